@@ -5,8 +5,16 @@ from typing import List, Dict, Tuple, Optional
 from dataclasses import dataclass
 import random
 
+from squad_optimizer import solve_squad
+
 LOG = logging.getLogger("ai_team_builder")
 
+# Selectable optimisation engines for build_optimal_team
+ENGINE_GA = "ga"
+ENGINE_GA_NUMPY = "ga_numpy"
+ENGINE_EXACT = "exact"
+ENGINES = (ENGINE_GA, ENGINE_GA_NUMPY, ENGINE_EXACT)
+
 @dataclass
 class Player:
     """Player data class"""
@@ -33,9 +41,12 @@ class Player:
 class AITeamBuilder:
     """AI-powered team builder with multi-objective optimization"""
     
-    def __init__(self, players: List[Player], budget: int):
+    def __init__(self, players: List[Player], budget: int, engine: str = ENGINE_GA,
+                 seed: Optional[int] = None):
         self.players = players
         self.budget = budget
+        self.engine = engine
+        self.seed = seed
         self.population_size = 100
         self.generations = 50
         self.mutation_rate = 0.15
@@ -43,14 +54,16 @@ class AITeamBuilder:
     def build_optimal_team(
         self, 
         formation: Dict[str, int],
-        objectives: Dict[str, float] = None
+        objectives: Dict[str, float] = None,
+        engine: Optional[str] = None
     ) -> Dict:
         """
-        Build optimal team using genetic algorithm
+        Build optimal team using the selected engine (genetic algorithm by default)
         
         Args:
             formation: {'P': 1, 'D': 4, 'C': 4, 'A': 2} or string like "3-5-2"
             objectives: {'performance': 0.5, 'value': 0.3, 'reliability': 0.2}
+            engine: 'ga', 'ga_numpy' or 'exact' (defaults to the builder's engine)
         """
         if objectives is None:
             objectives = {'performance': 0.5, 'value': 0.3, 'reliability': 0.2}
@@ -69,7 +82,19 @@ class AITeamBuilder:
                 LOG.error(f"Invalid formation string: {formation}")
                 formation = {'P': 1, 'D': 4, 'C': 4, 'A': 2}  # Default
         
-        LOG.info(f"Building team with formation {formation}, budget {self.budget}")
+        engine = engine or self.engine
+        LOG.info(f"Building team with formation {formation}, budget {self.budget}, engine {engine}")
+        
+        if engine == ENGINE_EXACT:
+            result = self._build_exact(formation, objectives)
+            if result is not None:
+                return result
+            LOG.warning("Exact optimizer found no feasible team, falling back to GA")
+        elif engine == ENGINE_GA_NUMPY:
+            result = self._build_ga_numpy(formation, objectives)
+            if result is not None:
+                return result
+            LOG.warning("Vectorized GA could not build a population, falling back to GA")
         
         # Initialize population
         population = self._initialize_population(formation)
@@ -93,6 +118,165 @@ class AITeamBuilder:
         
         return self._format_team_result(best_team, best_score, objectives)
     
+    def _build_exact(self, formation: Dict[str, int], objectives: Dict[str, float]) -> Optional[Dict]:
+        """Solve the team selection exactly (see squad_optimizer).
+
+        For a fixed squad size the fitness is linear in the players, apart from
+        the diversity bonus on the largest club count; solving once per club
+        cap (3, 2, 1) and keeping the best fitness makes the result exact.
+        """
+        size = sum(formation.values())
+        if size <= 0 or self.budget <= 0:
+            return None
+        
+        # One entry per player name (first occurrence wins, as in the GA)
+        seen = set()
+        pool = []
+        for p in self.players:
+            if p.name not in seen and p.role in formation:
+                seen.add(p.name)
+                pool.append(p)
+        
+        w_perf = objectives.get('performance', 0.5)
+        w_value = objectives.get('value', 0.3)
+        w_rel = objectives.get('reliability', 0.2)
+        scores = [
+            (w_perf * p.fantamedia + w_value * p.value_score * 10 + w_rel * p.reliability_score * 50) / size
+            + 5 * p.price / self.budget
+            for p in pool
+        ]
+        
+        best_team, best_score = None, -float('inf')
+        for cap in (3, 2, 1):
+            # Diversity bonus is (4 - max_per_team) * 2: only search for squads that
+            # can still beat the best fitness found with a looser cap
+            solution = solve_squad(
+                [p.role for p in pool], [p.price for p in pool], scores, [p.team for p in pool],
+                formation, int(self.budget), max_per_team=cap,
+                min_score=best_score - (4 - cap) * 2 if best_team is not None else None
+            )
+            if solution is None:
+                continue
+            team = [pool[i] for i in solution.indices]
+            score = self._fitness(team, objectives)
+            LOG.debug(f"Exact cap={cap}: fitness {score:.2f} ({solution.nodes} nodes, optimal={solution.optimal})")
+            if score > best_score:
+                best_team, best_score = team, score
+        
+        if best_team is None:
+            return None
+        order = {'P': 0, 'D': 1, 'C': 2, 'A': 3}
+        best_team.sort(key=lambda p: (order.get(p.role, 4), -p.fantamedia))
+        return self._format_team_result(best_team, best_score, objectives)
+    
+    def _build_ga_numpy(self, formation: Dict[str, int], objectives: Dict[str, float]) -> Optional[Dict]:
+        """Same GA as build_optimal_team, run on the whole population at once.
+
+        Individuals are rows of an integer matrix; column j holds an index into
+        the candidate block of the role owning slot j, so crossover and mutation
+        never break the formation.  Fitness mirrors _fitness.
+        """
+        rng = np.random.default_rng(self.seed)
+        slot_roles = [role for role, count in formation.items() for _ in range(count)]
+        n_slots = len(slot_roles)
+        if n_slots == 0:
+            return None
+        
+        # Player columns (one block of candidates per role)
+        blocks, offsets, sizes = [], {}, {}
+        for role in formation:
+            role_players = [p for p in self.players if p.role == role]
+            if len(role_players) < formation[role]:
+                return None
+            offsets[role], sizes[role] = sum(len(b) for b in blocks), len(role_players)
+            blocks.append(role_players)
+        pool = [p for b in blocks for p in b]
+        price = np.array([p.price for p in pool], dtype=np.float64)
+        fm = np.array([p.fantamedia for p in pool], dtype=np.float64)
+        value = np.array([p.value_score for p in pool], dtype=np.float64)
+        reliability = np.array([p.reliability_score for p in pool], dtype=np.float64)
+        names = {p.name: i for i, p in enumerate(pool)}
+        name_id = np.array([names[p.name] for p in pool], dtype=np.int64)  # duplicates share an id
+        team_index = {t: i for i, t in enumerate(sorted({p.team for p in pool}))}
+        team_id = np.array([team_index[p.team] for p in pool], dtype=np.int64)
+        n_teams = len(team_index)
+        
+        col_offset = np.array([offsets[r] for r in slot_roles], dtype=np.int64)
+        col_size = np.array([sizes[r] for r in slot_roles], dtype=np.int64)
+        
+        w_perf = objectives.get('performance', 0.5)
+        w_value = objectives.get('value', 0.3)
+        w_rel = objectives.get('reliability', 0.2)
+        
+        def random_genes(rows: int) -> np.ndarray:
+            return (rng.random((rows, n_slots)) * col_size).astype(np.int64)
+        
+        def has_duplicates(players: np.ndarray) -> np.ndarray:
+            ids = np.sort(name_id[players], axis=1)
+            return (ids[:, 1:] == ids[:, :-1]).any(axis=1)
+        
+        def fitness(genes: np.ndarray) -> np.ndarray:
+            players = genes + col_offset
+            cost = price[players].sum(axis=1)
+            counts = np.zeros((len(genes), n_teams), dtype=np.int64)
+            np.add.at(counts, (np.arange(len(genes))[:, None], team_id[players]), 1)
+            max_per_team = counts.max(axis=1)
+            
+            score = (
+                w_perf * fm[players].mean(axis=1) +
+                w_value * value[players].mean(axis=1) * 10 +
+                w_rel * reliability[players].mean(axis=1) * 50 +
+                cost / self.budget * 5 +
+                (4 - max_per_team) * 2
+            )
+            score = np.where(max_per_team > 3, -500.0 - (max_per_team - 3) * 100, score)
+            return np.where((cost > self.budget) | has_duplicates(players), -1000.0, score)
+        
+        # Initial population: random squads, re-drawn (a few times) while over budget
+        population = random_genes(self.population_size)
+        for _ in range(20):
+            bad = (price[population + col_offset].sum(axis=1) > self.budget) | has_duplicates(population + col_offset)
+            if not bad.any():
+                break
+            population[bad] = random_genes(int(bad.sum()))
+        
+        elite_count = max(1, self.population_size // 10)
+        n_children = self.population_size - elite_count
+        rows = np.arange(n_children)
+        best_genes, best_score = None, -float('inf')
+        
+        for generation in range(self.generations):
+            scores = fitness(population)
+            top = int(scores.argmax())
+            if scores[top] > best_score:
+                best_score = float(scores[top])
+                best_genes = population[top].copy()
+                LOG.debug(f"Gen {generation}: Best score {best_score:.2f}")
+            
+            # Elitism + tournament selection (size 3)
+            elite = population[np.argsort(scores)[-elite_count:]]
+            tournaments = rng.integers(0, self.population_size, size=(2, n_children, 3))
+            winners = tournaments[np.arange(2)[:, None], rows[None, :], scores[tournaments].argmax(axis=2)]
+            parent1, parent2 = population[winners[0]], population[winners[1]]
+            
+            # Single-point crossover; children with duplicate players keep parent1
+            point = rng.integers(1, max(n_slots, 2), size=n_children)
+            children = np.where(np.arange(n_slots)[None, :] < point[:, None], parent1, parent2)
+            if n_slots > 1:
+                dup = has_duplicates(children + col_offset)
+                children[dup] = parent1[dup]
+            
+            # Mutation: replace one slot with a random player of the same role
+            mutate = rng.random(n_children) < self.mutation_rate
+            col = rng.integers(0, n_slots, size=n_children)
+            fresh = (rng.random(n_children) * col_size[col]).astype(np.int64)
+            children[rows[mutate], col[mutate]] = fresh[mutate]
+            
+            population = np.concatenate([elite, children])
+        
+        best_team = [pool[i] for i in best_genes + col_offset]
+        return self._format_team_result(best_team, self._fitness(best_team, objectives), objectives)
+    
     def _initialize_population(self, formation: Dict[str, int]) -> List[List[Player]]:
         """Create initial random population"""
         population = []
@@ -35,7 +35,10 @@ class Base(DeclarativeBase):
 # Initialize Flask app
 app = Flask(__name__, template_folder="templates", static_folder="static", static_url_path="/static")
 app.secret_key = os.environ.get("SESSION_SECRET")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1) # needed for url_for to generate with https
+# PROXY_FIX_X_FOR = number of trusted proxies in front of the app (0 = use the socket address):
+# request.remote_addr is then the client IP, taken from X-Forwarded-For only as far as they set it
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ.get("PROXY_FIX_X_FOR", "1")),
+                        x_proto=1, x_host=1) # needed for url_for to generate with https
 
 # Database configuration
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
@@ -59,7 +62,9 @@ db = SQLAlchemy(app, model_class=Base)
 # )
 
 # Initialize SocketIO for real-time functionality
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+# With SOCKETIO_MESSAGE_QUEUE (e.g. redis://redis:6379/0) room emits reach clients on every worker
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading',
+                    message_queue=os.environ.get("SOCKETIO_MESSAGE_QUEUE") or None)
 
 # Initialize LiveMatchTracker for real-time statistics
 from live_match_tracker import LiveMatchTracker
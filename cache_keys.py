@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Stable cache keys for ``@cached`` (cache_manager) and ``@cached_redis``.
+
+Arguments are bound to the function signature (so ``f(1)`` and ``f(x=1)``
+share a key, defaults included), ``self``/``cls`` are dropped, and the rest is
+serialized canonically (sorted dict keys, sorted sets, tuples as lists) and
+hashed with SHA-256.  The result is the same in every process and across
+restarts, unlike ``hash()`` or reprs that embed object addresses.
+
+Functions whose result depends on receiver state declare a key function with
+the same signature that returns the relevant key material, e.g.::
+
+    @cached(category='formations', key=lambda self, formation, budget: (self.data_version, formation, budget))
+
+Values that cannot be serialized raise :class:`UncacheableArgs`; the
+decorators then call the function without caching.
+"""
+import hashlib
+import inspect
+import json
+from dataclasses import asdict, is_dataclass
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+RECEIVER_NAMES = ("self", "cls")
+
+
+class UncacheableArgs(TypeError):
+    """Arguments have no canonical form (e.g. arbitrary objects)."""
+
+
+def canonical(obj: Any) -> Any:
+    """JSON-ready, order-independent representation of ``obj``."""
+    if obj is None or isinstance(obj, (bool, int, str)):
+        return obj
+    if isinstance(obj, float):
+        return obj if obj == obj and obj not in (float("inf"), float("-inf")) else repr(obj)
+    if isinstance(obj, dict):
+        items = [(canonical(k), canonical(v)) for k, v in obj.items()]
+        return {"__dict__": sorted(items, key=lambda kv: json.dumps(kv[0], sort_keys=True))}
+    if isinstance(obj, (list, tuple)):
+        return [canonical(x) for x in obj]
+    if isinstance(obj, (set, frozenset)):
+        return {"__set__": sorted((canonical(x) for x in obj), key=lambda x: json.dumps(x, sort_keys=True))}
+    if isinstance(obj, bytes):
+        return {"__bytes__": hashlib.sha256(obj).hexdigest()}
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if hasattr(obj, "__cache_key__"):
+        return canonical(obj.__cache_key__())
+    if is_dataclass(obj) and not isinstance(obj, type):
+        return canonical(asdict(obj))
+    if hasattr(obj, "item") and hasattr(obj, "dtype") and getattr(obj, "shape", None) == ():
+        return canonical(obj.item())  # numpy scalar
+    raise UncacheableArgs(f"no canonical form for {type(obj).__name__}")
+
+
+def digest(material: Any, length: int = 32) -> str:
+    payload = json.dumps(canonical(material), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:length]
+
+
+class KeyBuilder:
+    """Builds ``"<namespace>:<digest>"`` keys for one decorated function."""
+
+    def __init__(self, func: Callable, namespace: str, key: Optional[Callable] = None,
+                 ignore: Iterable[str] = ()):
+        self.namespace = namespace
+        self.key = key
+        self.ignore = set(ignore) | set(RECEIVER_NAMES)
+        try:
+            self.signature: Optional[inspect.Signature] = inspect.signature(func)
+        except (TypeError, ValueError):
+            self.signature = None
+
+    def material(self, args: Tuple, kwargs: Dict[str, Any]) -> Any:
+        if self.key is not None:
+            return self.key(*args, **kwargs)
+        if self.signature is None:
+            return [list(args), kwargs]
+        bound = self.signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return {name: value for name, value in bound.arguments.items() if name not in self.ignore}
+
+    def __call__(self, args: Tuple, kwargs: Dict[str, Any]) -> str:
+        return f"{self.namespace}:{digest(self.material(args, kwargs))}"
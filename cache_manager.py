@@ -1,35 +1,121 @@
-import os
 import json
 import time
 import hashlib
 import logging
-from typing import Any, Dict, Optional, List
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, List, Set, Tuple
 from functools import wraps
-import sqlite3
-from datetime import datetime, timedelta
+from itertools import islice
+from datetime import datetime
 import sys # Added for sys.getsizeof
 
+from cache_keys import KeyBuilder, UncacheableArgs
+from config import CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_CATEGORY_LIMITS, CACHE_SWEEP_INTERVAL
+
 LOG = logging.getLogger("cache_manager")
 
+_SIZE_SAMPLE = 64
+
+# Per-category (max entries, max bytes); CACHE_CATEGORY_LIMITS overrides these
+DEFAULT_CATEGORY_LIMITS: Dict[str, Tuple[int, int]] = {
+    'player_data': (2000, 16 * 1024 * 1024),
+    'formations': (500, 16 * 1024 * 1024),
+    'search_results': (1000, 8 * 1024 * 1024),
+    'km_queries': (1000, 8 * 1024 * 1024),
+}
+
+
+def _parse_category_limits(spec: str) -> Dict[str, Tuple[int, int]]:
+    """Parse ``"formations:500:16777216,km_queries:1000:8388608"``."""
+    out = {}
+    for part in (spec or "").split(","):
+        bits = [b.strip() for b in part.split(":")]
+        if len(bits) != 3 or not bits[0]:
+            continue
+        try:
+            out[bits[0]] = (int(bits[1]), int(bits[2]))
+        except ValueError:
+            LOG.warning("[Cache] invalid category limit %r ignored", part)
+    return out
+
+
+def _sizeof(obj: Any, depth: int = 4) -> int:
+    """Approximate deep size in bytes; large containers are sampled."""
+    size = sys.getsizeof(obj)
+    if depth <= 0:
+        return size
+    if isinstance(obj, dict):
+        sample = list(islice(obj.items(), _SIZE_SAMPLE))
+        part = sum(_sizeof(k, depth - 1) + _sizeof(v, depth - 1) for k, v in sample)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        sample = list(islice(obj, _SIZE_SAMPLE))
+        part = sum(_sizeof(x, depth - 1) for x in sample)
+    else:
+        return size
+    if not sample:
+        return size
+    return size + part * len(obj) // len(sample)
+
+
+class _Entry:
+    __slots__ = ('value', 'expires_at', 'category', 'size')
+
+    def __init__(self, value: Any, expires_at: float, category: str, size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.category = category
+        self.size = size
+
+
+class _Segment:
+    """LRU order and size accounting for one category."""
+    __slots__ = ('keys', 'bytes', 'max_entries', 'max_bytes')
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.keys: "OrderedDict[str, None]" = OrderedDict()
+        self.bytes = 0
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+
 class CacheManager:
-    """Comprehensive caching system for Fantasy Football Assistant"""
+    """Bounded in-process LRU cache for Fantasy Football Assistant.
+
+    Entries live in one LRU-ordered dict with a segment per category; both the
+    global and the per-category entry/byte limits are enforced on ``set`` by
+    evicting least recently used entries.  Expired entries are dropped lazily
+    on read and by a periodic sweep piggybacked on writes.  Tags are kept in a
+    separate index and cleaned up on eviction.
+    """
 
-    def __init__(self, cache_dir: str = "./cache"):
-        # The original code used SQLite, but the provided changes imply an in-memory cache.
-        # We will proceed with the in-memory cache implementation as per the changes.
+    def __init__(self, cache_dir: str = "./cache", max_entries: int = CACHE_MAX_ENTRIES,
+                 max_bytes: int = CACHE_MAX_BYTES,
+                 category_limits: Optional[Dict[str, Tuple[int, int]]] = None,
+                 sweep_interval: float = CACHE_SWEEP_INTERVAL):
         self.cache_dir = cache_dir # This might be vestigial if not used by the new methods
-        # os.makedirs(cache_dir, exist_ok=True) # Not needed for in-memory cache
-        # self.db_path = os.path.join(cache_dir, "cache.db") # Not needed for in-memory cache
-        # self._init_db() # Not needed for in-memory cache
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.category_limits = dict(DEFAULT_CATEGORY_LIMITS)
+        self.category_limits.update(_parse_category_limits(CACHE_CATEGORY_LIMITS))
+        self.category_limits.update(category_limits or {})
+        self.sweep_interval = sweep_interval
 
-        self.cache: Dict[str, Dict[str, Any]] = {} # In-memory cache
+        self.cache: "OrderedDict[str, _Entry]" = OrderedDict() # In-memory cache, LRU first
+        self._segments: Dict[str, _Segment] = {}
+        self._bytes = 0
+        self._tags: Dict[str, Set[str]] = {}
+        self._key_tags: Dict[str, Set[str]] = {}
+        self._lock = threading.RLock()
+        self._next_sweep = time.monotonic() + sweep_interval
         self.stats = {
             'hits': 0,
             'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'rejected': 0,
             'start_time': datetime.now()
         }
-        # Cache configuration - these TTLs might be used by set, but the original changes don't show how they're integrated.
-        # For now, we'll keep them but they aren't directly used in the provided 'set' or 'get' implementations.
         self.cache_ttl = {
             'player_data': 3600,      # 1 hour
             'formations': 1800,       # 30 minutes
@@ -40,33 +126,73 @@ class CacheManager:
             'default': 1800          # 30 minutes
         }
 
-    # The following methods are replacements based on the provided <changes> snippet.
-    # They replace the original SQLite-based methods.
-
     def _make_key(self, prefix: str, *args, **kwargs) -> str:
         """Create cache key from arguments"""
         key_data = f"{prefix}:{':'.join(map(str, args))}:{json.dumps(kwargs, sort_keys=True)}"
         return hashlib.sha256(key_data.encode()).hexdigest()[:32]
 
-    def get(self, key: str) -> Any:
-        """Get a value from cache with hit/miss tracking"""
-        if key not in self.cache:
-            self.stats['misses'] = self.stats.get('misses', 0) + 1
+    # ---------- internals (call with the lock held) ----------
+    def _segment(self, category: str) -> _Segment:
+        seg = self._segments.get(category)
+        if seg is None:
+            max_entries, max_bytes = self.category_limits.get(category, (self.max_entries, self.max_bytes))
+            seg = _Segment(min(max_entries, self.max_entries), min(max_bytes, self.max_bytes))
+            self._segments[category] = seg
+        return seg
+
+    def _remove(self, key: str) -> Optional[_Entry]:
+        entry = self.cache.pop(key, None)
+        if entry is None:
             return None
+        seg = self._segments[entry.category]
+        seg.keys.pop(key, None)
+        seg.bytes -= entry.size
+        self._bytes -= entry.size
+        for tag in self._key_tags.pop(key, ()):
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+        return entry
 
-        entry = self.cache[key]
+    def _evict(self, seg: _Segment) -> None:
+        while seg.keys and (len(seg.keys) > seg.max_entries or seg.bytes > seg.max_bytes):
+            self._remove(next(iter(seg.keys)))
+            self.stats['evictions'] += 1
+        while self.cache and (len(self.cache) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self.cache)))
+            self.stats['evictions'] += 1
 
-        # Check if expired
-        if datetime.now() > entry['expires_at']:
-            del self.cache[key]
-            self.stats['misses'] = self.stats.get('misses', 0) + 1
-            return None
+    def _maybe_sweep(self, now: float) -> None:
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            self._sweep(now)
+
+    def _sweep(self, now: float) -> int:
+        expired = [k for k, e in self.cache.items() if e.expires_at <= now]
+        for key in expired:
+            self._remove(key)
+        self.stats['expirations'] += len(expired)
+        return len(expired)
 
-        # Update access time for LRU (This part of the original changes was slightly different, assuming simple LRU for now)
-        # The provided snippet did not include an explicit LRU eviction policy, just access time update.
-        entry['accessed_at'] = datetime.now()
-        self.stats['hits'] = self.stats.get('hits', 0) + 1
-        return entry['value']
+    # ---------- public API ----------
+    def get(self, key: str) -> Any:
+        """Get a value from cache with hit/miss tracking"""
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            if time.monotonic() >= entry.expires_at:
+                self._remove(key)
+                self.stats['expirations'] += 1
+                self.stats['misses'] += 1
+                return None
+            self.cache.move_to_end(key)
+            self._segments[entry.category].keys.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry.value
 
     def get_multi(self, keys: List[str]) -> Dict[str, Any]:
         """Get multiple values from cache efficiently"""
@@ -80,110 +206,128 @@ class CacheManager:
     def set(self, key: str, value: Any, category: str = 'default', ttl: Optional[int] = None) -> bool:
         """Set cached value with category and optional TTL"""
         if ttl is None:
-            # Using the category TTLs, though the original provided changes for set didn't explicitly use 'category'
-            # Assuming category is meant to influence TTL here.
             ttl = self.cache_ttl.get(category, self.cache_ttl['default'])
+        size = sys.getsizeof(key) + _sizeof(value)
+        now = time.monotonic()
+        with self._lock:
+            self._maybe_sweep(now)
+            seg = self._segment(category)
+            self._remove(key)
+            if size > seg.max_bytes:
+                self.stats['rejected'] += 1
+                LOG.debug("[Cache] %s entry of %d bytes exceeds category limit", category, size)
+                return False
+            self.cache[key] = _Entry(value, now + ttl, category, size)
+            seg.keys[key] = None
+            seg.bytes += size
+            self._bytes += size
+            self._evict(seg)
+            return key in self.cache
 
-        expires_at = datetime.now() + timedelta(seconds=ttl)
-        self.cache[key] = {
-            'value': value,
-            'expires_at': expires_at,
-            'accessed_at': datetime.now(),
-            'category': category # Keeping category info if needed later
-        }
-        return True
+    def delete(self, key: str) -> bool:
+        """Remove a single entry"""
+        with self._lock:
+            return self._remove(key) is not None
 
     def set_with_tags(self, key: str, value: Any, ttl: int = 3600, tags: List[str] = None):
         """Set cache with tags for bulk invalidation"""
-        # The original 'set' method is used here as a base.
-        # The 'category' parameter from the original 'set' is not used in this new method signature.
-        # We will use the provided ttl and tags.
-        self.set(key, value, category='tagged', ttl=ttl) # Using 'tagged' as a default category for tagged items
-
-        if tags:
-            if 'tag_index' not in self.cache:
-                self.cache['tag_index'] = {}
-            for tag in tags:
-                if tag not in self.cache['tag_index']:
-                    self.cache['tag_index'][tag] = set()
-                self.cache['tag_index'][tag].add(key)
+        with self._lock:
+            if not self.set(key, value, category='tagged', ttl=ttl):
+                return
+            if tags:
+                self._key_tags[key] = set(tags)
+                for tag in tags:
+                    self._tags.setdefault(tag, set()).add(key)
 
     def invalidate_by_tag(self, tag: str) -> int:
         """Invalidate all cache entries with a specific tag"""
-        if 'tag_index' not in self.cache or tag not in self.cache['tag_index']:
-            return 0
-
-        keys_to_remove = list(self.cache['tag_index'][tag])
-        count = 0
+        with self._lock:
+            keys = list(self._tags.get(tag, ()))
+            count = sum(1 for key in keys if self._remove(key) is not None)
+            self._tags.pop(tag, None)
+            return count
 
-        for key in keys_to_remove:
-            if key in self.cache:
-                del self.cache[key]
-                count += 1
+    def invalidate_category(self, category: str) -> int:
+        """Drop every entry of a category"""
+        with self._lock:
+            seg = self._segments.get(category)
+            keys = list(seg.keys) if seg else []
+            for key in keys:
+                self._remove(key)
+            return len(keys)
 
-        # Clean up tag index
-        del self.cache['tag_index'][tag]
-        return count
+    def cleanup_expired(self) -> int:
+        """Drop all expired entries now; returns how many were removed"""
+        with self._lock:
+            return self._sweep(time.monotonic())
 
-    # The following methods are from the original SQLiteCacheManager, but are not present in the provided changes.
-    # Therefore, they are omitted as per the instructions to only include modifications from the changes snippet.
-    # def _init_db(self): ...
-    # def invalidate_category(self, category: str) -> int: ...
-    # def cleanup_expired(self) -> int: ...
-    # def get_stats(self) -> Dict[str, Any]: ...
+    def clear(self) -> None:
+        with self._lock:
+            self.cache.clear()
+            self._segments.clear()
+            self._tags.clear()
+            self._key_tags.clear()
+            self._bytes = 0
 
-    # New methods from the changes snippet:
     def get_cache_stats(self) -> Dict:
         """Get detailed cache statistics"""
-        hits = self.stats.get('hits', 0)
-        misses = self.stats.get('misses', 0)
-        total = hits + misses
-
-        # Filter out internal cache keys like 'tag_index'
-        active_keys_count = len([k for k in self.cache.keys() if k != 'tag_index' and not (k.startswith('func_') and k.endswith('_tag_index'))]) # Added check for potential decorator keys
-
-        return {
-            'hits': hits,
-            'misses': misses,
-            'hit_rate': hits / total if total > 0 else 0,
-            'total_keys': active_keys_count,
-            'memory_usage': self.get_memory_usage(),
-            'uptime': (datetime.now() - self.stats.get('start_time', datetime.now())).total_seconds()
-        }
+        with self._lock:
+            hits = self.stats['hits']
+            misses = self.stats['misses']
+            total = hits + misses
+            return {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / total if total > 0 else 0,
+                'evictions': self.stats['evictions'],
+                'expirations': self.stats['expirations'],
+                'rejected': self.stats['rejected'],
+                'total_keys': len(self.cache),
+                'memory_usage': self._bytes,
+                'categories': {name: {'entries': len(seg.keys), 'bytes': seg.bytes,
+                                      'max_entries': seg.max_entries, 'max_bytes': seg.max_bytes}
+                               for name, seg in self._segments.items()},
+                'tags': len(self._tags),
+                'uptime': (datetime.now() - self.stats['start_time']).total_seconds()
+            }
 
     def get_memory_usage(self) -> int:
-        """Estimate memory usage of cache"""
-        total_size = 0
-        # Iterate over actual cache entries, not internal structures like tag_index
-        for key, value_entry in self.cache.items():
-            if key != 'tag_index': # Exclude the tag_index itself
-                total_size += sys.getsizeof(key)
-                # Estimate size of the value entry dictionary
-                for sub_key, sub_value in value_entry.items():
-                    total_size += sys.getsizeof(sub_key)
-                    total_size += sys.getsizeof(sub_value)
-        return total_size
+        """Estimate memory usage of cache (bytes accounted at insertion)"""
+        return self._bytes
 
 # Global cache instance
 _cache_manager = None
+_cache_manager_lock = threading.Lock()
 
 def get_cache_manager() -> CacheManager:
     """Get global cache manager instance"""
     global _cache_manager
     if _cache_manager is None:
-        # Initialize with the new CacheManager that uses in-memory cache
-        _cache_manager = CacheManager()
+        with _cache_manager_lock:
+            if _cache_manager is None:
+                _cache_manager = CacheManager()
     return _cache_manager
 
-def cached(category: str = 'default', ttl: Optional[int] = None):
-    """Decorator for caching function results"""
+def cached(category: str = 'default', ttl: Optional[int] = None, key: Optional[Callable] = None,
+           ignore: Iterable[str] = ()):
+    """Decorator for caching function results.
+
+    Keys come from :mod:`cache_keys`: ``self``/``cls`` and ``ignore`` are left
+    out; pass ``key`` (same signature as the function) when the result depends
+    on receiver state.
+    """
     def decorator(func):
+        build_key = KeyBuilder(func, f"func_{func.__qualname__}", key, ignore)
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            cache = get_cache_manager()
-            # The _make_key method is still relevant for creating cache keys for function results.
-            cache_key = cache._make_key(f"func_{func.__name__}", *args, **kwargs)
+            try:
+                cache_key = build_key(args, kwargs)
+            except UncacheableArgs as e:
+                LOG.debug("[Cache] %s not cached: %s", func.__qualname__, e)
+                return func(*args, **kwargs)
 
+            cache = get_cache_manager()
             # Try to get from cache
             result = cache.get(cache_key)
             if result is not None:
@@ -191,8 +335,8 @@ def cached(category: str = 'default', ttl: Optional[int] = None):
 
             # Execute function and cache result
             result = func(*args, **kwargs)
-            # Using the set method which now handles the in-memory storage.
             cache.set(cache_key, result, category, ttl)
             return result
+        wrapper.cache_key = build_key
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
@@ -3,9 +3,11 @@ import os
 import json
 import logging
 import functools
-from typing import Any, Optional, Callable
+from typing import Any, Optional, Callable, Iterable
 from datetime import timedelta
 
+from cache_keys import KeyBuilder, UncacheableArgs
+
 try:
     import redis
     REDIS_AVAILABLE = True
@@ -132,12 +134,16 @@ def get_redis_cache() -> RedisCache:
         _redis_cache = RedisCache()
     return _redis_cache
 
-def cached_redis(ttl: int = 300, key_prefix: str = ""):
+def cached_redis(ttl: int = 300, key_prefix: str = "", key: Optional[Callable] = None,
+                 ignore: Iterable[str] = ()):
     """Decorator for caching function results in Redis
     
     Args:
-        ttl: Time to live in seconds (default 5 minutes)
+        ttl: Time to live in seconds (default 5 minutes); 0 disables caching
         key_prefix: Prefix for cache key
+        key: Optional key function (same signature as the function) returning
+            the key material; by default all arguments except ``self``/``cls``
+        ignore: Argument names left out of the default key
     
     Usage:
         @cached_redis(ttl=600, key_prefix="roster")
@@ -145,21 +151,23 @@ def cached_redis(ttl: int = 300, key_prefix: str = ""):
             return expensive_operation()
     """
     def decorator(func: Callable) -> Callable:
+        namespace = key_prefix or func.__qualname__
+        build_key = KeyBuilder(func, namespace, key, ignore)
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             cache = get_redis_cache()
             
-            if not cache.enabled:
+            if not cache.enabled or ttl <= 0:
                 # Cache disabled, call function directly
                 return func(*args, **kwargs)
             
-            # Create cache key from function name and arguments
-            key_parts = [key_prefix or func.__name__]
-            if args:
-                key_parts.append(str(hash(str(args))))
-            if kwargs:
-                key_parts.append(str(hash(str(sorted(kwargs.items())))))
-            cache_key = ":".join(key_parts)
+            # Stable across workers and restarts (see cache_keys)
+            try:
+                cache_key = build_key(args, kwargs)
+            except UncacheableArgs as e:
+                LOG.debug(f"Cache BYPASS for {namespace}: {e}")
+                return func(*args, **kwargs)
             
             # Try to get from cache
             cached_value = cache.get(cache_key)
@@ -172,7 +180,8 @@ def cached_redis(ttl: int = 300, key_prefix: str = ""):
             return result
         
         # Add cache management methods
-        wrapper.clear_cache = lambda: get_redis_cache().clear_pattern(f"{key_prefix or func.__name__}:*")
+        wrapper.clear_cache = lambda: get_redis_cache().clear_pattern(f"{namespace}:*")
+        wrapper.cache_key = build_key
         return wrapper
     
     return decorator
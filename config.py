@@ -59,3 +59,76 @@ OPENAI_API_KEY     = env_str("OPENAI_API_KEY", "")
 OPENAI_MODEL       = env_str("OPENAI_MODEL", "gpt-4o-mini")
 OPENAI_TEMPERATURE = float(env_str("OPENAI_TEMPERATURE", "0.20"))
 OPENAI_MAX_TOKENS  = env_int("OPENAI_MAX_TOKENS", 600)
+OPENAI_BASE_URL    = env_str("OPENAI_BASE_URL", "https://api.openai.com/v1")
+
+# Pool HTTP condiviso per il client LLM (llm_client.py)
+LLM_TIMEOUT         = float(env_str("LLM_TIMEOUT", "60"))
+LLM_MAX_CONNECTIONS = env_int("LLM_MAX_CONNECTIONS", 20)
+LLM_MAX_KEEPALIVE   = env_int("LLM_MAX_KEEPALIVE", 10)
+LLM_MAX_CONCURRENCY = env_int("LLM_MAX_CONCURRENCY", 8)
+
+# Motore per la costruzione della formazione: "greedy" oppure "exact" (squad_optimizer)
+FORMATION_ENGINE   = env_str("FORMATION_ENGINE", "greedy")
+
+# Cache in-process (cache_manager.py): limiti globali, per categoria "nome:voci:byte,..." e sweep TTL
+CACHE_MAX_ENTRIES     = env_int("CACHE_MAX_ENTRIES", 5000)
+CACHE_MAX_BYTES       = env_int("CACHE_MAX_BYTES", 64 * 1024 * 1024)
+CACHE_CATEGORY_LIMITS = env_str("CACHE_CATEGORY_LIMITS", "")
+CACHE_SWEEP_INTERVAL  = env_int("CACHE_SWEEP_INTERVAL", 60)
+
+# Refresh del roster in background (roster_refresh.py): intervallo di controllo, sorgenti dell'ETL, lock del leader
+ROSTER_REFRESH_ENABLED  = env_bool("ROSTER_REFRESH_ENABLED", True)
+ROSTER_REFRESH_INTERVAL = env_int("ROSTER_REFRESH_INTERVAL", 300)
+ROSTER_REFRESH_SOURCES  = env_str("ROSTER_REFRESH_SOURCES", env_str("CHROMA_DB_PATH", "./chroma_db"))
+ROSTER_REFRESH_LOCK     = env_str("ROSTER_REFRESH_LOCK", "./cache/roster_refresh.lock")
+
+# Indice BM25 persistente (retrieval/hybrid.py): cartella su disco e soglia del delta log prima della compattazione
+BM25_INDEX_PATH      = env_str("BM25_INDEX_PATH", "./cache/bm25")
+BM25_COMPACT_EVERY   = env_int("BM25_COMPACT_EVERY", 5000)
+
+# KnowledgeManager: documenti per insert Chroma in add_knowledge_batch e batch size dell'encoder
+KM_ADD_CHUNK_SIZE    = env_int("KM_ADD_CHUNK_SIZE", 256)
+KM_ENCODE_BATCH_SIZE = env_int("KM_ENCODE_BATCH_SIZE", 64)
+KM_EMBED_MODEL       = env_str("KM_EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# Carica il modello di embedding e fa un encode di prova all'avvio (in background)
+MODEL_WARMUP         = env_bool("MODEL_WARMUP", False)
+
+# Rerank cross-encoder (retrieval.reranker): candidati massimi, batch, budget di latenza e cache punteggi, retry dopo errore
+RERANK_ENABLED        = env_bool("RERANK_ENABLED", True)
+RERANK_MODEL          = env_str("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_MAX_CANDIDATES = env_int("RERANK_MAX_CANDIDATES", 30)
+RERANK_BATCH_SIZE     = env_int("RERANK_BATCH_SIZE", 16)
+RERANK_BUDGET_MS      = env_int("RERANK_BUDGET_MS", 300)
+RERANK_CACHE_SIZE     = env_int("RERANK_CACHE_SIZE", 20000)
+RERANK_RETRY_S        = env_int("RERANK_RETRY_S", 60)  # attesa minima prima di ricaricare un modello fallito
+
+# RAG: boost RRF per i documenti della stagione richiesta (>= 1.0 = sempre prima degli altri)
+RAG_SEASON_BOOST      = float(env_str("RAG_SEASON_BOOST", "1.0"))
+
+# Cache risposte dell'assistente (query_cache): backend auto|redis|sqlite, TTL per intent (0 = non cacheare)
+RESPONSE_CACHE_ENABLED    = env_bool("RESPONSE_CACHE_ENABLED", True)
+RESPONSE_CACHE_BACKEND    = env_str("RESPONSE_CACHE_BACKEND", "auto")
+RESPONSE_CACHE_PATH       = env_str("RESPONSE_CACHE_PATH", "./cache/llm_responses.sqlite")
+RESPONSE_CACHE_TTLS       = env_str("RESPONSE_CACHE_TTLS", "")  # "generic:7200,transfers:3600"
+RESPONSE_CACHE_SEMANTIC_INTENTS = env_str("RESPONSE_CACHE_SEMANTIC_INTENTS", "generic,advice,season_info")
+RESPONSE_CACHE_SIMILARITY = float(env_str("RESPONSE_CACHE_SIMILARITY", "0.95"))
+RESPONSE_CACHE_MAX_VECTORS = env_int("RESPONSE_CACHE_MAX_VECTORS", 2000)
+
+# Stato chat lato server (session_store): memory | sqlite | redis, scadenza e limiti di dimensione
+STATE_BACKEND             = env_str("STATE_BACKEND", "sqlite")
+STATE_DB_PATH             = env_str("STATE_DB_PATH", "./cache/chat_state.sqlite")
+STATE_TTL                 = env_int("STATE_TTL", 7 * 24 * 3600)
+STATE_MAX_BYTES           = env_int("STATE_MAX_BYTES", 64 * 1024)
+STATE_MAX_HISTORY         = env_int("STATE_MAX_HISTORY", 20)
+STATE_MEMORY_MAX_SESSIONS = env_int("STATE_MEMORY_MAX_SESSIONS", 10000)
+
+# Rate limiting (rate_limiter): auto = solo in deploy | on | off; backend auto = Redis se disponibile
+RATE_LIMIT_MODE     = env_str("RATE_LIMIT_MODE", "auto")
+RATE_LIMIT_BACKEND  = env_str("RATE_LIMIT_BACKEND", "auto")
+RATE_LIMIT_MAX_KEYS = env_int("RATE_LIMIT_MAX_KEYS", 50000)
+
+# Chat di lega (league_chat): dimensione pagina dello storico e massimo per richiesta
+LEAGUE_CHAT_PAGE_SIZE     = env_int("LEAGUE_CHAT_PAGE_SIZE", 50)
+LEAGUE_CHAT_MAX_PAGE_SIZE = env_int("LEAGUE_CHAT_MAX_PAGE_SIZE", 200)
+# Presenza in chat per connessione (sid): scade senza heartbeat entro questi secondi
+LEAGUE_CHAT_PRESENCE_TTL  = env_int("LEAGUE_CHAT_PRESENCE_TTL", 90)
@@ -3,12 +3,39 @@ import logging
 import re
 import sqlite3
 import os
+import threading
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, FrozenSet, List, Optional, Any, Tuple
+
+from text_rewriter import TeamCorrectionRewriter
 
 logger = logging.getLogger(__name__)
 LOG = logger # Alias for consistency with provided snippet
 
+PLAYER_STATUS_DB_PATH = "fantacalcio.db"
+
+
+@dataclass(frozen=True)
+class CorrectionsSnapshot:
+    """Read-only view of every correction/exclusion, loaded in one pass."""
+    version: int = 0
+    corrected_names: Dict[str, str] = field(default_factory=dict)        # exact name -> new name
+    corrected_teams: Dict[str, str] = field(default_factory=dict)        # lower(name) -> new team
+    excluded_by_team: Dict[str, FrozenSet[str]] = field(default_factory=dict)  # lower(team) -> names
+    excluded_all: FrozenSet[str] = frozenset()                            # every team-specific exclusion
+    removed: FrozenSet[str] = frozenset()                                 # REMOVE corrections (global)
+    player_status: Dict[str, str] = field(default_factory=dict)          # canonical_key -> status
+    corrections: Tuple[tuple, ...] = ()                                   # raw persistent rows, newest first
+
+    def corrected_team(self, player_name: str) -> Optional[str]:
+        return self.corrected_teams.get((player_name or "").lower())
+
+    def excluded(self, team: Optional[str] = None) -> FrozenSet[str]:
+        if team:
+            return self.excluded_by_team.get(team.lower(), frozenset()) | self.removed
+        return self.excluded_all | self.removed
+
 class CorrectionsManager:
     """Enhanced corrections manager with better retrieval and application"""
 
@@ -16,10 +43,17 @@ class CorrectionsManager:
         self.knowledge_manager = knowledge_manager
         self._correction_cache = {}  # Cache for faster lookups
         self.db_path = "corrections.db"
+        self.status_db_path = PLAYER_STATUS_DB_PATH
         self._init_db()
         self.current_season = "2024-25"
         # Don't store persistent connections - create per-thread connections instead
         self.conn = None
+        # Versioned in-memory snapshot (reloaded on local writes or db file changes)
+        self._snapshot_lock = threading.Lock()
+        self._snapshot: Optional[CorrectionsSnapshot] = None
+        self._snapshot_key: Optional[tuple] = None
+        self._write_version = 0
+        self._text_rewriter: Optional[Tuple[int, TeamCorrectionRewriter]] = None
 
 
     def add_correction(self, correction_type: str, incorrect_info: str,
@@ -128,99 +162,46 @@ class CorrectionsManager:
             logger.error(f"Failed to get relevant corrections: {e}")
             return []
 
+    def _team_rewriter(self) -> TeamCorrectionRewriter:
+        """Compiled "Player (Team)" rewriter, rebuilt only when the snapshot changes."""
+        snap = self.snapshot()
+        cached = self._text_rewriter
+        if cached is not None and cached[0] == snap.version:
+            return cached[1]
+
+        rules: Dict[str, str] = {}
+        for correction in snap.corrections:
+            # (id, player_name, correction_type, old_value, new_value, ...)
+            wrong = str(correction[3]).strip() if correction[3] else ""
+            correct = str(correction[4]).strip() if correction[4] else ""
+            if not (wrong and correct):
+                continue
+            player_match = re.search(r'^(\w+(?:\s+\w+)*)\s+team:', wrong)
+            new_team_match = re.search(r'team:\s*(.+?)(?:\s*->|\s*$)', correct)
+            if not (player_match and new_team_match
+                    and re.search(r'team:\s*(.+?)(?:\s*->|\s*$)', wrong)):
+                continue
+            new_team = new_team_match.group(1).strip()
+            if new_team in ["trasferito", "nuovo club", "nuovo team"]:
+                new_team = "nuovo club"
+            rules.setdefault(player_match.group(1).strip(), new_team)
+
+        rewriter = TeamCorrectionRewriter(rules)
+        self._text_rewriter = (snap.version, rewriter)
+        logger.debug(f"Built text rewriter v{snap.version} with {len(rewriter)} team corrections")
+        return rewriter
+
     def apply_corrections_to_text(self, text: str) -> Tuple[str, List[str]]:
         """Apply stored corrections to text"""
         if not text:
             return text, []
 
-        corrections = self.get_corrections()
-        if not corrections:
+        try:
+            return self._team_rewriter().rewrite(text)
+        except Exception as e:
+            logger.error(f"Error applying corrections to text: {e}")
             return text, []
 
-        corrected_text = text
-        applied_corrections = []
-
-        for correction in corrections:
-            try:
-                # Handle both dict and tuple formats
-                if isinstance(correction, dict):
-                    wrong = correction.get("wrong", "")
-                    correct = correction.get("correct", "")
-                    context = correction.get("context", "")
-                elif isinstance(correction, (list, tuple)) and len(correction) >= 5:
-                    # Handle tuple format: (id, player_name, correction_type, old_value, new_value, ...)
-                    wrong = str(correction[3]) if correction[3] else ""
-                    correct = str(correction[4]) if correction[4] else ""
-                    context = ""
-                else:
-                    continue
-
-                if not (wrong and correct):
-                    continue
-
-                # Try to extract player and team info from correction fields
-                wrong_info = wrong.strip()
-                correct_info = correct.strip()
-
-                # Extract player name (should be in both wrong and correct)
-                player_match = re.search(r'^(\w+(?:\s+\w+)*)\s+team:', wrong_info)
-                if not player_match:
-                    continue
-
-                player_name = player_match.group(1).strip()
-
-                # Check if this player appears in the text
-                if player_name.lower() not in corrected_text.lower():
-                    continue
-
-                # Extract old and new team info
-                old_team_match = re.search(r'team:\s*(.+?)(?:\s*->|\s*$)', wrong_info)
-                new_team_match = re.search(r'team:\s*(.+?)(?:\s*->|\s*$)', correct_info)
-
-                if not (old_team_match and new_team_match):
-                    continue
-
-                old_team = old_team_match.group(1).strip()
-                new_team = new_team_match.group(1).strip()
-
-                # Determine the replacement team
-                if new_team in ["trasferito", "nuovo club", "nuovo team"]:
-                    replacement_team = "nuovo club"
-                else:
-                    replacement_team = new_team
-
-                # Pattern 1: "**Player Name** (Team)" format
-                player_pattern = re.escape(player_name)
-                team_pattern = rf'(\*\*{player_pattern}\*\*)\s*\(([^)]+)\)'
-
-                def replace_team(match):
-                    player_part = match.group(1)
-                    current_team = match.group(2).strip()
-                    applied_corrections.append(f"Corrected {player_name}: {current_team} → {replacement_team}")
-                    return f"{player_part} ({replacement_team})"
-
-                # Apply the correction
-                new_text = re.sub(team_pattern, replace_team, corrected_text, flags=re.IGNORECASE)
-                if new_text != corrected_text:
-                    corrected_text = new_text
-                    continue
-
-                # Pattern 2: More general pattern for any team name in parentheses after player
-                general_pattern = rf'({re.escape(player_name)})\s*\(([^)]+)\)'
-
-                def replace_general_team(match):
-                    player_part = match.group(1)
-                    current_team = match.group(2).strip()
-                    applied_corrections.append(f"Corrected {player_name}: {current_team} → {replacement_team}")
-                    return f"{player_part} ({replacement_team})"
-
-                corrected_text = re.sub(general_pattern, replace_general_team, corrected_text, flags=re.IGNORECASE)
-
-            except Exception as e:
-                logger.error(f"Error applying single correction: {e}")
-
-        return corrected_text, applied_corrections
-
     def get_recent_corrections(self, limit: int = 20) -> List[Dict]:
         """Get most recent corrections"""
         if not self.knowledge_manager:
@@ -265,7 +246,7 @@ class CorrectionsManager:
     def get_corrections(self, limit: int = 50, persistent_only: bool = True) -> List[Dict]:
         """Get all corrections - wrapper for compatibility"""
         if persistent_only:
-            return self.get_corrections_filtered(persistent_only=True)
+            return list(self.snapshot().corrections)
         else:
             return self.get_recent_corrections(limit)
 
@@ -355,6 +336,119 @@ class CorrectionsManager:
         except Exception as e:
             logger.error(f"Failed to initialize corrections database: {e}")
 
+    # ---------- snapshot ----------
+    def _source_signature(self) -> tuple:
+        sig = [self._write_version]
+        for path in (self.db_path, f"{self.db_path}-wal", self.status_db_path, f"{self.status_db_path}-wal"):
+            try:
+                st = os.stat(path)
+                sig.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                sig.append(None)
+        return tuple(sig)
+
+    def _load_snapshot(self, version: int) -> CorrectionsSnapshot:
+        """Read corrections, exclusions and player_status in a single read transaction."""
+        corrected_names: Dict[str, str] = {}
+        corrected_teams: Dict[str, str] = {}
+        excluded_by_team: Dict[str, set] = {}
+        excluded_all, removed = set(), set()
+        player_status: Dict[str, str] = {}
+        rows: List[tuple] = []
+
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            has_status_db = False
+            if os.path.exists(self.status_db_path):
+                try:
+                    # ATTACH is not allowed inside a transaction
+                    cursor.execute("ATTACH DATABASE ? AS status_db", (self.status_db_path,))
+                    has_status_db = True
+                except sqlite3.Error as e:
+                    logger.debug(f"Could not attach {self.status_db_path}: {e}")
+            cursor.execute("BEGIN")
+            try:
+                columns = [row[1] for row in cursor.execute("PRAGMA table_info(corrections)").fetchall()]
+                if 'player_name' in columns and 'correction_type' in columns:
+                    rows = cursor.execute(
+                        "SELECT * FROM corrections WHERE persistent = TRUE ORDER BY timestamp DESC"
+                    ).fetchall()
+                    for row in rows:
+                        name, ctype, new_value = row[1], row[2], row[4]
+                        if not name:
+                            continue
+                        if ctype == "NAME_UPDATE":
+                            corrected_names.setdefault(name, new_value)
+                        elif ctype == "TEAM_UPDATE":
+                            corrected_teams.setdefault(name.lower(), new_value)
+                        elif ctype == "REMOVE":
+                            removed.add(name.lower().strip())
+                elif columns:
+                    # Fallback for older schema (field_name holds the player)
+                    for name, new_value in cursor.execute(
+                        "SELECT field_name, new_value FROM corrections ORDER BY created_at DESC"
+                    ).fetchall():
+                        if name:
+                            corrected_teams.setdefault(name.lower(), new_value)
+
+                for name, team in cursor.execute("SELECT player_name, team FROM exclusions").fetchall():
+                    key = (name or "").lower().strip()
+                    excluded_all.add(key)
+                    excluded_by_team.setdefault((team or "").lower(), set()).add(key)
+
+                if has_status_db:
+                    try:
+                        player_status = dict(cursor.execute(
+                            "SELECT canonical_key, status FROM status_db.player_status"
+                        ).fetchall())
+                    except sqlite3.Error as e:
+                        logger.debug(f"player_status not available: {e}")
+            finally:
+                conn.rollback()
+
+        return CorrectionsSnapshot(
+            version=version,
+            corrected_names=corrected_names,
+            corrected_teams=corrected_teams,
+            excluded_by_team={t: frozenset(v) for t, v in excluded_by_team.items()},
+            excluded_all=frozenset(excluded_all),
+            removed=frozenset(removed),
+            player_status=player_status,
+            corrections=tuple(rows),
+        )
+
+    def snapshot(self) -> CorrectionsSnapshot:
+        """Current corrections snapshot, reloaded only when a write happened
+        through this manager or one of the database files changed on disk."""
+        key = self._source_signature()
+        snap = self._snapshot
+        if snap is not None and key == self._snapshot_key:
+            return snap
+        with self._snapshot_lock:
+            if self._snapshot is not None and key == self._snapshot_key:
+                return self._snapshot
+            version = (self._snapshot.version + 1) if self._snapshot else 1
+            try:
+                self._snapshot = self._load_snapshot(version)
+            except Exception as e:
+                logger.error(f"Failed to load corrections snapshot: {e}")
+                if self._snapshot is None:
+                    self._snapshot = CorrectionsSnapshot(version=version)
+            self._snapshot_key = key
+            return self._snapshot
+
+    @property
+    def version(self) -> int:
+        """Monotonic version of the corrections data (bumps on every reload)."""
+        return self.snapshot().version
+
+    def _bump_version(self):
+        self._write_version += 1
+
+    def get_player_status(self, canonical_key: str) -> Optional[str]:
+        """Status from fantacalcio.db player_status (e.g. 'transferred_out')."""
+        return self.snapshot().player_status.get(canonical_key)
+
     def add_persistent_correction(self, player_name: str, field_name: str, 
                                 old_value: str, new_value: str, reason: Optional[str] = None):
         """Add correction to persistent database"""
@@ -365,7 +459,8 @@ class CorrectionsManager:
                     VALUES (?, ?, ?, ?, ?)
                 """, (player_name, field_name, old_value, new_value, reason))
                 conn.commit()
-                return True
+            self._bump_version()
+            return True
         except Exception as e:
             logger.error(f"Failed to add persistent correction: {e}")
             return False
@@ -420,6 +515,7 @@ class CorrectionsManager:
 
                 conn.commit()
                 logger.info(f"Added correction to DB: {player_name} - {correction_type}")
+            self._bump_version()
             return True
         except Exception as e:
             logger.error(f"Failed to add correction: {e}")
@@ -454,6 +550,7 @@ class CorrectionsManager:
         cursor.execute('UPDATE corrections SET applied = TRUE WHERE id = ?', (correction_id,))
         conn.commit()
         conn.close()
+        self._bump_version()
 
     def remove_player(self, player_name: str, reason: str = "User request"):
         """Permanently remove a player from all recommendations."""
@@ -549,6 +646,7 @@ class CorrectionsManager:
                 """, (player_key, player_name, team, datetime.now().isoformat()))
 
                 conn.commit()
+            self._bump_version()
 
             # Also add as a persistent correction for general exclusion
             self.add_correction_to_db(player_name, "TEAM_EXCLUSION", team, "EXCLUDED", persistent=True)
@@ -570,9 +668,8 @@ class CorrectionsManager:
 
     def get_excluded_players(self, team: str = None) -> List[str]:
         """Get list of excluded players, optionally filtered by team"""
+        excluded_players = []
         try:
-            excluded_players = []
-
             # Get from cache if available (for immediate effect)
             if hasattr(self, '_excluded_players_cache'):
                 if team and team in self._excluded_players_cache:
@@ -582,28 +679,11 @@ class CorrectionsManager:
                     for team_players in self._excluded_players_cache.values():
                         excluded_players.extend(team_players)
 
-            # Get from database using thread-safe connection
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                if team:
-                    cursor.execute("SELECT player_name FROM exclusions WHERE LOWER(team) = LOWER(?)", (team,))
-                else:
-                    cursor.execute("SELECT player_name FROM exclusions")
-                
-                db_players = [row[0].lower().strip() for row in cursor.fetchall()]
-
-                # Also check for general exclusions (players excluded from all teams)
-                try:
-                    cursor.execute("SELECT player_name FROM corrections WHERE correction_type = 'REMOVE' AND persistent = TRUE")
-                    general_excluded = [row[0].lower().strip() for row in cursor.fetchall()]
-                except sqlite3.OperationalError:
-                    # Handle case where table schema might be different
-                    general_excluded = []
+            # Exclusions table + general REMOVE corrections from the snapshot
+            snap = self.snapshot()
+            all_excluded = list(set(excluded_players) | snap.excluded(team))
 
-            # Combine and deduplicate
-            all_excluded = list(set(excluded_players + db_players + general_excluded))
-
-            LOG.info(f"[Corrections] Excluded players for {team or 'all teams'}: {len(all_excluded)} total - DB: {len(db_players)}, Cache: {len(excluded_players)}, General: {len(general_excluded)}")
+            LOG.debug(f"[Corrections] Excluded players for {team or 'all teams'}: {len(all_excluded)} total - Cache: {len(excluded_players)}, Snapshot v{snap.version}")
             return all_excluded
 
         except Exception as e:
@@ -613,7 +693,7 @@ class CorrectionsManager:
     def apply_corrections_to_data(self, players_data: list):
         """Apply all persistent corrections and filters to a list of player dictionaries."""
         excluded_players = set(self.get_excluded_players())
-        corrections = self.get_corrections_filtered(persistent_only=True)
+        corrections = self.snapshot().corrections
 
         # Build correction maps for efficient lookup (case-insensitive)
         team_updates = {}
@@ -655,6 +735,7 @@ class CorrectionsManager:
     def _clear_correction_cache(self):
         """Clear any internal correction caches to force fresh data loading."""
         self._correction_cache = {}
+        self._bump_version()
         # Force re-initialization of any cached data
         if hasattr(self, '_excluded_players_cache'):
             delattr(self, '_excluded_players_cache')
@@ -736,11 +817,7 @@ class CorrectionsManager:
     def get_corrected_name(self, name: str) -> Optional[str]:
         """Get the corrected name for a player if one exists"""
         try:
-            corrections = self.get_corrections_filtered(persistent_only=True)
-            for correction in corrections:
-                if len(correction) > 4 and correction[2] == "NAME_UPDATE" and correction[1] == name:
-                    return correction[4]  # new_value
-            return None
+            return self.snapshot().corrected_names.get(name)
         except Exception as e:
             logger.error(f"Error getting corrected name for {name}: {e}")
             return None
@@ -748,42 +825,7 @@ class CorrectionsManager:
     def get_corrected_team(self, player_name: str, current_team: str) -> Optional[str]:
         """Get the corrected team for a player if one exists"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-
-                # Check if the table exists and get its schema
-                cursor.execute("PRAGMA table_info(corrections)")
-                columns = [row[1] for row in cursor.fetchall()]
-
-                if not columns:
-                    return None
-
-                # Query for team corrections for this player (case-insensitive)
-                if 'player_name' in columns and 'correction_type' in columns:
-                    cursor.execute("""
-                        SELECT new_value FROM corrections 
-                        WHERE LOWER(player_name) = LOWER(?) 
-                        AND correction_type = 'TEAM_UPDATE' 
-                        AND persistent = TRUE 
-                        ORDER BY timestamp DESC 
-                        LIMIT 1
-                    """, (player_name,))
-                else:
-                    # Fallback for older schema
-                    cursor.execute("""
-                        SELECT new_value FROM corrections 
-                        WHERE LOWER(field_name) = LOWER(?) 
-                        ORDER BY created_at DESC 
-                        LIMIT 1
-                    """, (player_name,))
-
-                result = cursor.fetchone()
-                if result:
-                    logger.info(f"Found team correction for {player_name}: {current_team} → {result[0]}")
-                    return result[0]
-
-                return None
-
+            return self.snapshot().corrected_team(player_name)
         except Exception as e:
             logger.error(f"Error getting corrected team for {player_name}: {e}")
             return None
@@ -99,13 +99,14 @@ def enrich_knowledge_base():
     
     # Generate and add player knowledge
     player_knowledge = generate_player_knowledge()
-    for entry in player_knowledge:
-        km.add_knowledge(entry["text"], entry["metadata"], entry["id"])
-    
-    # Generate and add strategy knowledge
+    # Generate strategy knowledge
     strategy_knowledge = generate_strategy_knowledge()
-    for entry in strategy_knowledge:
-        km.add_knowledge(entry["text"], entry["metadata"], entry["id"])
+
+    # Add both in batched embed + insert chunks
+    entries = player_knowledge + strategy_knowledge
+    km.add_knowledge_batch([e["text"] for e in entries],
+                           [e["metadata"] for e in entries],
+                           [e["id"] for e in entries])
     
     print(f"✅ Added {len(player_knowledge)} player entries and {len(strategy_knowledge)} strategy entries to knowledge base")
 
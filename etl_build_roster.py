@@ -106,8 +106,11 @@ def main():
         except Exception:
             pass
     
-    with open(OUT_PATH, "w", encoding="utf-8") as f:
+    # Scrittura atomica: i lettori (scheduler di refresh) non vedono mai un file a metà
+    tmp_path = f"{OUT_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
         json.dump(clean, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, OUT_PATH)
     LOG.info("[ETL] Salvato %s con %d giocatori", OUT_PATH, len(clean))
 
 if __name__ == "__main__":
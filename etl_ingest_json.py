@@ -11,6 +11,9 @@ from typing import List, Dict, Any, Optional
 import chromadb
 from chromadb.utils import embedding_functions
 
+from config import BM25_INDEX_PATH
+from retrieval.hybrid import append_documents
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - ingest - %(levelname)s - %(message)s")
 log = logging.getLogger("ingest")
 
@@ -106,6 +109,8 @@ def main():
                 batch_metas = metas[i:i+B]
                 batch_ids = ids[i:i+B]
                 coll.add(documents=batch_docs, metadatas=batch_metas, ids=batch_ids)
+                # delta log dell'indice BM25 persistente (no-op se l'indice non esiste ancora)
+                append_documents(BM25_INDEX_PATH, batch_docs, batch_ids)
                 total_added += len(batch_docs)
 
     log.info("Ingest completato. Aggiunti documenti: %s", total_added)
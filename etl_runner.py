@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 """
 Runner ETL in background per ricostruire il roster (season_roster.json).
-Espone refresh_roster_async() usato da web_interface.py.
+Espone refresh_roster_async() usato da roster_refresh.py (scheduler in-process).
 
 - Esegue per default: ETL_CMD="python etl_build_roster.py"
 - Debounce/cooldown per evitare flood
@@ -15,7 +15,7 @@ import time
 import logging
 import threading
 import subprocess
-from typing import Optional, Dict
+from typing import Callable, Optional, Dict
 
 LOG = logging.getLogger("etl_runner")
 logging.basicConfig(
@@ -28,8 +28,9 @@ _IS_RUNNING = False
 _LAST_START = 0.0
 
 
-def _run_etl_once() -> None:
-    """Esegue l'ETL una volta, catturando lo stdout e loggandolo riga per riga."""
+def _run_etl_once() -> bool:
+    """Esegue l'ETL una volta, catturando lo stdout e loggandolo riga per riga.
+    Ritorna True se il processo termina con exit code 0."""
     cmd = os.getenv("ETL_CMD", "python etl_build_roster.py")
     LOG.info("[ETL] Eseguo: %s", cmd)
     try:
@@ -42,7 +43,7 @@ def _run_etl_once() -> None:
         )
     except Exception as e:
         LOG.error("[ETL] Avvio processo fallito: %s", e)
-        return
+        return False
 
     try:
         assert proc.stdout is not None
@@ -50,14 +51,18 @@ def _run_etl_once() -> None:
             LOG.info("[ETL] %s", line.rstrip("\n"))
         proc.wait()
         LOG.info("[ETL] Exit code: %s", proc.returncode)
+        return proc.returncode == 0
     except Exception as e:
         LOG.error("[ETL] Errore in esecuzione: %s", e)
+        return False
 
 
-def refresh_roster_async(cooldown_sec: int = 60) -> bool:
+def refresh_roster_async(cooldown_sec: int = 60,
+                         on_done: Optional[Callable[[bool], None]] = None) -> bool:
     """
     Lancia l'ETL in un thread di background.
     Ritorna True se lancia davvero, False se è già in esecuzione o in cooldown.
+    on_done(ok) viene chiamato nel thread di background a fine ETL.
     """
     global _IS_RUNNING, _LAST_START
     now = time.time()
@@ -73,13 +78,19 @@ def refresh_roster_async(cooldown_sec: int = 60) -> bool:
 
         def _worker():
             global _IS_RUNNING, _LAST_START
+            ok = False
             try:
-                _run_etl_once()
+                ok = _run_etl_once()
             finally:
                 with _ETL_LOCK:
                     _IS_RUNNING = False
                     _LAST_START = time.time()
                 LOG.info("[ETL] Refresh roster completato")
+            if on_done is not None:
+                try:
+                    on_done(ok)
+                except Exception as e:
+                    LOG.error("[ETL] Callback on_done fallita: %s", e)
 
         t = threading.Thread(target=_worker, daemon=True)
         t.start()
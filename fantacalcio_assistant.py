@@ -4,19 +4,31 @@ import re
 import json
 import logging
 import unicodedata
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import time
+import copy
 import shutil
+import threading
+import dataclasses
+from dataclasses import dataclass, field
+
+import numpy as np
 
 from config import (
     ROSTER_JSON_PATH, SEASON_FILTER, REF_YEAR,
     AGE_INDEX_PATH, AGE_OVERRIDES_PATH,
     ENABLE_WEB_FALLBACK, OPENAI_API_KEY, OPENAI_MODEL,
-    OPENAI_TEMPERATURE, OPENAI_MAX_TOKENS
+    OPENAI_TEMPERATURE, OPENAI_MAX_TOKENS, FORMATION_ENGINE, RESPONSE_CACHE_ENABLED
 )
 from knowledge_manager import KnowledgeManager
 from static_transfers import get_team_arrivals, is_static_mode_enabled
 from cache_manager import get_cache_manager, cached
+from cache_keys import UncacheableArgs, digest
+from query_cache import INTENT_TTLS, SEMANTIC_INTENTS, get_query_cache
+from roster_snapshot import RosterSnapshot
+from intent_matcher import get_intent_matcher
+from squad_optimizer import solve_squad
+from llm_client import get_llm_client
 
 LOG = logging.getLogger("fantacalcio_assistant")
 
@@ -137,6 +149,21 @@ def _safe_float(x: Any, default: float = 0.0) -> float:
     except (ValueError, TypeError):
         return default
 
+def _player_line(p: Dict[str, Any], missing: str) -> str:
+    fm = p.get("_fm")
+    price = p.get("_price")
+    fm_str = f"FM {fm:.2f}" if isinstance(fm, (int, float)) else "FM N/D"
+    price_str = f"€{int(price)}" if isinstance(price, (int, float)) else "€N/D"
+    return f"{p.get('name', missing)} ({p.get('team', missing)}) - {fm_str}, {price_str}"
+
+@dataclass(frozen=True)
+class PromptArtifact:
+    """LLM prompt pieces precomputed for one (snapshot version, corrections version)."""
+    key: Tuple[int, int]
+    system_prompt: str
+    roster_context: str
+    role_context: Dict[str, str] = field(default_factory=dict)
+
 class FantacalcioAssistant:
     def __init__(self) -> None:
         LOG.info("Initializing FantacalcioAssistant...")
@@ -170,6 +197,12 @@ class FantacalcioAssistant:
         self.guessed_age_index = {}
         self.roster = None
         self.filtered_roster = None
+        self._roster_snapshot: Optional[RosterSnapshot] = None
+        self._roster_snapshot_cv = 0
+        self._prompt_artifact: Optional["PromptArtifact"] = None
+        self._prompt_lock = threading.Lock()
+        # (data version, content fingerprint) for response-cache namespaces
+        self._fingerprint_memo: Optional[Tuple[Tuple[int, int], str]] = None
         self._data_loaded = False
         
         LOG.info("[Assistant] Fast initialization completed - data will load on first use")
@@ -198,6 +231,32 @@ class FantacalcioAssistant:
         self._data_loaded = True
         LOG.info("[Assistant] Data loading completed - %d players loaded", len(self.filtered_roster))
 
+    # Attributes produced by _ensure_data_loaded, swapped together by reload_roster
+    _DATA_ATTRS = ("age_index", "overrides", "override_roles", "roster", "season_filter",
+                   "_synthetic_under21_players", "_roster_snapshot_cv", "_roster_snapshot", "filtered_roster")
+
+    def reload_roster(self) -> int:
+        """Reload the roster files and hot-swap them in; returns the new size.
+
+        The data is rebuilt on a shallow copy, so concurrent requests keep
+        reading the old roster until everything is ready.  ``filtered_roster``
+        is assigned last: it is what invalidates the snapshot, the prompt
+        artifact and the formation cache.
+        """
+        if not self._data_loaded:
+            self._ensure_data_loaded()
+            return len(self.filtered_roster or [])
+        staging = copy.copy(self)
+        staging.season_filter = SEASON_FILTER
+        staging._synthetic_under21_players = []
+        staging._data_loaded = False
+        staging._ensure_data_loaded()
+        for attr in self._DATA_ATTRS:
+            setattr(self, attr, getattr(staging, attr, None))
+        self._snapshot()
+        LOG.info("[Assistant] Roster hot-swapped: %d players", len(self.filtered_roster))
+        return len(self.filtered_roster)
+
     # ---------- loaders ----------
     def _load_age_index(self, path: str) -> Dict[str,int]:
         out={}
@@ -305,6 +364,7 @@ class FantacalcioAssistant:
                 "team": team, "season": season,
                 "birth_year": it.get("birth_year") or it.get("year_of_birth"),
                 "price": price_raw, "fantamedia": fm_raw,
+                "appearances": it.get("appearances"),
                 "_price": _to_float(price_raw), "_fm": _to_float(fm_raw),
             })
         LOG.info("[Assistant] Roster normalizzato: %d/%d record utili", len(roster), len(data))
@@ -427,6 +487,8 @@ class FantacalcioAssistant:
         # First, create all players from overrides that might not be in roster
         # BUT only include them for Under21 queries, not for budget-based formations
         processed_players = set()  # Track to prevent duplicates
+        roster_ids = {(_norm_name(p.get("name", "").strip()), _norm_team(p.get("team", "").strip()))
+                      for p in corrected_roster}
 
         for key, birth_year in self.overrides.items():
             if "@@" in key:
@@ -439,13 +501,7 @@ class FantacalcioAssistant:
                 processed_players.add(player_id)
 
                 # Create a synthetic player record for override entries not in roster
-                found_in_roster = False
-                for p in corrected_roster:
-                    p_name = _norm_name(p.get("name", "").strip())
-                    p_team = _norm_team(p.get("team", "").strip())
-                    if p_name == _norm_name(name) and p_team == _norm_team(team):
-                        found_in_roster = True
-                        break
+                found_in_roster = (_norm_name(name), _norm_team(team)) in roster_ids
 
                 if not found_in_roster:
                     # Get role from override data, default to "C"
@@ -472,6 +528,18 @@ class FantacalcioAssistant:
                     self._synthetic_under21_players.append(synthetic_player)
                     processed_override_players.add(key)
 
+        # Player status (transferred out of Serie A) from the corrections snapshot
+        if self.corrections_manager and hasattr(self.corrections_manager, "get_player_status"):
+            player_status = self.corrections_manager.snapshot().player_status
+        else:
+            player_status = {}
+            try:
+                import sqlite3
+                with sqlite3.connect("fantacalcio.db") as conn:
+                    player_status = dict(conn.execute("SELECT canonical_key, status FROM player_status").fetchall())
+            except Exception:
+                pass  # Continue with normal filtering if database unavailable
+
         # Then process corrected roster with override matching
         for p in corrected_roster:
             name = p.get("name", "").strip()
@@ -481,16 +549,8 @@ class FantacalcioAssistant:
             canonical_key = f"{name.lower().strip()}@@{team.lower().strip()}"
             
             # EXCLUDE players who transferred out of Serie A using dynamic database
-            try:
-                import sqlite3
-                with sqlite3.connect("fantacalcio.db") as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT status FROM player_status WHERE canonical_key = ?", (canonical_key,))
-                    result = cursor.fetchone()
-                    if result and result[0] == 'transferred_out':
-                        continue  # Skip players who transferred out
-            except Exception as e:
-                pass  # Continue with normal filtering if database unavailable
+            if player_status.get(canonical_key) == 'transferred_out':
+                continue  # Skip players who transferred out
             
             # Check if player has verified age in overrides with multiple key formats
             possible_keys = [
@@ -542,6 +602,73 @@ class FantacalcioAssistant:
         synthetic_count = len(getattr(self, '_synthetic_under21_players', []))
         LOG.info("[Assistant] Pool filtrato: %d record principali + %d synthetic U21, stagione=%s",
                 len(out), synthetic_count, self.season_filter or "ANY")
+        self._build_roster_snapshot()
+
+    # ---------- snapshot ----------
+    def _build_roster_snapshot(self) -> RosterSnapshot:
+        """(Re)build the columnar snapshot used by the selectors."""
+        override_by_norm = {}
+        for key, by in (self.overrides or {}).items():
+            if "@@" in key:
+                name, team = key.split("@@", 1)
+                override_by_norm.setdefault((_norm_name(name), _norm_team(team)),
+                                            (getattr(self, "override_roles", {}).get(key), by))
+
+        def identity_of(p):
+            return f"{_norm_name((p.get('name') or '').strip())}_{_norm_team((p.get('team') or '').strip())}"
+
+        def override_of(p):
+            return override_by_norm.get((_norm_name((p.get("name") or "").strip()),
+                                         _norm_team((p.get("team") or "").strip())), (None, None))
+
+        def team_of(p):
+            team = p.get("team", "")
+            if self.corrections_manager:
+                try:
+                    corrected = self.corrections_manager.get_corrected_team(p.get("name", ""), team)
+                    if corrected:
+                        return corrected
+                except Exception as e:
+                    LOG.error(f"Error getting corrected team for snapshot: {e}")
+            return team
+
+        prev = self._roster_snapshot
+        self._roster_snapshot_cv = self._corrections_version()
+        self._roster_snapshot = RosterSnapshot.build(
+            self.filtered_roster, REF_YEAR,
+            role_of=lambda p: _role_letter(p.get("role") or p.get("role_raw", "")),
+            team_of=team_of,
+            synthetic=getattr(self, "_synthetic_under21_players", []),
+            identity_of=identity_of,
+            override_of=override_of,
+            version=(prev.version + 1) if prev else 1,
+        )
+        return self._roster_snapshot
+
+    def _corrections_version(self) -> int:
+        cm = self.corrections_manager
+        return cm.version if cm is not None and hasattr(cm, "snapshot") else 0
+
+    def _data_version(self) -> Tuple[int, int]:
+        """(snapshot version, corrections version) of the data answers are built from."""
+        self._ensure_data_loaded()
+        return self._snapshot().version, self._corrections_version()
+
+    def _snapshot(self) -> RosterSnapshot:
+        snap = self._roster_snapshot
+        if (snap is None or snap.source is not self.filtered_roster
+                or self._roster_snapshot_cv != self._corrections_version()):
+            snap = self._build_roster_snapshot()
+        return snap
+
+    def _excluded_names(self) -> List[str]:
+        if not self.corrections_manager:
+            return []
+        try:
+            return [name.lower() for name in self.corrections_manager.get_excluded_players()]
+        except Exception as e:
+            LOG.error(f"Error getting excluded players: {e}")
+            return []
 
     # ---------- KM guess ----------
     def _guess_birth_year_from_km(self, name: str) -> Optional[int]:
@@ -600,59 +727,13 @@ class FantacalcioAssistant:
 
     # ---------- utility ----------
     def _pool_by_role(self, r: str, max_age: Optional[int] = None) -> List[Dict[str,Any]]:
-        # Get excluded players from corrections manager
-        excluded_players = []
-        if self.corrections_manager:
-            try:
-                excluded_players = [name.lower() for name in self.corrections_manager.get_excluded_players()]
-            except Exception as e:
-                LOG.error(f"Error getting excluded players in _pool_by_role: {e}")
+        snap = self._snapshot()
+        excluded_players = self._excluded_names()
 
-        filtered_pool = []
-        for p in self.filtered_roster:
-            if _role_letter(p.get("role") or p.get("role_raw","")) == r:
-                # Create a copy to avoid modifying the original
-                player_copy = dict(p)
-
-                # Apply team corrections
-                if self.corrections_manager:
-                    player_name = player_copy.get("name", "")
-                    current_team = player_copy.get("team", "")
-                    corrected_team = self.corrections_manager.get_corrected_team(player_name, current_team)
-                    if corrected_team and corrected_team != current_team:
-                        player_copy["team"] = corrected_team
-                        LOG.info(f"[Pool] Applied team correction: {player_name} {current_team} → {corrected_team}")
-
-                # Skip excluded players - use fuzzy matching
-                player_name = (player_copy.get("name") or "").lower()
-                should_skip = False
-                for excluded in excluded_players:
-                    excluded_lower = excluded.lower()
-                    # Check if excluded name is contained in player name or vice versa
-                    if excluded_lower in player_name or player_name in excluded_lower:
-                        should_skip = True
-                        break
-                    # Also check if main part of name matches
-                    excluded_parts = excluded_lower.split()
-                    player_parts = player_name.split()
-                    if any(part in player_parts for part in excluded_parts if len(part) > 2):
-                        should_skip = True
-                        break
-                # Apply age filter if specified
-                if max_age is not None and not should_skip:
-                    birth_year = player_copy.get("birth_year")
-                    if birth_year:
-                        age = REF_YEAR - birth_year
-                        if age > max_age:
-                            LOG.debug(f"[Pool Age Filter] Excluding {player_copy.get('name', 'Unknown')} (age {age} > {max_age})")
-                            should_skip = True
-                    else:
-                        # If no birth year available, be conservative and exclude
-                        LOG.debug(f"[Pool Age Filter] Excluding {player_copy.get('name', 'Unknown')} (no age data)")
-                        should_skip = True
-                        
-                if not should_skip:
-                    filtered_pool.append(player_copy)
+        # Index-based selection: role index ∩ age bucket, minus excluded mask.
+        # Team corrections are already folded into the snapshot.
+        idx = snap.role_index(r, max_age=max_age, excluded=excluded_players)
+        filtered_pool = snap.rows(idx)
 
         if max_age is not None:
             LOG.info(f"[Pool Age Filter] Role {r}: {len(filtered_pool)} players under {max_age} years old")
@@ -670,192 +751,157 @@ class FantacalcioAssistant:
 
     # ---------- Selettori ----------
     def _select_under(self, r: str, max_age: int = 21, take: int = 3) -> List[Dict[str,Any]]:
-        pool=[]
-
-        # Get ALL players from filtered roster and check role + age
-        LOG.info(f"[Under21] Looking for {r} players under {max_age} in {len(self.filtered_roster)} total players")
-
-        # Debug: check all override players for this role
-        override_matches = []
-        for key, birth_year in self.overrides.items():
-            if "@@" in key:
-                name, team = key.split("@@", 1)
-
-                # Create unique identifier for this player
-                player_id = f"{_norm_name(name)}_{_norm_team(team)}"
-
-                # Check role, matching logic needs to be consistent
-                role = self.override_roles.get(key)
-                is_role_match = False
-                if role == r:
-                    is_role_match = True
-
-                if is_role_match:
-                    age = self._age_from_by(birth_year)
-                    if age is not None and age <= max_age:
-                        override_matches.append(f"{name} ({team}) - age {age}")
-
-        LOG.info(f"[Under21] Total U{max_age} players in overrides: {len(override_matches)}")
-        if override_matches[:5]:  # Show first 5
-            LOG.info(f"[Under21] Examples: {', '.join(override_matches[:5])}")
-
-        # Check each player in filtered roster + synthetic under21 players
-        role_matches = 0
-        age_matches = 0
-        final_matches = 0
-        seen_players = set()  # Prevent duplicate entries
-
-        # Combine regular roster with synthetic under21 players for this query
-        all_players = list(self.filtered_roster)
-        if hasattr(self, '_synthetic_under21_players'):
-            all_players.extend(self._synthetic_under21_players)
-
-        for p in all_players:
-            # Create unique identifier for this player
-            name = p.get("name", "").strip()
-            team = p.get("team", "").strip()
-            player_id = f"{_norm_name(name)}_{_norm_team(team)}"
-
-            if player_id in seen_players:
-                continue
-            seen_players.add(player_id)
-
-            # Check role - use override role if available, otherwise use player role
-            player_role = p.get("role", "").strip().upper()
-            role_raw = p.get("role_raw", "").strip().upper()
-
-            # Check if we have role info from overrides
-            override_role = None
-            for key in self.overrides.keys():
-                if "@@" in key:
-                    key_name, key_team = key.split("@@", 1)
-                    if (_norm_name(key_name) == _norm_name(name) and
-                        _norm_team(key_team) == _norm_team(team)):
-                        override_role = self.override_roles.get(key)
-                        break
-
-            # Use override role if available, otherwise use player role
-            effective_role = override_role or player_role
-
-            # Role matching
-            is_role_match = False
-            if r == "D":
-                is_role_match = (effective_role == "D" or player_role in ["D"] or
-                               any(x in role_raw for x in ["DIFENSOR", "DIFENSORE", "DEF", "DC", "CB", "RB", "LB", "TD", "TS"]))
-            elif r == "C":
-                is_role_match = (effective_role == "C" or player_role in ["C"] or
-                               any(x in role_raw for x in ["CENTROCAMP", "MED", "MEZZ", "CM", "CAM", "CDM", "AM", "TQ"]))
-            elif r == "A":
-                is_role_match = (effective_role == "A" or player_role in ["A"] or
-                               any(x in role_raw for x in ["ATTACC", "ATT", "ST", "CF", "LW", "RW", "SS", "PUN"]))
-            elif r == "P":
-                is_role_match = (effective_role == "P" or player_role in ["P"] or
-                               any(x in role_raw for x in ["PORTIER", "GK", "POR"]))
-
-            if is_role_match:
-                role_matches += 1
-
-                # Check age - try to find birth year from overrides first
-                birth_year = p.get("birth_year")
-                for key in self.overrides.keys():
-                    if "@@" in key:
-                        key_name, key_team = key.split("@@", 1)
-                        if (_norm_name(key_name) == _norm_name(name) and
-                            _norm_team(key_team) == _norm_team(team)):
-                            birth_year = self.overrides[key]
-                            p["birth_year"] = birth_year
-                            break
-
-                if birth_year and _valid_birth_year(birth_year):
-                    age = self._age_from_by(birth_year)
-                    if age is not None and age <= max_age:
-                        age_matches += 1
-                        pool.append(p)
-                        final_matches += 1
-                        LOG.info(f"[Under21] MATCH: {name} ({team}) - role: {effective_role}, age: {age}")
-
-        LOG.info(f"[Under21] Summary - Role matches: {role_matches}, Age matches: {age_matches}, Final: {final_matches}")
-
-        # Sort by fantamedia descending, then price ascending
-        pool.sort(key=lambda x: (-(x.get("_fm") or 0.0), (x.get("_price") or 9_999.0)))
-
-        return pool[:take]
+        snap = self._snapshot()
+        LOG.info(f"[Under21] Looking for {r} players under {max_age} in {len(self.filtered_roster or [])} total players")
+
+        # Roster + synthetic U21 rows, de-duplicated, role matched (override role
+        # first) and aged with the override birth year when available
+        idx = snap.order_by_fm(snap.under_index(r, max_age))[:take]
+        pool = []
+        for i in idx:
+            p = snap.players[int(i)]
+            by = int(snap.birth_year[i])
+            if p.get("birth_year") != by:
+                # copia: le righe dello snapshot sono condivise fra richieste e thread
+                p = {**p, "birth_year": by}
+            LOG.info(f"[Under21] MATCH: {p.get('name', '')} ({p.get('team', '')}) - age: {int(snap.age[i])}")
+            pool.append(p)
+
+        LOG.info(f"[Under21] Summary - Role matches: {int(snap.under_role[r].sum()) if r in snap.under_role else 0}, "
+                 f"Final: {len(pool)}")
+        return pool
 
     def _select_top_by_budget(self, r: str, budget: int, take: int = 8, max_age: Optional[int] = None
                               ) -> Tuple[List[Dict[str,Any]], List[Dict[str,Any]]]:
-        within=[]; fm_only=[]
+        snap = self._snapshot()
+        excluded_players = self._excluded_names()
+
+        idx = snap.role_index(r, max_age=max_age, excluded=excluded_players)
+        fm = snap.fm[idx]; pr = snap.price[idx]
+        ok = (fm > 0) & (pr > 0) & (pr <= float(budget))
+        cand = idx[ok]
+        ratio = snap.fm[cand] / np.maximum(snap.price[cand], 1.0)
+        order = np.lexsort((snap.price_or_max[cand], -snap.fm_or_zero[cand], -ratio))[:take]
+        within = snap.rows(cand[order], extra={"_value_ratio": ratio[order]})
+
+        fm_only = []
+        if len(within) < take:
+            missing_price = idx[(fm > 0) & np.isnan(pr)]
+            missing_price = missing_price[np.argsort(-snap.fm[missing_price], kind="stable")]
+            fm_only = snap.rows(missing_price[:max(0, take-len(within))])
+        return within, fm_only
+
+    def _select_top_role_any(self, r: str, take: int = 400, max_age: Optional[int] = None) -> List[Dict[str,Any]]:
+        snap = self._snapshot()
+        idx = snap.role_index(r, max_age=max_age, excluded=self._excluded_names())
+        denom = np.where(np.isnan(snap.price[idx]), 100.0, snap.price[idx])
+        ratio = snap.fm_or_zero[idx] / np.maximum(denom, 1.0)
+        order = np.lexsort((snap.price_or_max[idx], -snap.fm_or_zero[idx], -ratio))[:take]
+        return snap.rows(idx[order], extra={"_value_ratio": ratio[order]})
+
+    # ---------- XI Builder ----------
+    def _formation_pool(self, role: str, max_age: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Candidates for ``role`` with corrected team, numeric price/FM and value ratio"""
+        pool = self._select_top_role_any(role, take=500, max_age=max_age)
 
-        # Get excluded players from corrections manager
-        excluded_players = []
+        # Apply team corrections
         if self.corrections_manager:
-            try:
-                excluded_players = [name.lower() for name in self.corrections_manager.get_excluded_players()]
-            except Exception as e:
-                LOG.error(f"Error getting excluded players: {e}")
-
-        tmp=[]
-        for p in self._pool_by_role(r, max_age):
-            # Skip excluded players - use fuzzy matching
-            player_name = (p.get("name") or "").lower()
-            should_skip = False
-            for excluded in excluded_players:
-                excluded_lower = excluded.lower()
-                # Check if excluded name is contained in player name or vice versa
-                if excluded_lower in player_name or player_name in excluded_lower:
-                    should_skip = True
-                    LOG.info(f"Skipping excluded player: {p.get('name')} (matches exclusion: {excluded})")
-                    break
-                # Also check if main part of name matches (e.g., "arnautovic" matches "marko arnautovic")
-                excluded_parts = excluded_lower.split()
-                player_parts = player_name.split()
-                if any(part in player_parts for part in excluded_parts if len(part) > 2):
-                    should_skip = True
-                    LOG.info(f"Skipping excluded player: {p.get('name')} (partial match: {excluded})")
-                    break
-            if should_skip:
+            for p in pool:
+                player_name = p.get("name", "")
+                current_team = p.get("team", "")
+                corrected_team = self.corrections_manager.get_corrected_team(player_name, current_team)
+                if corrected_team and corrected_team != current_team:
+                    p["team"] = corrected_team
+                    LOG.info(f"[Formation] Applied team correction: {player_name} {current_team} → {corrected_team}")
+
+        # Filter valid players - include those with 0.0 FM if they have price data
+        valid_pool = []
+        for p in pool:
+            if p.get("_source") == "override_synthetic":
                 continue
 
-            fm = p.get("_fm"); pr = p.get("_price")
-            if isinstance(fm,(int,float)) and fm>0 and isinstance(pr,(int,float)) and 0<pr<=float(budget):
-                q = dict(p); q["_value_ratio"] = fm / max(pr,1.0); tmp.append(q)
-        tmp.sort(key=lambda x: (-x["_value_ratio"], -(x.get("_fm") or 0.0), x.get("_price") or 9_999.0))
-        within = tmp[:take]
+            price = p.get("_price") or p.get("price")
+            fm = p.get("_fm") or p.get("fantamedia")
+
+            # Include players with valid price, even if FM is 0.0 (new signings)
+            if price is not None:
+                # Convert string prices if needed
+                if isinstance(price, str):
+                    price = _to_float(price)
+                if isinstance(fm, str):
+                    fm = _to_float(fm)
+
+                # Set defaults for missing data
+                if price is None:
+                    price = 10.0  # Default price
+                if fm is None or fm == 0.0:
+                    # Assign reasonable default based on role and recent transfers
+                    if role == "A":
+                        fm = 6.5  # Default for attackers
+                    elif role == "C":
+                        fm = 6.0  # Default for midfielders  
+                    elif role == "D":
+                        fm = 5.8  # Default for defenders
+                    else:
+                        fm = 5.5  # Default for others
 
-        if len(within) < take:
-            tmp2=[]
-            for p in self._pool_by_role(r, max_age):
-                # Skip excluded players
-                player_name = (p.get("name") or "").lower()
-                if player_name in excluded_players:
-                    continue
+                # Update the player data
+                p["_price"] = float(price)
+                p["_fm"] = float(fm)
+                p["_value_ratio"] = float(fm) / max(float(price), 1.0)
+                valid_pool.append(p)
 
-                if p.get("_fm") is not None and (p.get("_fm") or 0.0) > 0 and p.get("_price") is None:
-                    tmp2.append(p)
-            tmp2.sort(key=lambda x: -(x.get("_fm") or 0.0))
-            fm_only = tmp2[:max(0, take-len(within))]
-        return within, fm_only
+        return valid_pool
 
-    def _select_top_role_any(self, r: str, take: int = 400, max_age: Optional[int] = None) -> List[Dict[str,Any]]:
-        pool=[]
-        for p in self._pool_by_role(r, max_age):
-            fm = p.get("_fm"); pr = p.get("_price")
-
-            # Skip players without essential data for budget formations
-            if p.get("_source") == "override_synthetic" and (fm is None or pr is None):
+    def _exact_formation_picks(self, slots: Dict[str, int], budget: int,
+                               max_age: Optional[int] = None) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+        """Best total FM under budget, role slots and max 3 players per club (exact solver)"""
+        candidates: List[Dict[str, Any]] = []
+        roles: List[str] = []
+        seen = set()
+        for role in ["P", "D", "C", "A"]:
+            if slots.get(role, 0) <= 0:
                 continue
+            for p in self._formation_pool(role, max_age):
+                name = p.get("name")
+                if name in seen:
+                    continue
+                seen.add(name)
+                candidates.append(p)
+                roles.append(role)
+
+        solution = solve_squad(
+            roles,
+            [p["_price"] for p in candidates],
+            [p["_fm"] for p in candidates],
+            [(p.get("team") or "").lower() for p in candidates],
+            slots, budget, max_per_team=3,
+        )
+        if solution is None:
+            LOG.warning("[Formation] Exact engine found no feasible squad, using greedy builder")
+            return None
 
-            fm_ok = float(fm) if isinstance(fm,(int,float)) else 0.0
-            denom = pr if isinstance(pr,(int,float)) else 100.0
-            vr = fm_ok / max(denom, 1.0)
-            q = dict(p); q["_value_ratio"] = vr
-            pool.append(q)
-        pool.sort(key=lambda x: (-x.get("_value_ratio",0.0), -(x.get("_fm") or 0.0), x.get("_price") if isinstance(x.get("_price"),(int,float)) else 9_999.0))
-        return pool[:take]
-
-    # ---------- XI Builder ----------
-    @cached(category='formations', ttl=1800)
-    def _build_formation(self, formation: Dict[str,int], budget: int, max_age: Optional[int] = None) -> Dict[str,Any]:
-        """Build formation with budget allocation optimized for 200 credit budget"""
+        picks: Dict[str, List[Dict[str, Any]]] = {"P": [], "D": [], "C": [], "A": []}
+        for i in solution.indices:
+            picks[roles[i]].append(candidates[i])
+        for role in picks:
+            picks[role].sort(key=lambda x: (-(x.get("_fm") or 0.0), x.get("_price", 0)))
+        LOG.info(f"[Formation] Exact engine: FM {solution.score:.2f}, cost {solution.cost}, "
+                 f"{solution.nodes} nodes (optimal={solution.optimal})")
+        return picks
+
+    def _formation_cache_key(self, formation: Dict[str,int], budget: int, max_age: Optional[int] = None,
+                             engine: Optional[str] = None):
+        return (self._data_version(), formation, budget, max_age, (engine or FORMATION_ENGINE).lower())
+
+    @cached(category='formations', ttl=1800, key=_formation_cache_key)
+    def _build_formation(self, formation: Dict[str,int], budget: int, max_age: Optional[int] = None,
+                         engine: Optional[str] = None) -> Dict[str,Any]:
+        """Build formation with budget allocation optimized for 200 credit budget.
+
+        ``engine`` is "greedy" (per-role budget targets) or "exact" (squad_optimizer);
+        defaults to FORMATION_ENGINE.
+        """
         slots = dict(formation)
         picks = {"P":[], "D":[], "C":[], "A":[]}
         used = set()
@@ -863,6 +909,11 @@ class FantacalcioAssistant:
         # FORCE budget to be 200 regardless of what user specifies
         budget = 200
 
+        engine = (engine or FORMATION_ENGINE).lower()
+        exact_picks = self._exact_formation_picks(slots, budget, max_age) if engine == "exact" else None
+        if exact_picks is not None:
+            picks = exact_picks
+
         # Calculate target budget allocation per role (optimized for 200 credit budget)
         total_players = sum(slots.values())
         role_budget_targets = {
@@ -874,54 +925,7 @@ class FantacalcioAssistant:
 
         # Strategy: Pick players to actually utilize the budget effectively
         def pick_budget_conscious_role(role: str, needed_count: int, role_budget: int):
-            pool = self._select_top_role_any(role, take=500, max_age=max_age)
-
-            # Apply team corrections
-            if self.corrections_manager:
-                for p in pool:
-                    player_name = p.get("name", "")
-                    current_team = p.get("team", "")
-                    corrected_team = self.corrections_manager.get_corrected_team(player_name, current_team)
-                    if corrected_team and corrected_team != current_team:
-                        p["team"] = corrected_team
-                        LOG.info(f"[Formation] Applied team correction: {player_name} {current_team} → {corrected_team}")
-
-            # Filter valid players - include those with 0.0 FM if they have price data
-            valid_pool = []
-            for p in pool:
-                if p.get("_source") == "override_synthetic":
-                    continue
-
-                price = p.get("_price") or p.get("price")
-                fm = p.get("_fm") or p.get("fantamedia")
-
-                # Include players with valid price, even if FM is 0.0 (new signings)
-                if price is not None:
-                    # Convert string prices if needed
-                    if isinstance(price, str):
-                        price = _to_float(price)
-                    if isinstance(fm, str):
-                        fm = _to_float(fm)
-
-                    # Set defaults for missing data
-                    if price is None:
-                        price = 10.0  # Default price
-                    if fm is None or fm == 0.0:
-                        # Assign reasonable default based on role and recent transfers
-                        if role == "A":
-                            fm = 6.5  # Default for attackers
-                        elif role == "C":
-                            fm = 6.0  # Default for midfielders  
-                        elif role == "D":
-                            fm = 5.8  # Default for defenders
-                        else:
-                            fm = 5.5  # Default for others
-
-                    # Update the player data
-                    p["_price"] = float(price)
-                    p["_fm"] = float(fm)
-                    p["_value_ratio"] = float(fm) / max(float(price), 1.0)
-                    valid_pool.append(p)
+            valid_pool = self._formation_pool(role, max_age)
 
             if not valid_pool:
                 return []
@@ -996,7 +1000,7 @@ class FantacalcioAssistant:
 
         # Pick players for each role with budget consciousness
         for role in ["P", "D", "C", "A"]:
-            if slots[role] > 0:
+            if exact_picks is None and slots[role] > 0:
                 if role == "P":
                     # Get goalkeepers from pool with corrections applied
                     gk_pool = self._pool_by_role("P")
@@ -1669,28 +1673,21 @@ Cosa ti interessa di più?"""
     def _parse_intent(self, text: str, mode: str) -> Dict[str,Any]:
         lt = (text or "").lower().strip()
         intent={"type":"generic","mode":mode,"raw":lt}
+        # One pass over the text: keyword tags + team/role/budget/age slots
+        slots = get_intent_matcher().scan(lt)
 
         # Complex budget allocation requests - CHECK FIRST before simple keyword matches
-        budget_match = re.search(r"budget.*?(\d{2,4})", lt)
-        player_counts = []
-        if re.search(r"(\d+)\s*portier", lt):
-            player_counts.append(("P", int(re.search(r"(\d+)\s*portier", lt).group(1))))
-        if re.search(r"(\d+)\s*difens", lt):
-            player_counts.append(("D", int(re.search(r"(\d+)\s*difens", lt).group(1))))
-        if re.search(r"(\d+)\s*centrocamp", lt):
-            player_counts.append(("C", int(re.search(r"(\d+)\s*centrocamp", lt).group(1))))
-        if re.search(r"(\d+)\s*attaccan", lt):
-            player_counts.append(("A", int(re.search(r"(\d+)\s*attaccan", lt).group(1))))
-            
+        player_counts = slots.player_counts
+
         # Check for age constraints in complex requests
         under_constraint = None
-        if "under 21" in lt or "u21" in lt:
+        if slots.has("complex_u21"):
             under_constraint = 21
-        elif "under 23" in lt or "u23" in lt:
+        elif slots.has("complex_u23"):
             under_constraint = 23
             
-        if budget_match and player_counts:
-            budget = int(budget_match.group(1))
+        if slots.budget is not None and player_counts:
+            budget = slots.budget
             LOG.info(f"[Complex Budget Intent] Detected: budget={budget}, counts={player_counts}, under={under_constraint}")
             intent.update({
                 "type": "complex_budget",
@@ -1702,130 +1699,97 @@ Cosa ti interessa di più?"""
             return intent
 
         # Check for goalkeeper requests (only simple ones, not top/migliori queries)
-        simple_goalkeeper_query = any(x in lt for x in ["portieri", "portiere", "goalkeeper", "gk"]) and not player_counts
-        is_top_goalkeeper = any(word in lt for word in ["top", "migliori", "miglior"]) and "portier" in lt
+        simple_goalkeeper_query = slots.has("gk_simple") and not player_counts
+        is_top_goalkeeper = slots.has("top") and slots.has("portier")
         if simple_goalkeeper_query and not is_top_goalkeeper:
             intent.update({"type": "goalkeeper", "original_text": text})
             return intent
 
         # Check for team formation requests
-        if any(x in lt for x in ["formazione", "titolare", "squadra", "rosa", "lineup"]) and not re.search(r"\b[0-5]\s*-\s*[0-5]\s*-\s*[0-5]\b", lt):
-            team = None
-            for team_name in ["inter", "milan", "juventus", "napoli", "roma", "lazio", "atalanta", "fiorentina", "bologna", "torino", "genoa", "udinese", "cagliari", "lecce", "empoli", "monza", "venezia", "verona", "como", "parma"]:
-                if team_name in lt:
-                    team = team_name.title()
-                    break
-            intent.update({"type": "team_formation", "team": team, "original_text": text})
+        if slots.has("team_formation") and not slots.formation:
+            intent.update({"type": "team_formation", "team": slots.team, "original_text": text})
             return intent
 
         # Check for transfer/acquisitions requests
-        if any(x in lt for x in ["ultimi acquisti", "acquisiti", "nuovi acquisti", "trasferimenti", "mercato", "acquisti"]):
-            team = None
-            for team_name in ["inter", "milan", "juventus", "napoli", "roma", "lazio", "atalanta", "fiorentina", "bologna", "torino", "genoa", "udinese", "cagliari", "lecce", "empoli", "monza", "venezia", "verona", "como", "parma"]:
-                if team_name in lt:
-                    team = team_name.title()
-                    break
-            intent.update({"type": "transfers", "team": team, "original_text": text})
+        if slots.has("transfers"):
+            intent.update({"type": "transfers", "team": slots.team, "original_text": text})
             return intent
 
         # formazione - CHECK FOR AGE CONSTRAINTS TOO
-        if "formazione" in lt and re.search(r"\b[0-5]\s*-\s*[0-5]\s*-\s*[0-5]\b", lt):
-            fm = re.search(r"\b([0-5])\s*-\s*([0-5])\s*-\s*([0-5])\b", lt).group(0)
-            budget = self._parse_first_int(lt) or 200
+        if slots.has("formazione") and slots.formation:
+            fm = slots.formation
+            budget = slots.first_int or 200
             
             # Check for age constraints in the same text
             max_age = None
             
             # Pattern 1: Explicit under age mentions
-            if any(k in lt for k in ["under 21","under-21","under21","u21"]):
+            if slots.has("fm_u21"):
                 max_age = 21
-            elif any(k in lt for k in ["under 23","under-23","under23","u23"]):
+            elif slots.has("fm_u23"):
                 max_age = 23
             
             # Pattern 2: Italian phrases with "solo/soltanto/solamente + under + age"
-            solo_under_patterns = [
-                r"sol[oa]\s+(?:di\s+)?under\s*(\d+)",  # solo under 23, solo di under 23
-                r"soltanto\s+(?:di\s+)?under\s*(\d+)",  # soltanto under 23, soltanto di under 23
-                r"solamente\s+(?:di\s+)?under\s*(\d+)", # solamente under 23, solamente di under 23
-                r"(?:solo|soltanto|solamente)\s+.*?under\s*(\d+)", # flexible matching
-            ]
-            
-            for pattern in solo_under_patterns:
-                age_match = re.search(pattern, lt, re.IGNORECASE)
+            for pattern in self._SOLO_UNDER_PATTERNS:
+                age_match = pattern.search(lt)
                 if age_match:
                     max_age = int(age_match.group(1))
                     LOG.info(f"[Intent Parse] Found age constraint: max_age={max_age} from '{age_match.group(0)}'")
                     break
                     
             # Pattern 3: Generic under + number patterns as fallback  
-            if max_age is None:
-                generic_under = re.search(r"under\s*(\d+)", lt, re.IGNORECASE)
-                if generic_under:
-                    max_age = int(generic_under.group(1))
-                    LOG.info(f"[Intent Parse] Found generic age constraint: max_age={max_age}")
+            if max_age is None and slots.under_age is not None:
+                max_age = slots.under_age
+                LOG.info(f"[Intent Parse] Found generic age constraint: max_age={max_age}")
                     
             intent.update({"type":"formation","formation_text":fm, "budget":budget, "max_age":max_age})
             return intent
 
         # under - CHECK THIS FIRST before budget detection
-        if any(k in lt for k in ["under 21","under-21","under21","u21","under 23","u23"]):
-            max_age = 21 if "23" not in lt else 23
+        if slots.has("under"):
+            max_age = 21 if not slots.has("has_23") else 23
             role="A"
-            if "difensor" in lt or "terzin" in lt or "centrale" in lt: role="D"
-            elif "centrocamp" in lt or "mezzala" in lt or "regista" in lt: role="C"
-            elif "portier" in lt: role="P"
+            if slots.has("under_D"): role="D"
+            elif slots.has("under_C"): role="C"
+            elif slots.has("portier"): role="P"
             take = 3
-            m = re.search(r"\b(\d)\s+(nomi|giocatori|attaccant)\b", lt)
-            if m: take = max(1, int(m.group(1)))
+            if slots.take is not None: take = max(1, slots.take)
             intent.update({"type":"under","role":role,"max_age":max_age,"take":take})
             return intent
 
         # top players by role with budget (expanded to handle more cases)
-        role_keywords = {
-            "A": ["attacc", "punta", "attaccanti"],
-            "C": ["centrocamp", "mediano", "mezzala", "centrocampisti"],
-            "D": ["difensor", "difensori", "terzin", "centrale"],
-            "P": ["portier", "portieri", "goalkeeper"]
-        }
-        
-        # Check for "top" or "migliori" patterns
-        is_top_query = any(word in lt for word in ["top", "migliori", "miglior"])
-        
-        role_found = None
-        for role_code, keywords in role_keywords.items():
-            if any(keyword in lt for keyword in keywords):
-                role_found = role_code
-                break
+        is_top_query = slots.has("top")
+        role_found = next((r for r in ("A", "C", "D", "P") if slots.has(f"role_{r}")), None)
         
         # Handle top queries with or without explicit budget
         if is_top_query and role_found:
-            budget = self._parse_first_int(lt) or 150
+            budget = slots.first_int or 150
             intent.update({"type":"top_players","role":role_found,"budget":budget})
             return intent
         
         # Legacy support for attackers with budget (keep for compatibility)
-        if ("attacc" in lt or "top attaccanti" in lt or "punta" in lt) and ("budget" in lt or self._parse_first_int(lt)):
-            budget = self._parse_first_int(lt) or 150
+        if slots.has("attackers") and (slots.has("budget") or slots.first_int):
+            budget = slots.first_int or 150
             intent.update({"type":"budget_attackers","budget":budget})
             return intent
 
         # asta
-        if "strategia" in lt and "asta" in lt:
+        if slots.has("strategia") and slots.has("asta"):
             intent.update({"type":"asta"})
             return intent
 
         # Player comparisons - catch before LLM fallback
-        if any(word in lt for word in ["vs", "contro", "meglio", "confronto", "compara"]) and len(lt.split()) > 2:
+        if slots.has("comparison") and len(lt.split()) > 2:
             intent.update({"type": "comparison", "original_text": text})
             return intent
             
         # General advice requests - structured response instead of LLM
-        if any(word in lt for word in ["consiglio", "consigli", "strategia", "tattica", "suggerimento"]) and not any(word in lt for word in ["asta"]):
+        if slots.has("advice") and not slots.has("asta"):
             intent.update({"type": "advice", "original_text": text})
             return intent
             
         # Season/league questions - structured response
-        if any(word in lt for word in ["stagione", "campionato", "serie a", "giornata"]):
+        if slots.has("season"):
             intent.update({"type": "season_info", "original_text": text})
             return intent
 
@@ -1839,9 +1803,18 @@ Cosa ti interessa di più?"""
         intent.update({"type": "generic", "needs_validation": True})
         return intent
 
+    # Italian "solo/soltanto/solamente (di) under N" (only checked for formation requests)
+    _SOLO_UNDER_PATTERNS = tuple(re.compile(p, re.IGNORECASE) for p in (
+        r"sol[oa]\s+(?:di\s+)?under\s*(\d+)",  # solo under 23, solo di under 23
+        r"soltanto\s+(?:di\s+)?under\s*(\d+)",  # soltanto under 23, soltanto di under 23
+        r"solamente\s+(?:di\s+)?under\s*(\d+)", # solamente under 23, solamente di under 23
+        r"(?:solo|soltanto|solamente)\s+.*?under\s*(\d+)", # flexible matching
+    ))
+
     # ---------- respond ----------
-    def get_response(self, user_text: str, mode: str, context: Dict[str, Any]) -> str:
-        """Main logic to get a response based on intent"""
+    def get_response(self, user_text: str, mode: str, context: Dict[str, Any],
+                     on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Main logic to get a response based on intent (``on_token`` streams LLM replies)"""
         st = dict(context or {})
         st.setdefault("history", [])
         st["history"] = (st["history"] + [{"u":user_text}])[-10:]
@@ -1851,6 +1824,32 @@ Cosa ti interessa di più?"""
         if intent["type"] == "followup" and st.get("last_intent"):
             intent = self._apply_followup_mods(user_text.lower(), dict(st["last_intent"]))
 
+        # Response cache: exact/semantic match per (data fingerprint, exclusions, mode, parsed intent)
+        ttl = INTENT_TTLS.get(intent["type"], 0) if RESPONSE_CACHE_ENABLED else 0
+        if intent["type"] == "generic" and len(st.get("conversation_history") or []) > 1:
+            ttl = 0  # la risposta LLM dipende dai turni precedenti della conversazione
+        if ttl > 0:
+            cache, namespace = get_query_cache(), self._response_cache_namespace(mode, intent, st)
+            semantic = intent["type"] in SEMANTIC_INTENTS
+            reply = cache.lookup(user_text, namespace, semantic=semantic)
+            if reply is not None:
+                if on_token:
+                    on_token(reply)  # il chiamante filtra come per i token LLM
+            else:
+                reply = self._dispatch_intent(intent, user_text, st, on_token)
+                if reply not in (self._NO_ANSWER_REPLY, self._NOT_UNDERSTOOD_REPLY):
+                    cache.store_response(user_text, reply, namespace, ttl, intent["type"], semantic=semantic)
+        else:
+            reply = self._dispatch_intent(intent, user_text, st, on_token)
+
+        st["last_intent"] = intent
+        return reply
+
+    _NO_ANSWER_REPLY = "Dimmi: *formazione 5-3-2 500*, *top attaccanti budget 150*, *2 difensori under 21*, oppure *strategia asta*."
+    _NOT_UNDERSTOOD_REPLY = "Non ho capito la richiesta. Prova con: *formazione 5-3-2 500*, *top attaccanti budget 150*, *2 difensori under 21*, oppure *strategia asta*."
+
+    def _dispatch_intent(self, intent: Dict[str, Any], user_text: str, st: Dict[str, Any],
+                         on_token: Optional[Callable[[str], None]] = None) -> str:
         if intent["type"] == "under":
             reply = self._answer_under21(intent["role"], intent.get("max_age",21), intent.get("take",3))
         elif intent["type"] == "budget_attackers":
@@ -1887,21 +1886,48 @@ Cosa ti interessa di più?"""
         elif intent["type"] == "generic":
             # More strict validation before using LLM
             if intent.get("needs_validation"):
-                reply = self._validated_llm_complete(user_text, context_messages=[], state=st)
+                reply = self._validated_llm_complete(user_text, context_messages=[], state=st, on_token=on_token)
             else:
-                reply = self._llm_complete(user_text, context_messages=[], state=st)
+                reply = self._llm_complete(user_text, context_messages=[], state=st, on_token=on_token)
             if not reply or "non disponibile" in reply.lower() or reply.strip() == "":
-                reply = "Dimmi: *formazione 5-3-2 500*, *top attaccanti budget 150*, *2 difensori under 21*, oppure *strategia asta*."
+                reply = self._NO_ANSWER_REPLY
         else:
-            reply = "Non ho capito la richiesta. Prova con: *formazione 5-3-2 500*, *top attaccanti budget 150*, *2 difensori under 21*, oppure *strategia asta*."
-
-        st["last_intent"] = intent
+            reply = self._NOT_UNDERSTOOD_REPLY
         return reply
 
+    def _data_fingerprint(self) -> str:
+        """Content hash of roster + corrections, stable across processes (memoized per data version)."""
+        version = self._data_version()
+        memo = self._fingerprint_memo
+        if memo is not None and memo[0] == version:
+            return memo[1]
+        cm = self.corrections_manager
+        corrections = dataclasses.replace(cm.snapshot(), version=0) if cm is not None and hasattr(cm, "snapshot") else None
+        try:
+            fp = digest([self.filtered_roster, corrections])
+        except UncacheableArgs:
+            fp = f"local:{os.getpid()}:{id(self)}:{version}"
+        self._fingerprint_memo = (version, fp)
+        return fp
+
+    def _response_cache_namespace(self, mode: str, intent: Dict[str, Any],
+                                  st: Optional[Dict[str, Any]] = None) -> str:
+        params = {k: v for k, v in intent.items() if k not in ("raw", "original_text")}
+        # esclusioni di sessione: sia quelle nello stato sia quelle copiate nel corrections manager
+        cm_cache = getattr(self.corrections_manager, "_excluded_players_cache", None) or {}
+        exclusions = [sorted((st or {}).get("excluded_players") or []),
+                      sorted((team, sorted(names)) for team, names in cm_cache.items())]
+        return digest([self._data_fingerprint(), exclusions, mode, params])
+
     def respond(self, user_text: str, mode: str = "classic",
                 state: Optional[Dict[str, Any]] = None,
-                context_messages: Optional[List[Dict[str, str]]] = None) -> Tuple[str, Dict[str, Any]]:
-        """Main response method that applies corrections and filters"""
+                context_messages: Optional[List[Dict[str, str]]] = None,
+                on_token: Optional[Callable[[str], None]] = None) -> Tuple[str, Dict[str, Any]]:
+        """Main response method that applies corrections and filters.
+
+        ``on_token`` receives LLM tokens as they are generated (streaming); the
+        returned reply is the final, corrected text.
+        """
         state = state or {}
 
         # Initialize conversation history if not present
@@ -1923,7 +1949,7 @@ Cosa ti interessa di più?"""
 
         if not response:
             # Get response from main logic if no conversational response
-            response = self.get_response(user_text, mode=mode, context=state)
+            response = self.get_response(user_text, mode=mode, context=state, on_token=on_token)
 
         # Apply corrections if corrections manager is available
         if self.corrections_manager:
@@ -2046,15 +2072,20 @@ Cosa ti interessa di più?"""
             # Increase search results when user wants to see all transfers
             search_limit = 200 if show_all else 25
 
-            for term in search_terms:
-                try:
-                    results = self.km.search_knowledge(
-                        text=term, 
-                        n_results=search_limit,
-                        include=["documents", "metadatas"]
-                    )
+            # One batched encode + one multi-query Chroma request for all terms
+            try:
+                batch_results = self.km.search_knowledge_batch(
+                    search_terms,
+                    n_results=search_limit,
+                    include=["documents", "metadatas"]
+                )
+            except Exception as e:
+                LOG.debug(f"Error searching knowledge for {search_terms}: {e}")
+                batch_results = []
 
-                    if results and "metadatas" in results:
+            for term, results in zip(search_terms, batch_results):
+                try:
+                    if results and results.get("metadatas"):
                         for metadata_list in results["metadatas"]:
                             for metadata in metadata_list:
                                 if (metadata.get("type") == "transfer" and 
@@ -2574,33 +2605,63 @@ Cosa ti interessa di più?"""
 
     def _get_roster_context(self) -> str:
         """Get a representative sample of roster data for LLM context"""
-        if not hasattr(self, 'filtered_roster') or not self.filtered_roster:
-            return "ROSTER VUOTO - aggiornare i dati"
+        return self._prompt().roster_context
 
-        # Get top players by role for context
-        context_parts = []
+    def _prompt(self) -> "PromptArtifact":
+        """Prompt artifact for the current roster/corrections version.
 
-        for role in ["A", "C", "D", "P"]:
-            role_players = [p for p in self.filtered_roster if self._role_bucket(p.get("role") or "") == role]
+        Built once per (snapshot version, corrections version) and shared by
+        all threads; a chat turn only pays for a dict lookup.
+        """
+        if not getattr(self, "filtered_roster", None):
+            key = (0, self._corrections_version())
+        else:
+            key = (self._snapshot().version, self._corrections_version())
+        art = self._prompt_artifact
+        if art is not None and art.key == key:
+            return art
+        with self._prompt_lock:
+            art = self._prompt_artifact
+            if art is None or art.key != key:
+                t0 = time.perf_counter()
+                art = self._build_prompt_artifact(key)
+                self._prompt_artifact = art
+                LOG.info("[Assistant] Prompt artifact v%s built in %.1f ms", key,
+                         (time.perf_counter() - t0) * 1000)
+        return art
+
+    def _build_prompt_artifact(self, key: Tuple[int, int]) -> "PromptArtifact":
+        roster = getattr(self, "filtered_roster", None) or []
+        by_role: Dict[str, List[Dict[str, Any]]] = {}
+        for p in roster:
+            by_role.setdefault(self._role_bucket(p.get("role") or ""), []).append(p)
+        for players in by_role.values():
             # Sort by fantamedia desc, then by price asc
-            role_players.sort(key=lambda x: (-(x.get("_fm") or 0.0), (x.get("_price") or 9999.0)))
+            players.sort(key=lambda x: (-(x.get("_fm") or 0.0), (x.get("_price") or 9999.0)))
+
+        roster_context = self._render_roster_context(roster, by_role)
+        role_context = {}
+        for role, title in (("A", "ATTACCANTI"), ("C", "CENTROCAMPISTI")):
+            if by_role.get(role):
+                lines = [f"- {_player_line(p, '')}" for p in by_role[role][:8]]
+                role_context[role] = f"{title} DISPONIBILI NEL ROSTER:\n" + "\n".join(lines)
+        return PromptArtifact(key=key, roster_context=roster_context,
+                              system_prompt=self._render_system_prompt(roster_context),
+                              role_context=role_context)
+
+    @staticmethod
+    def _render_roster_context(roster: List[Dict[str, Any]],
+                               by_role: Dict[str, List[Dict[str, Any]]]) -> str:
+        if not roster:
+            return "ROSTER VUOTO - aggiornare i dati"
 
+        # Get top players by role for context
+        context_parts = [f"ROSTER CORRENTE ({len(roster)} giocatori Serie A 2024-25/2025-26):"]
+        for role in ["A", "C", "D", "P"]:
             role_name = {"A": "Attaccanti", "C": "Centrocampisti", "D": "Difensori", "P": "Portieri"}[role]
             context_parts.append(f"\n{role_name} TOP (roster corrente):")
-
-            for i, p in enumerate(role_players[:5]):  # Top 5 per ruolo
-                name = p.get("name", "N/D")
-                team = p.get("team", "N/D")
-                fm = p.get("_fm")
-                price = p.get("_price")
-
-                fm_str = f"FM {fm:.2f}" if isinstance(fm, (int, float)) else "FM N/D"
-                price_str = f"€{int(price)}" if isinstance(price, (int, float)) else "€N/D"
-
-                context_parts.append(f"  {i+1}. {name} ({team}) - {fm_str}, {price_str}")
-
-        total_players = len(self.filtered_roster)
-        context_parts.insert(0, f"ROSTER CORRENTE ({total_players} giocatori Serie A 2024-25/2025-26):")
+            for i, p in enumerate(by_role.get(role, [])[:5]):  # Top 5 per ruolo
+                context_parts.append(f"  {i+1}. {_player_line(p, 'N/D')}")
 
         return "\n".join(context_parts)
 
@@ -2741,7 +2802,8 @@ Cosa ti interessa di più?"""
 
     # LLM with enhanced validation
     # -----------------------------
-    def _validated_llm_complete(self, user_text: str, context_messages: List[Dict[str, str]] = None, state: Dict[str, Any] = None) -> str:
+    def _validated_llm_complete(self, user_text: str, context_messages: List[Dict[str, str]] = None, state: Dict[str, Any] = None,
+                                on_token: Optional[Callable[[str], None]] = None) -> str:
         """LLM completion with extra validation and constraints"""
         # Pre-validation: If the query seems like it should have been caught by structured handlers, redirect
         lt = user_text.lower()
@@ -2751,7 +2813,7 @@ Cosa ti interessa di più?"""
             return "🤖 Per richieste specifiche sui giocatori, usa comandi strutturati: *formazione 5-3-2 500*, *top attaccanti budget 150*, o *3 difensori under 21*"
         
         # If we proceed to LLM, use stricter constraints
-        result = self._llm_complete(user_text, context_messages, state)
+        result = self._llm_complete(user_text, context_messages, state, on_token=on_token)
         
         # Post-validation: Check if LLM mentioned specific players
         if result and any(name in result for name in ["Lautaro", "Lukaku", "Dimarco", "Theo", "Barella"]):
@@ -2762,118 +2824,94 @@ Cosa ti interessa di più?"""
 
     # LLM (fallback generico)
     # ---------------------------
-    def _llm_complete(self, user_text: str, context_messages: List[Dict[str, str]] = None, state: Dict[str, Any] = None) -> str:
-        """Complete using LLM with conversation context"""
+    def _llm_complete(self, user_text: str, context_messages: List[Dict[str, str]] = None, state: Dict[str, Any] = None,
+                      on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Complete using LLM with conversation context.
+
+        With ``on_token`` the completion is streamed and every content delta is
+        passed to the callback as it arrives; the validated full text is returned.
+        """
         if not self.openai_api_key:
             LOG.warning("[Assistant] OPENAI_API_KEY not set, cannot use LLM.")
             return "⚠️ Servizio AI temporaneamente non disponibile. Configura OPENAI_API_KEY."
 
         try:
-            import httpx
-
-            # Build messages with context
-            messages = [{"role": "system", "content": self._get_system_prompt()}]
-
-            # Add conversation history from state for better context
-            if state and "conversation_history" in state:
-                # Get last 6 messages (3 exchanges) for context
-                recent_history = state["conversation_history"][-6:]
-                for msg in recent_history:
-                    if msg.get("role") in ["user", "assistant"]:
-                        messages.append({
-                            "role": msg["role"],
-                            "content": msg["content"]
-                        })
-
-            # Add external context messages if provided
-            if context_messages:
-                messages.extend(context_messages)
-
-            # Add specific context for different query types
-            user_lower = user_text.lower()
-
-            # Enhanced context for specific queries
-            if any(term in user_lower for term in ["attaccant", "miglior", "top", "punta"]):
-                attackers = [p for p in self.filtered_roster if self._role_bucket(p.get("role") or "") == "A"]
-                if attackers:
-                    attackers.sort(key=lambda x: (-(x.get("_fm") or 0.0), (x.get("_price") or 9999.0)))
-                    top_attackers = []
-                    for p in attackers[:8]:
-                        name = p.get("name", "")
-                        team = p.get("team", "")
-                        fm = p.get("_fm")
-                        price = p.get("_price")
-                        fm_str = f"FM {fm:.2f}" if isinstance(fm, (int, float)) else "FM N/D"
-                        price_str = f"€{int(price)}" if isinstance(price, (int, float)) else "€N/D"
-                        top_attackers.append(f"- {name} ({team}) - {fm_str}, {price_str}")
-
-                    roster_context = f"ATTACCANTI DISPONIBILI NEL ROSTER:\n" + "\n".join(top_attackers)
-                    messages.append({"role": "system", "content": roster_context})
-
-            elif any(term in user_lower for term in ["centrocamp", "mediano", "mezz"]):
-                midfielders = [p for p in self.filtered_roster if self._role_bucket(p.get("role") or "") == "C"]
-                if midfielders:
-                    midfielders.sort(key=lambda x: (-(x.get("_fm") or 0.0), (x.get("_price") or 9999.0)))
-                    top_mids = []
-                    for p in midfielders[:8]:
-                        name = p.get("name", "")
-                        team = p.get("team", "")
-                        fm = p.get("_fm")
-                        price = p.get("_price")
-                        fm_str = f"FM {fm:.2f}" if isinstance(fm, (int, float)) else "FM N/D"
-                        price_str = f"€{int(price)}" if isinstance(price, (int, float)) else "€N/D"
-                        top_mids.append(f"- {name} ({team}) - {fm_str}, {price_str}")
-
-                    roster_context = f"CENTROCAMPISTI DISPONIBILI NEL ROSTER:\n" + "\n".join(top_mids)
-                    messages.append({"role": "system", "content": roster_context})
-
-            # Don't add the user message again if it's already in conversation history
-            if not (state and "conversation_history" in state and 
-                   state["conversation_history"] and 
-                   state["conversation_history"][-1].get("content") == user_text):
-                messages.append({"role": "user", "content": user_text})
-
-            headers = {
-                "Authorization": f"Bearer {self.openai_api_key}",
-                "Content-Type": "application/json"
-            }
-
-            payload = {
-                "model": self.openai_model,
-                "temperature": self.openai_temperature,
-                "max_tokens": self.openai_max_tokens,
-                "messages": messages
-            }
+            messages = self._build_llm_messages(user_text, context_messages, state)
+            client = get_llm_client()
+            params = dict(model=self.openai_model, temperature=self.openai_temperature,
+                          max_tokens=self.openai_max_tokens, api_key=self.openai_api_key)
 
             LOG.debug("[Assistant] Calling OpenAI API with enhanced context")
 
-            with httpx.Client(timeout=60.0) as client:
-                resp = client.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers=headers,
-                    json=payload
-                )
-                resp.raise_for_status()
-                data = resp.json()
-                response_content = data["choices"][0]["message"]["content"].strip()
+            if on_token is not None:
+                parts = []
+                for delta in client.stream(messages, **params):
+                    parts.append(delta)
+                    on_token(delta)
+                response_content = "".join(parts).strip()
+            else:
+                response_content = client.complete(messages, **params)
 
-                # Additional validation: ensure response doesn't mention players not in roster
-                if self._contains_invalid_players(response_content):
-                    LOG.warning("[Assistant] LLM response contained invalid players, filtering...")
-                    response_content = self._filter_invalid_players(response_content)
+            # Additional validation: ensure response doesn't mention players not in roster
+            if self._contains_invalid_players(response_content):
+                LOG.warning("[Assistant] LLM response contained invalid players, filtering...")
+                response_content = self._filter_invalid_players(response_content)
 
-                LOG.debug("[Assistant] OpenAI API response validated")
-                return response_content
+            LOG.debug("[Assistant] OpenAI API response validated")
+            return response_content
 
         except Exception as e:
             LOG.error("[Assistant] Errore OpenAI: %s", e)
             return "⚠️ Servizio AI momentaneamente non disponibile. Prova con: *formazione 4-3-3*, *top attaccanti budget 150*, o *difensori under 21*."
 
+    def _build_llm_messages(self, user_text: str, context_messages: List[Dict[str, str]] = None,
+                            state: Dict[str, Any] = None) -> List[Dict[str, str]]:
+        """System prompt + recent history + query-specific roster context + user turn"""
+        # Build messages with context
+        messages = [{"role": "system", "content": self._get_system_prompt()}]
+
+        # Add conversation history from state for better context
+        if state and "conversation_history" in state:
+            # Get last 6 messages (3 exchanges) for context
+            recent_history = state["conversation_history"][-6:]
+            for msg in recent_history:
+                if msg.get("role") in ["user", "assistant"]:
+                    messages.append({
+                        "role": msg["role"],
+                        "content": msg["content"]
+                    })
+
+        # Add external context messages if provided
+        if context_messages:
+            messages.extend(context_messages)
+
+        # Add specific context for different query types
+        user_lower = user_text.lower()
+
+        # Enhanced context for specific queries (precomputed per roster version)
+        role_context = self._prompt().role_context
+        if any(term in user_lower for term in ["attaccant", "miglior", "top", "punta"]):
+            if "A" in role_context:
+                messages.append({"role": "system", "content": role_context["A"]})
+
+        elif any(term in user_lower for term in ["centrocamp", "mediano", "mezz"]):
+            if "C" in role_context:
+                messages.append({"role": "system", "content": role_context["C"]})
+
+        # Don't add the user message again if it's already in conversation history
+        if not (state and "conversation_history" in state and 
+               state["conversation_history"] and 
+               state["conversation_history"][-1].get("content") == user_text):
+            messages.append({"role": "user", "content": user_text})
+
+        return messages
+
     def _get_system_prompt(self) -> str:
         """Get enhanced system prompt for LLM with current roster context"""
-        # Get a sample of current roster data for context
-        roster_context = self._get_roster_context()
+        return self._prompt().system_prompt
 
+    @staticmethod
+    def _render_system_prompt(roster_context: str) -> str:
         return f"""Sei un assistente esperto e amichevole di fantacalcio italiano. Parla come un amico esperto che conosce bene il fantacalcio.
 
 PERSONALITÀ:
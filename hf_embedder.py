@@ -2,7 +2,9 @@ import os
 import time
 import sqlite3
 import hashlib
-from typing import List
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
 import numpy as np
 from huggingface_hub import InferenceClient
 
@@ -11,6 +13,8 @@ HF_TOKEN = os.environ.get("HF_TOKEN", "")
 # Modello di default: multilingue, supporta feature-extraction su Inference API
 DEFAULT_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 MODEL = os.environ.get("HF_EMBED_MODEL", DEFAULT_MODEL)
+# Voci tenute nella LRU in memoria davanti alla cache SQLite (0 = disattivata)
+EMBED_CACHE_LRU = int(os.environ.get("HF_EMBED_CACHE_LRU", "10000"))
 
 os.environ.setdefault("HF_HOME", "./.cache/huggingface")
 os.environ.setdefault("TRANSFORMERS_CACHE", "./.cache/huggingface")
@@ -19,27 +23,100 @@ def _use_e5_prefixes(model_name: str) -> bool:
     return "e5" in model_name.lower()
 
 class _Cache:
-    def __init__(self, path: str = "./embedding_cache.sqlite"):
-        self.conn = sqlite3.connect(path, check_same_thread=False)
-        self.conn.execute("CREATE TABLE IF NOT EXISTS cache (k TEXT PRIMARY KEY, v BLOB)")
-        self.conn.commit()
+    """
+    Cache SQLite degli embedding (vettori float32 come BLOB).
+
+    - WAL + synchronous=NORMAL, una connessione riusata per thread;
+    - get_many/set_many: una query IN (...) e una sola transazione per batch;
+    - LRU in memoria opzionale davanti a SQLite (lru_size=0 la disattiva).
+    """
+
+    _MAX_VARS = 500  # sotto il limite SQLITE_MAX_VARIABLE_NUMBER delle build vecchie (999)
+
+    def __init__(self, path: str = "./embedding_cache.sqlite", lru_size: int = EMBED_CACHE_LRU):
+        self.path = path
+        self._local = threading.local()
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lru_size = max(0, int(lru_size))
+        self._lru_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS cache (k TEXT PRIMARY KEY, v BLOB)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
 
     @staticmethod
     def _k(model: str, text: str, prefix: str) -> str:
         return hashlib.sha256((model + "|" + prefix + text).encode("utf-8")).hexdigest()
 
-    def get(self, model: str, text: str, prefix: str):
-        k = self._k(model, text, prefix)
-        cur = self.conn.execute("SELECT v FROM cache WHERE k=?", (k,))
-        row = cur.fetchone()
-        if not row:
+    # ---------- LRU front ----------
+    def _lru_get(self, k: str) -> Optional[np.ndarray]:
+        if not self._lru_size:
             return None
-        return np.frombuffer(row[0], dtype=np.float32)
+        with self._lru_lock:
+            v = self._lru.get(k)
+            if v is not None:
+                self._lru.move_to_end(k)
+            return v
+
+    def _lru_put(self, k: str, v: np.ndarray) -> None:
+        if not self._lru_size:
+            return
+        with self._lru_lock:
+            self._lru[k] = v
+            self._lru.move_to_end(k)
+            while len(self._lru) > self._lru_size:
+                self._lru.popitem(last=False)
+
+    # ---------- batch API ----------
+    def get_many(self, model: str, texts: Sequence[str], prefix: str) -> List[Optional[np.ndarray]]:
+        keys = [self._k(model, t, prefix) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        missing = []
+        for k in dict.fromkeys(keys):
+            v = self._lru_get(k)
+            if v is None:
+                missing.append(k)
+            else:
+                found[k] = v
+        conn = self._conn()
+        for s in range(0, len(missing), self._MAX_VARS):
+            chunk = missing[s:s + self._MAX_VARS]
+            rows = conn.execute(
+                f"SELECT k, v FROM cache WHERE k IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            for k, blob in rows:
+                v = np.frombuffer(blob, dtype=np.float32)
+                found[k] = v
+                self._lru_put(k, v)
+        return [found.get(k) for k in keys]
+
+    def set_many(self, model: str, texts: Sequence[str], prefix: str, vecs: Sequence[np.ndarray]) -> None:
+        rows = []
+        for t, vec in zip(texts, vecs):
+            k = self._k(model, t, prefix)
+            v = np.ascontiguousarray(vec, dtype=np.float32)
+            rows.append((k, v.tobytes()))
+            self._lru_put(k, v)
+        if not rows:
+            return
+        conn = self._conn()
+        with conn:  # una transazione (un solo commit/fsync) per tutto il batch
+            conn.executemany("INSERT OR REPLACE INTO cache(k, v) VALUES(?, ?)", rows)
+
+    # ---------- single-item API ----------
+    def get(self, model: str, text: str, prefix: str):
+        return self.get_many(model, [text], prefix)[0]
 
     def set(self, model: str, text: str, prefix: str, vec: np.ndarray):
-        k = self._k(model, text, prefix)
-        self.conn.execute("INSERT OR REPLACE INTO cache(k, v) VALUES(?, ?)", (k, vec.astype(np.float32).tobytes()))
-        self.conn.commit()
+        self.set_many(model, [text], prefix, [vec])
 
 def _l2norm(x: np.ndarray) -> np.ndarray:
     n = np.linalg.norm(x, axis=1, keepdims=True) + 1e-12
@@ -75,21 +152,22 @@ class HFEmbedder:
             prefix = "query: " if is_query else "passage: "
 
         out = [None] * len(texts)
-        to_send, idxs = [], []
-
-        # cache lookup
-        for i, t in enumerate(texts):
-            c = self.cache.get(self.model, t, prefix)
-            if c is None:
-                to_send.append(prefix + t)
-                idxs.append(i)
-            else:
+        to_send, pending = [], {}
+
+        # cache lookup (una query per tutto il batch); i duplicati vengono inviati una volta sola
+        for i, (t, c) in enumerate(zip(texts, self.cache.get_many(self.model, texts, prefix))):
+            if c is not None:
                 out[i] = c
+            elif t in pending:
+                pending[t].append(i)
+            else:
+                pending[t] = [i]
+                to_send.append(t)
 
         # remote batches
         for s in range(0, len(to_send), self.batch_size):
             batch = to_send[s:s + self.batch_size]
-            resp = self._remote_embed_batch(batch)
+            resp = self._remote_embed_batch([prefix + t for t in batch])
 
             # --- parsing robusto: gestisce 1D / 2D / 3D ---
             arr = np.array(resp, dtype=np.float32)
@@ -107,10 +185,11 @@ class HFEmbedder:
 
             vecs = _l2norm(vecs)
 
-            for j, v in enumerate(vecs):
-                i = idxs[s + j]
-                out[i] = v
-                self.cache.set(self.model, texts[i], prefix, v)
+            for t, v in zip(batch, vecs):
+                for i in pending[t]:
+                    out[i] = v
+            # un commit per batch remoto: i batch gia' pagati restano in cache anche se il successivo fallisce
+            self.cache.set_many(self.model, batch, prefix, vecs)
 
         return np.stack(out, axis=0).astype(np.float32)
 
@@ -1,5 +1,5 @@
 # ingest_cli.py
-# Ingest di file .jsonl nella collection Chroma + rebuild indici RAG
+# Ingest di file .jsonl nella collection Chroma + aggiornamento indice BM25
 # Uso:
 #   python ingest_cli.py --files data1.jsonl data2.jsonl
 #   python ingest_cli.py --dir ./datasets/jsonl --reset
@@ -13,8 +13,8 @@ import argparse
 from typing import List
 
 from knowledge_manager import KnowledgeManager
-from retrieval.helpers import dump_chroma_texts_ids
-from retrieval.rag_pipeline import RAGPipeline
+from config import BM25_INDEX_PATH
+from retrieval.hybrid import BM25Index
 
 def find_jsonl_in_dir(d: str) -> List[str]:
     return sorted(glob.glob(os.path.join(d, "*.jsonl")))
@@ -70,13 +70,17 @@ def main():
         print(f"[CLI]   -> aggiunti: {added}")
         total += added
 
-    # Ricostruisci RAG (BM25) dopo l’ingest
+    # Indice BM25 persistente: ricostruito solo con --reset o se non allineato alla collection,
+    # altrimenti si limita a compattare il delta log
     try:
-        texts, ids = dump_chroma_texts_ids(km.collection)
-        rag = RAGPipeline(km.collection, texts, ids)
-        print(f"[CLI] RAG ricostruito. Documenti indicizzati: {len(ids)}")
+        if args.reset:
+            bm25 = BM25Index.rebuild(BM25_INDEX_PATH, km.collection)
+        else:
+            bm25 = BM25Index.open(BM25_INDEX_PATH, km.collection)
+            bm25.compact()
+        print(f"[CLI] Indice BM25 aggiornato. Documenti indicizzati: {len(bm25)}")
     except Exception as e:
-        print("[CLI] Warning: ricostruzione RAG fallita:", e)
+        print("[CLI] Warning: aggiornamento indice BM25 fallito:", e)
 
     print(f"[CLI] DONE. Totale documenti caricati: {total}. Count collection: {km.count()}")
 
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Single-pass slot extraction for ``FantacalcioAssistant._parse_intent``.
+
+Every keyword the intent rules look at (plus the team names) is compiled into
+one prefix-factored alternation, and ``IntentMatcher.scan`` walks the text
+once: keyword hits become tags, and the slot patterns (player counts,
+formation, budget, ages, ...) are only tried, anchored, where the scan finds a
+digit run or the word that starts them.  All slots come back together.
+
+Keywords are matched as substrings, exactly like the ``"x" in text`` checks
+they replace: the alternation sits in a lookahead tried at every position,
+longest word first, and each keyword also carries the tags of every shorter
+keyword it contains (if "portieri" is in the text, so is "portier").
+"""
+import re
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Sequence, Set, Tuple
+
+SERIE_A_TEAMS: Tuple[str, ...] = (
+    "inter", "milan", "juventus", "napoli", "roma", "lazio", "atalanta", "fiorentina", "bologna", "torino",
+    "genoa", "udinese", "cagliari", "lecce", "empoli", "monza", "venezia", "verona", "como", "parma",
+)
+
+# tag -> keywords (substring semantics)
+INTENT_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "budget": ("budget",),
+    "gk_simple": ("portieri", "portiere", "goalkeeper", "gk"),
+    "top": ("top", "migliori", "miglior"),
+    "portier": ("portier",),
+    "team_formation": ("formazione", "titolare", "squadra", "rosa", "lineup"),
+    "transfers": ("ultimi acquisti", "acquisiti", "nuovi acquisti", "trasferimenti", "mercato", "acquisti"),
+    "formazione": ("formazione",),
+    # under 21/23: vincolo nelle richieste complesse, nella formazione e intent "under"
+    "complex_u21": ("under 21", "u21"),
+    "complex_u23": ("under 23", "u23"),
+    "fm_u21": ("under 21", "under-21", "under21", "u21"),
+    "fm_u23": ("under 23", "under-23", "under23", "u23"),
+    "under": ("under 21", "under-21", "under21", "u21", "under 23", "u23"),
+    "has_23": ("23",),
+    "under_D": ("difensor", "terzin", "centrale"),
+    "under_C": ("centrocamp", "mezzala", "regista"),
+    # ruoli per le richieste top (ordine A, C, D, P)
+    "role_A": ("attacc", "punta", "attaccanti"),
+    "role_C": ("centrocamp", "mediano", "mezzala", "centrocampisti"),
+    "role_D": ("difensor", "difensori", "terzin", "centrale"),
+    "role_P": ("portier", "portieri", "goalkeeper"),
+    "attackers": ("attacc", "top attaccanti", "punta"),
+    "strategia": ("strategia",),
+    "asta": ("asta",),
+    "comparison": ("vs", "contro", "meglio", "confronto", "compara"),
+    "advice": ("consiglio", "consigli", "strategia", "tattica", "suggerimento"),
+    "season": ("stagione", "campionato", "serie a", "giornata"),
+}
+
+_COUNT_ROLES = (("P", "portier"), ("D", "difens"), ("C", "centrocamp"), ("A", "attaccan"))
+
+# Slot patterns, anchored where the scan finds a digit run or the word that starts them
+_COUNT_RE = re.compile(r"(\d+)\s*(portier|difens|centrocamp|attaccan)")
+_FORMATION_RE = re.compile(r"\b[0-5]\s*-\s*[0-5]\s*-\s*[0-5]\b")
+_INT_RE = re.compile(r"\b(\d{2,4})\b")
+_TAKE_RE = re.compile(r"\b(\d)\s+(?:nomi|giocatori|attaccant)\b")
+_BUDGET_RE = re.compile(r"budget.*?(\d{2,4})")
+_UNDER_AGE_RE = re.compile(r"under\s*(\d+)")
+
+
+def trie_regex(words: Sequence[str]) -> str:
+    """Alternation of ``words`` factored by common prefix (longest match first)."""
+    trie: Dict[str, dict] = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if "" in node:
+            body = f"(?:{body})?"
+        return body
+
+    return build(trie)
+
+
+@dataclass
+class IntentSlots:
+    """Everything ``_parse_intent`` needs from one scan of the lowercased text."""
+    tags: Set[str]
+    team: Optional[str]                      # prima squadra nell'ordine di SERIE_A_TEAMS, titolata
+    player_counts: List[Tuple[str, int]]     # [(ruolo, n)] in ordine P, D, C, A
+    formation: Optional[str]                 # es. "4-3-3" (testo originale del match)
+    first_int: Optional[int]                 # primo numero di 2-4 cifre
+    budget: Optional[int]                    # primo numero dopo "budget"
+    under_age: Optional[int]                 # primo "under N"
+    take: Optional[int]                      # "3 nomi" / "2 giocatori"
+
+    def has(self, tag: str) -> bool:
+        return tag in self.tags
+
+
+class IntentMatcher:
+    def __init__(self, keywords: Dict[str, Sequence[str]] = INTENT_KEYWORDS,
+                 teams: Sequence[str] = SERIE_A_TEAMS):
+        tags_of: Dict[str, set] = {"budget": set(), "under": set()}  # parole che ancorano uno slot
+        for tag, words in keywords.items():
+            for w in words:
+                tags_of.setdefault(w, set()).add(tag)
+        for i, team in enumerate(teams):
+            tags_of.setdefault(team, set()).add(f"team:{i}")
+        # un keyword porta con se' i tag di ogni keyword piu' corto che contiene
+        self._tags: Dict[str, FrozenSet[str]] = {
+            w: frozenset().union(*(tags_of[o] for o in tags_of if o in w)) for w in tags_of
+        }
+        self._teams = tuple(teams)
+        # keyword -> (tag, indice della prima squadra contenuta o None, slot ancorato alla parola)
+        self._info: Dict[str, Tuple[FrozenSet[str], Optional[int], Optional[str]]] = {}
+        for w, tags in self._tags.items():
+            teams_in = [int(t[5:]) for t in tags if t.startswith("team:")]
+            anchor = "budget" if w.startswith("budget") else "under" if w.startswith("under") else None
+            self._info[w] = (tags, min(teams_in) if teams_in else None, anchor)
+        # lookahead: a ogni posizione il keyword piu' lungo che inizia li' (match sovrapposti inclusi),
+        # oppure l'inizio di una sequenza di cifre
+        self._pattern = re.compile(f"(?=({trie_regex(list(tags_of))}|(?<!\\d)\\d))")
+
+    def scan(self, lt: str) -> IntentSlots:
+        tags: Set[str] = set()
+        counts: Dict[str, int] = {}
+        team_idx = formation = first_int = budget = under_age = take = None
+        budget_seen = False
+        for m in self._pattern.finditer(lt):
+            word = m.group(1)
+            info = self._info.get(word)
+            if info is not None:
+                tags |= info[0]
+                if info[1] is not None and (team_idx is None or info[1] < team_idx):
+                    team_idx = info[1]
+                if info[2] == "budget" and not budget_seen:
+                    budget_seen = True  # il primo "budget" e' anche il match piu' a sinistra
+                    b = _BUDGET_RE.match(lt, m.start())
+                    budget = int(b.group(1)) if b is not None else None
+                elif info[2] == "under" and under_age is None:
+                    u = _UNDER_AGE_RE.match(lt, m.start())
+                    under_age = int(u.group(1)) if u is not None else None
+            if word[0].isdecimal():
+                pos = m.start()
+                if pos and lt[pos - 1].isdecimal():
+                    continue  # keyword numerico ("23") a meta' di una sequenza di cifre
+                # inizio di una sequenza di cifre: qui partono conteggi, modulo, budget, "3 nomi"
+                c = _COUNT_RE.match(lt, pos)
+                if c is not None:
+                    counts.setdefault(c.group(2), int(c.group(1)))
+                if formation is None:
+                    f = _FORMATION_RE.match(lt, pos)
+                    formation = f.group(0) if f is not None else None
+                if first_int is None:
+                    i = _INT_RE.match(lt, pos)
+                    first_int = int(i.group(1)) if i is not None else None
+                if take is None:
+                    t = _TAKE_RE.match(lt, pos)
+                    take = int(t.group(1)) if t is not None else None
+
+        return IntentSlots(
+            tags=tags,
+            team=self._teams[team_idx].title() if team_idx is not None else None,
+            player_counts=[(role, counts[stem]) for role, stem in _COUNT_ROLES if stem in counts],
+            formation=formation,
+            first_int=first_int,
+            budget=budget,
+            under_age=under_age,
+            take=take,
+        )
+
+
+_matcher: Optional[IntentMatcher] = None
+
+
+def get_intent_matcher() -> IntentMatcher:
+    global _matcher
+    if _matcher is None:
+        _matcher = IntentMatcher()
+    return _matcher
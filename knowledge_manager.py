@@ -11,6 +11,10 @@ import chromadb
 from chromadb.config import Settings
 from chromadb.utils import embedding_functions
 
+from config import BM25_INDEX_PATH, KM_ADD_CHUNK_SIZE, KM_ENCODE_BATCH_SIZE, KM_EMBED_MODEL
+from model_registry import get_sentence_transformer
+from retrieval.hybrid import append_documents
+
 LOG = logging.getLogger("knowledge_manager")
 logging.basicConfig(
     level=os.environ.get("LOG_LEVEL", "INFO"),
@@ -119,33 +123,20 @@ class KnowledgeManager:
 
         self.collection_name = collection_name
 
-        # Lazy load SentenceTransformer model for faster startup
+        # Lazy load SentenceTransformer model for faster startup (shared per process, see model_registry)
         self.model = None
-        self._model_loading = False
         LOG.info("🚀 KnowledgeManager initialized with lazy model loading")
 
     def _ensure_model_loaded(self):
         """Lazy load SentenceTransformer model when needed"""
         if self.model is not None:
             return
-
-        if self._model_loading:
-            # Another thread is loading, wait briefly
-            import time
-            time.sleep(0.1)
-            return
-
-        self._model_loading = True
         try:
-            LOG.info("🔄 Loading SentenceTransformer model on-demand...")
-            from sentence_transformers import SentenceTransformer
-            self.model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-            LOG.info("✅ SentenceTransformer model loaded successfully")
+            # Loaded once per process: concurrent first calls wait on the same load
+            self.model = get_sentence_transformer(KM_EMBED_MODEL)
         except Exception as e:
             LOG.error(f"❌ Failed to load SentenceTransformer model: {e}")
             self.model = None
-        finally:
-            self._model_loading = False
 
     # ---------- filter normalization ----------
     def _normalize_where(self, where: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
@@ -209,13 +200,42 @@ class KnowledgeManager:
         out = {k: res.get(k) for k in ("documents", "metadatas", "distances", "ids") if k in include or k == "ids"}
         return out
 
-    def add_knowledge(self, text: str, metadata: Optional[Dict[str, Any]] = None, 
-                     id: Optional[str] = None) -> None:
-        """Add a single document to the knowledge base"""
-        import uuid
-        if id is None:
-            id = str(uuid.uuid4())
+    def search_knowledge_batch(self,
+                               queries: List[str],
+                               n_results: int = 20,
+                               where: Optional[Dict[str, Any]] = None,
+                               include: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Come search_knowledge per più testi: un solo encode in batch e una sola query
+        Chroma multi-query. Ritorna un risultato per query, nello stesso formato.
+        """
+        queries = list(queries or [])
+        if not queries:
+            return []
+        include = include or ["documents", "metadatas", "distances"]
+        include = [x for x in include if x in {"documents", "embeddings", "metadatas", "distances", "uris", "data"}]
+
+        self._ensure_model_loaded()
+        if self.model is None:
+            return [self.search_knowledge(q, where=where, n_results=n_results, include=include) for q in queries]
 
+        where_n = self._normalize_where(where)
+        embs = self.model.encode(queries, batch_size=KM_ENCODE_BATCH_SIZE).tolist()
+        res = self.collection.query(
+            query_embeddings=embs,
+            n_results=n_results,
+            where=where_n,
+            include=include
+        )
+        # Chroma restituisce liste annidate per query: le separo mantenendo il formato di search_knowledge
+        keys = [k for k in ("documents", "metadatas", "distances", "ids") if k in include or k == "ids"]
+        out = []
+        for i in range(len(queries)):
+            out.append({k: [res[k][i]] if res.get(k) else None for k in keys})
+        return out
+
+    @staticmethod
+    def _clean_metadata(metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
         # Filter out None values from metadata - ChromaDB only accepts str, int, float, bool
         clean_metadata = {}
         if metadata:
@@ -226,6 +246,16 @@ class KnowledgeManager:
                         clean_metadata[k] = v
                     else:
                         clean_metadata[k] = str(v)
+        return clean_metadata
+
+    def add_knowledge(self, text: str, metadata: Optional[Dict[str, Any]] = None, 
+                     id: Optional[str] = None) -> None:
+        """Add a single document to the knowledge base"""
+        import uuid
+        if id is None:
+            id = str(uuid.uuid4())
+
+        clean_metadata = self._clean_metadata(metadata)
 
         try:
             self.collection.add(
@@ -236,4 +266,43 @@ class KnowledgeManager:
             LOG.debug("[KM] Added document with id: %s", id)
         except Exception as e:
             LOG.error("[KM] Error adding document: %s", e)
-            raise
\ No newline at end of file
+            raise
+        # Aggiornamento incrementale dell'indice BM25 persistente (delta log)
+        try:
+            append_documents(BM25_INDEX_PATH, [text], [id])
+        except Exception as e:
+            LOG.warning("[KM] BM25 index update failed for %s: %s", id, e)
+
+    def add_knowledge_batch(self, texts: List[str], metadatas: Optional[List[Optional[Dict[str, Any]]]] = None,
+                            ids: Optional[List[Optional[str]]] = None,
+                            chunk_size: int = KM_ADD_CHUNK_SIZE) -> List[str]:
+        """
+        Add many documents: embeddings computed in batch with the SentenceTransformer
+        (one encode per chunk) and one Chroma insert per chunk. Returns the ids used.
+        """
+        import uuid
+        n = len(texts)
+        metadatas = list(metadatas) if metadatas is not None else [None] * n
+        ids = [i or str(uuid.uuid4()) for i in (ids if ids is not None else [None] * n)]
+        if len(metadatas) != n or len(ids) != n:
+            raise ValueError("texts, metadatas and ids must have the same length")
+
+        self._ensure_model_loaded()
+        for start in range(0, n, chunk_size):
+            chunk_texts = list(texts[start:start + chunk_size])
+            chunk_ids = ids[start:start + chunk_size]
+            chunk_metas = [self._clean_metadata(m) for m in metadatas[start:start + chunk_size]]
+            kwargs: Dict[str, Any] = {"documents": chunk_texts, "metadatas": chunk_metas, "ids": chunk_ids}
+            if self.model is not None:
+                kwargs["embeddings"] = self.model.encode(chunk_texts, batch_size=KM_ENCODE_BATCH_SIZE).tolist()
+            try:
+                self.collection.add(**kwargs)
+            except Exception as e:
+                LOG.error("[KM] Error adding batch of %d documents: %s", len(chunk_texts), e)
+                raise
+            try:
+                append_documents(BM25_INDEX_PATH, chunk_texts, chunk_ids)
+            except Exception as e:
+                LOG.warning("[KM] BM25 index update failed for batch: %s", e)
+        LOG.info("[KM] Added %d documents in %d chunk(s)", n, (n + chunk_size - 1) // chunk_size if n else 0)
+        return ids
@@ -1,18 +1,160 @@
 # league_chat.py - Real-time chat for fantasy leagues
+#
+# Messages are stored append-only in the league_messages table (SQLite or
+# PostgreSQL, whatever DATABASE_URL points to) and read back in pages.  Room
+# emits reach clients connected to other workers when SocketIO runs with a
+# message queue (SOCKETIO_MESSAGE_QUEUE, e.g. redis://redis:6379/0); presence
+# is kept in Redis when available.  League membership is checked against the
+# database once per connection and then cached until disconnect.
+#
+# Presence is per connection (sid), so a user with two tabs stays active until
+# both are gone.  Each entry carries a last-seen time refreshed by the client
+# heartbeat and expires after LEAGUE_CHAT_PRESENCE_TTL seconds, which also
+# covers connections dropped without a disconnect (crashed worker, lost network).
 import logging
+import threading
+import time
 from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
 from flask import request
 from flask_socketio import emit, join_room, leave_room, rooms
 from flask_login import current_user
 from app import socketio, db
-from models import UserLeague
-from sqlalchemy import text
+from models import UserLeague, LeagueMessage
+from cache_redis import get_redis_cache
+from config import LEAGUE_CHAT_PAGE_SIZE, LEAGUE_CHAT_MAX_PAGE_SIZE, LEAGUE_CHAT_PRESENCE_TTL
 
 LOG = logging.getLogger("league_chat")
 
-# In-memory message store (TODO: Move to Redis or PostgreSQL)
-league_messages = {}
-active_users = {}
+# Presence fallback when Redis is not available (process-local):
+# league_id -> {sid: (user_id, last seen)}
+active_users: Dict[int, Dict[str, Tuple[int, float]]] = {}
+
+# Socket.IO sid -> leagues the connected user has been verified for
+_connection_leagues: Dict[str, Set[int]] = {}
+# Socket.IO sid -> (user_id, leagues whose chat the connection has joined)
+_connection_presence: Dict[str, Tuple[int, Set[int]]] = {}
+_state_lock = threading.Lock()
+
+
+def _league_id(data) -> Optional[int]:
+    try:
+        return int((data or {}).get('league_id'))
+    except (TypeError, ValueError):
+        return None
+
+def _room(league_id: int) -> str:
+    return f'league_{league_id}'
+
+def _is_member(league_id: int) -> bool:
+    """Membership of current_user, from the per-connection cache or (once) from the database"""
+    sid = request.sid
+    with _state_lock:
+        if league_id in _connection_leagues.get(sid, ()):
+            return True
+    league = UserLeague.query.filter_by(
+        id=league_id,
+        user_id=current_user.id
+    ).first()
+    if not league:
+        return False
+    with _state_lock:
+        _connection_leagues.setdefault(sid, set()).add(league_id)
+    return True
+
+def forget_connection(sid: str) -> None:
+    """Drop the membership cache of a disconnected client and its presence"""
+    with _state_lock:
+        _connection_leagues.pop(sid, None)
+        user_id, leagues = _connection_presence.pop(sid, (None, set()))
+    for league_id in leagues:
+        _presence_remove(league_id, sid, user_id)
+
+# Presence -------------------------------------------------------------------
+
+def _presence_key(league_id: int) -> str:
+    return f"league_chat:presence:{league_id}"
+
+def _presence_member(sid: str, user_id: int) -> str:
+    return f"{user_id}:{sid}"
+
+def _presence_add(league_id: int, sid: str, user_id: int) -> None:
+    """Mark (or refresh, for the heartbeat) the connection ``sid`` as active in the league"""
+    now = time.time()
+    with _state_lock:
+        _connection_presence.setdefault(sid, (user_id, set()))[1].add(league_id)
+    cache = get_redis_cache()
+    if cache.enabled and cache.client:
+        try:
+            key = _presence_key(league_id)
+            pipe = cache.client.pipeline()
+            pipe.zadd(key, {_presence_member(sid, user_id): now})
+            pipe.expire(key, LEAGUE_CHAT_PRESENCE_TTL)
+            pipe.execute()
+            return
+        except Exception as e:
+            LOG.warning(f"Redis presence unavailable, using local tracking: {e}")
+    with _state_lock:
+        active_users.setdefault(league_id, {})[sid] = (user_id, now)
+
+def _presence_remove(league_id: int, sid: str, user_id: Optional[int]) -> None:
+    with _state_lock:
+        entry = _connection_presence.get(sid)
+        if entry:
+            entry[1].discard(league_id)
+    cache = get_redis_cache()
+    if cache.enabled and cache.client and user_id is not None:
+        try:
+            cache.client.zrem(_presence_key(league_id), _presence_member(sid, user_id))
+            return
+        except Exception as e:
+            LOG.warning(f"Redis presence unavailable, using local tracking: {e}")
+    with _state_lock:
+        active_users.get(league_id, {}).pop(sid, None)
+
+def _presence_members(league_id: int) -> List[int]:
+    """Distinct user ids with at least one live connection in the league"""
+    cutoff = time.time() - LEAGUE_CHAT_PRESENCE_TTL
+    cache = get_redis_cache()
+    if cache.enabled and cache.client:
+        try:
+            key = _presence_key(league_id)
+            pipe = cache.client.pipeline()
+            pipe.zremrangebyscore(key, "-inf", cutoff)
+            pipe.zrange(key, 0, -1)
+            members = pipe.execute()[1]
+            return sorted({int(m.split(":", 1)[0]) for m in members})
+        except Exception as e:
+            LOG.warning(f"Redis presence unavailable, using local tracking: {e}")
+    with _state_lock:
+        return sorted({uid for uid, seen in active_users.get(league_id, {}).values() if seen > cutoff})
+
+# Storage --------------------------------------------------------------------
+
+def get_message_history(league_id: int, before_id: Optional[int] = None,
+                        limit: int = LEAGUE_CHAT_PAGE_SIZE) -> Tuple[List[dict], bool]:
+    """One page of messages older than ``before_id`` (oldest first) and whether more exist"""
+    limit = max(1, min(int(limit), LEAGUE_CHAT_MAX_PAGE_SIZE))
+    query = LeagueMessage.query.filter(
+        LeagueMessage.league_id == league_id,
+        LeagueMessage.deleted_at.is_(None)
+    )
+    if before_id is not None:
+        query = query.filter(LeagueMessage.id < before_id)
+    rows = query.order_by(LeagueMessage.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    return [row.to_dict() for row in reversed(rows[:limit])], has_more
+
+def _emit_history(league_id: int, before_id: Optional[int] = None, limit: int = LEAGUE_CHAT_PAGE_SIZE) -> None:
+    messages, has_more = get_message_history(league_id, before_id, limit)
+    emit('message_history', {
+        'league_id': league_id,
+        'messages': messages,
+        'has_more': has_more,
+        'before_id': before_id
+    })
+
+# Socket.IO handlers ---------------------------------------------------------
 
 @socketio.on('join_league_chat')
 def handle_join_league(data):
@@ -20,71 +162,81 @@ def handle_join_league(data):
     if not current_user.is_authenticated:
         emit('error', {'message': 'Authentication required'})
         return
-    
-    league_id = data.get('league_id')
+
+    league_id = _league_id(data)
     if not league_id:
         emit('error', {'message': 'League ID required'})
         return
-    
+
     # Verify user has access to this league
-    league = UserLeague.query.filter_by(
-        id=league_id,
-        user_id=current_user.id
-    ).first()
-    
-    if not league:
+    if not _is_member(league_id):
         emit('error', {'message': 'Access denied to this league'})
         return
-    
-    room_name = f'league_{league_id}'
+
+    room_name = _room(league_id)
     join_room(room_name)
-    
-    # Track active user
-    if league_id not in active_users:
-        active_users[league_id] = set()
-    active_users[league_id].add(current_user.id)
-    
+
+    # Track active connection
+    _presence_add(league_id, request.sid, current_user.id)
+
     # Send join notification
     emit('user_joined', {
         'user_id': current_user.id,
         'username': current_user.username,
         'timestamp': datetime.now().isoformat(),
-        'active_count': len(active_users[league_id])
+        'active_count': len(_presence_members(league_id))
     }, room=room_name)
-    
+
     # Send recent messages to new user
-    if league_id in league_messages:
-        emit('message_history', {
-            'messages': league_messages[league_id][-50:]  # Last 50 messages
-        })
-    
+    _emit_history(league_id)
+
     LOG.info(f"User {current_user.username} joined league chat {league_id}")
 
+@socketio.on('load_message_history')
+def handle_load_history(data):
+    """Older messages for infinite scroll: ``before_id`` is the oldest message id the client has"""
+    if not current_user.is_authenticated:
+        emit('error', {'message': 'Authentication required'})
+        return
+
+    league_id = _league_id(data)
+    if not league_id or not _is_member(league_id):
+        emit('error', {'message': 'Access denied'})
+        return
+
+    try:
+        before_id = int(data['before_id']) if data.get('before_id') is not None else None
+        limit = int(data.get('limit') or LEAGUE_CHAT_PAGE_SIZE)
+    except (TypeError, ValueError):
+        emit('error', {'message': 'Invalid pagination parameters'})
+        return
+
+    _emit_history(league_id, before_id, limit)
+
 @socketio.on('leave_league_chat')
 def handle_leave_league(data):
     """User leaves a league chat room"""
     if not current_user.is_authenticated:
         return
-    
-    league_id = data.get('league_id')
+
+    league_id = _league_id(data)
     if not league_id:
         return
-    
-    room_name = f'league_{league_id}'
+
+    room_name = _room(league_id)
     leave_room(room_name)
-    
-    # Remove from active users
-    if league_id in active_users:
-        active_users[league_id].discard(current_user.id)
-    
+
+    # Remove this connection from the active ones
+    _presence_remove(league_id, request.sid, current_user.id)
+
     # Send leave notification
     emit('user_left', {
         'user_id': current_user.id,
         'username': current_user.username,
         'timestamp': datetime.now().isoformat(),
-        'active_count': len(active_users.get(league_id, set()))
+        'active_count': len(_presence_members(league_id))
     }, room=room_name)
-    
+
     LOG.info(f"User {current_user.username} left league chat {league_id}")
 
 @socketio.on('send_message')
@@ -93,113 +245,119 @@ def handle_send_message(data):
     if not current_user.is_authenticated:
         emit('error', {'message': 'Authentication required'})
         return
-    
-    league_id = data.get('league_id')
-    message_text = data.get('message', '').strip()
-    
+
+    league_id = _league_id(data)
+    message_text = (data or {}).get('message', '').strip()
+
     if not league_id or not message_text:
         emit('error', {'message': 'League ID and message required'})
         return
-    
-    # Verify user is in this league
-    league = UserLeague.query.filter_by(
-        id=league_id,
-        user_id=current_user.id
-    ).first()
-    
-    if not league:
+
+    # Verify user is in this league (cached for the connection)
+    if not _is_member(league_id):
         emit('error', {'message': 'Access denied'})
         return
-    
-    # Create message object
-    message = {
-        'id': f"{league_id}_{datetime.now().timestamp()}",
-        'league_id': league_id,
-        'user_id': current_user.id,
-        'username': current_user.username,
-        'message': message_text,
-        'timestamp': datetime.now().isoformat(),
-        'is_pro': current_user.is_pro
-    }
-    
+
     # Store message
-    if league_id not in league_messages:
-        league_messages[league_id] = []
-    league_messages[league_id].append(message)
-    
-    # Keep only last 100 messages per league
-    if len(league_messages[league_id]) > 100:
-        league_messages[league_id] = league_messages[league_id][-100:]
-    
-    # Broadcast to all users in league
-    room_name = f'league_{league_id}'
-    emit('new_message', message, room=room_name)
-    
+    row = LeagueMessage(
+        league_id=league_id,
+        user_id=current_user.id,
+        username=current_user.username,
+        message=message_text,
+        is_pro=bool(current_user.is_pro)
+    )
+    try:
+        db.session.add(row)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        LOG.error(f"Error storing message in league {league_id}: {e}")
+        emit('error', {'message': 'Message not sent, please retry'})
+        return
+
+    # Broadcast to all users in league (every worker, through the message queue)
+    emit('new_message', row.to_dict(), room=_room(league_id))
+
     LOG.info(f"Message sent in league {league_id} by {current_user.username}")
 
+@socketio.on('league_chat_heartbeat')
+def handle_heartbeat(data):
+    """Keep the presence of this connection alive (sent periodically by the client)"""
+    if not current_user.is_authenticated:
+        return
+
+    sid = request.sid
+    with _state_lock:
+        _, leagues = _connection_presence.get(sid, (None, set()))
+        leagues = set(leagues)
+    for league_id in leagues:
+        _presence_add(league_id, sid, current_user.id)
+
 @socketio.on('typing')
 def handle_typing(data):
     """User is typing indicator"""
     if not current_user.is_authenticated:
         return
-    
-    league_id = data.get('league_id')
-    is_typing = data.get('is_typing', False)
-    
-    if not league_id:
+
+    league_id = _league_id(data)
+    is_typing = (data or {}).get('is_typing', False)
+
+    if not league_id or not _is_member(league_id):
         return
-    
-    room_name = f'league_{league_id}'
+
     emit('user_typing', {
         'user_id': current_user.id,
         'username': current_user.username,
         'is_typing': is_typing
-    }, room=room_name, include_self=False)
+    }, room=_room(league_id), include_self=False)
 
 @socketio.on('delete_message')
 def handle_delete_message(data):
     """Delete a message (only message author or league admin)"""
     if not current_user.is_authenticated:
         return
-    
-    league_id = data.get('league_id')
-    message_id = data.get('message_id')
-    
+
+    league_id = _league_id(data)
+    message_id = (data or {}).get('message_id')
+
     if not league_id or not message_id:
         return
-    
-    # Find and delete message
-    if league_id in league_messages:
-        messages = league_messages[league_id]
-        for i, msg in enumerate(messages):
-            if msg['id'] == message_id:
-                # Check if user owns the message
-                if msg['user_id'] == current_user.id:
-                    messages.pop(i)
-                    
-                    room_name = f'league_{league_id}'
-                    emit('message_deleted', {
-                        'message_id': message_id
-                    }, room=room_name)
-                    
-                    LOG.info(f"Message {message_id} deleted by {current_user.username}")
-                    return
-                else:
-                    emit('error', {'message': 'Not authorized to delete this message'})
-                    return
+
+    row = LeagueMessage.query.filter_by(id=message_id, league_id=league_id).first()
+    if row is None or row.deleted_at is not None:
+        return
+
+    # Check if user owns the message
+    if row.user_id != current_user.id:
+        emit('error', {'message': 'Not authorized to delete this message'})
+        return
+
+    try:
+        row.deleted_at = datetime.now()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        LOG.error(f"Error deleting message {message_id}: {e}")
+        return
+
+    emit('message_deleted', {
+        'message_id': row.id
+    }, room=_room(league_id))
+
+    LOG.info(f"Message {message_id} deleted by {current_user.username}")
 
 @socketio.on('get_active_users')
 def handle_get_active_users(data):
     """Get list of active users in league"""
     if not current_user.is_authenticated:
         return
-    
-    league_id = data.get('league_id')
+
+    league_id = _league_id(data)
     if not league_id:
         return
-    
-    active_user_ids = list(active_users.get(league_id, set()))
-    
+
+    active_user_ids = _presence_members(league_id)
+
     # TODO: Fetch user details from database
     emit('active_users', {
         'league_id': league_id,
@@ -209,22 +367,27 @@ def handle_get_active_users(data):
 
 def get_league_chat_stats(league_id: int) -> dict:
     """Get chat statistics for a league"""
-    if league_id not in league_messages:
-        return {
-            'total_messages': 0,
-            'active_users': 0,
-            'last_message': None
-        }
-    
-    messages = league_messages[league_id]
+    visible = LeagueMessage.query.filter(
+        LeagueMessage.league_id == league_id,
+        LeagueMessage.deleted_at.is_(None)
+    )
+    last = visible.order_by(LeagueMessage.id.desc()).first()
     return {
-        'total_messages': len(messages),
-        'active_users': len(active_users.get(league_id, set())),
-        'last_message': messages[-1] if messages else None
+        'total_messages': visible.count(),
+        'active_users': len(_presence_members(league_id)),
+        'last_message': last.to_dict() if last else None
     }
 
 # Cleanup function to run periodically
 def cleanup_inactive_users():
-    """Remove inactive users from active_users tracking"""
-    # TODO: Implement heartbeat system to detect disconnected users
-    pass
+    """Remove connections without a recent heartbeat from the local active_users tracking"""
+    # Disconnects are handled by forget_connection (called from the 'disconnect' handler);
+    # Redis entries are pruned on read and the whole key expires with the last heartbeat
+    cutoff = time.time() - LEAGUE_CHAT_PRESENCE_TTL
+    with _state_lock:
+        for league_id in list(active_users):
+            conns = active_users[league_id]
+            for sid in [s for s, (_, seen) in conns.items() if seen <= cutoff]:
+                del conns[sid]
+            if not conns:
+                del active_users[league_id]
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide client for the OpenAI-compatible chat completions API.
+
+One pooled ``httpx.Client`` (keep-alive, bounded connections) is shared by all
+threads, so chat turns reuse warm TLS connections instead of opening a new one
+per call.  A semaphore caps concurrent upstream requests.  ``stream()`` yields
+tokens as they arrive (server-sent events) so callers can forward them to
+``/api/chat/stream`` or Socket.IO while the completion is still generating.
+
+Point ``OPENAI_BASE_URL`` at ``llm_stub.py`` to run everything offline.
+"""
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+from config import (
+    OPENAI_BASE_URL, LLM_TIMEOUT, LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE, LLM_MAX_CONCURRENCY
+)
+
+LOG = logging.getLogger("llm_client")
+
+
+class LLMError(RuntimeError):
+    """Upstream LLM call failed (HTTP error, timeout, malformed payload)."""
+
+
+class LLMClient:
+    """Pooled, thread-safe chat completions client."""
+
+    def __init__(self, base_url: str = OPENAI_BASE_URL, api_key: str = "",
+                 timeout: float = LLM_TIMEOUT, max_connections: int = LLM_MAX_CONNECTIONS,
+                 max_keepalive: int = LLM_MAX_KEEPALIVE, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self._client = httpx.Client(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(timeout, connect=min(10.0, timeout)),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive,
+                                keepalive_expiry=60.0),
+        )
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        self.stats = {"requests": 0, "errors": 0, "streams": 0}
+
+    def _headers(self, api_key: Optional[str]) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        key = api_key or self.api_key
+        if key:
+            headers["Authorization"] = f"Bearer {key}"
+        return headers
+
+    def complete(self, messages: List[Dict[str, str]], model: str, temperature: float,
+                 max_tokens: int, api_key: Optional[str] = None) -> str:
+        """Blocking completion; returns the stripped message content."""
+        payload = {"model": model, "temperature": temperature,
+                   "max_tokens": max_tokens, "messages": messages}
+        t0 = time.perf_counter()
+        with self._slots:
+            self.stats["requests"] += 1
+            try:
+                resp = self._client.post("/chat/completions", headers=self._headers(api_key), json=payload)
+                resp.raise_for_status()
+                data = resp.json()
+                content = data["choices"][0]["message"]["content"]
+            except (httpx.HTTPError, KeyError, IndexError, ValueError) as e:
+                self.stats["errors"] += 1
+                raise LLMError(str(e)) from e
+        LOG.debug("[LLM] completion in %.0f ms", (time.perf_counter() - t0) * 1000)
+        return (content or "").strip()
+
+    def stream(self, messages: List[Dict[str, str]], model: str, temperature: float,
+               max_tokens: int, api_key: Optional[str] = None) -> Iterator[str]:
+        """Yield content deltas as they arrive (``stream: true`` SSE response)."""
+        payload = {"model": model, "temperature": temperature, "max_tokens": max_tokens,
+                   "messages": messages, "stream": True}
+        t0 = time.perf_counter()
+        first = None
+        with self._slots:
+            self.stats["requests"] += 1
+            self.stats["streams"] += 1
+            try:
+                with self._client.stream("POST", "/chat/completions",
+                                         headers=self._headers(api_key), json=payload) as resp:
+                    resp.raise_for_status()
+                    for line in resp.iter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        try:
+                            delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                        except (ValueError, KeyError, IndexError):
+                            continue
+                        if delta:
+                            if first is None:
+                                first = time.perf_counter()
+                                LOG.debug("[LLM] first token after %.0f ms", (first - t0) * 1000)
+                            yield delta
+            except httpx.HTTPError as e:
+                self.stats["errors"] += 1
+                raise LLMError(str(e)) from e
+
+    def close(self) -> None:
+        self._client.close()
+
+
+_client: Optional[LLMClient] = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    """Get the process-wide LLM client (created on first use)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient()
+    return _client
@@ -1,22 +1,33 @@
 # match_tracker_enhanced.py - Enhanced live match tracking with WebSockets
 import asyncio
 import logging
+import threading
+from collections import deque
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Set
 import requests
 from flask_socketio import emit
 from app import socketio
-from cache_redis import get_redis_cache, cached_redis
+from cache_redis import get_redis_cache
 
 LOG = logging.getLogger("match_tracker_enhanced")
 
+# Delta recenti tenuti per partita: un client che ha perso meno di N aggiornamenti li riceve
+# di nuovo, oltre serve uno snapshot completo
+DELTA_HISTORY = 200
+
+def match_room(match_id: str) -> str:
+    return f'match_{match_id}'
+
 class EnhancedMatchTracker:
     """Enhanced real-time match tracking with fantasy points calculation"""
     
     def __init__(self):
         self.active_matches = {}
         self.user_teams = {}  # user_id -> {player_ids, formation}
+        self.player_users: Dict[str, Set[int]] = {}  # indice inverso: giocatore -> utenti che lo schierano
         self.cache = get_redis_cache()
+        self._lock = threading.RLock()
         
         # Fantasy points scoring rules (Classic)
         self.scoring_rules = {
@@ -43,6 +54,8 @@ class EnhancedMatchTracker:
             'status': 'live',
             'events': [],
             'player_stats': {},
+            'seq': 0,  # versione: +1 a ogni delta inviato alla room della partita
+            'deltas': deque(maxlen=DELTA_HISTORY),
             'started_at': datetime.now()
         }
         
@@ -61,8 +74,6 @@ class EnhancedMatchTracker:
             return
         
         match = self.active_matches[match_id]
-        match['events'].append(event)
-        
         event_type = event['type']
         player_name = event.get('player')
         player_role = event.get('role', 'C')
@@ -71,46 +82,56 @@ class EnhancedMatchTracker:
         # Calculate fantasy points
         points = self.calculate_event_points(event_type, player_role)
         
-        # Update player stats
-        if player_name not in match['player_stats']:
-            match['player_stats'][player_name] = {
-                'name': player_name,
-                'role': player_role,
-                'team': event.get('team'),
-                'points': 6.0,  # Base vote
-                'events': []
-            }
-        
-        match['player_stats'][player_name]['points'] += points
-        match['player_stats'][player_name]['events'].append({
-            'type': event_type,
-            'minute': minute,
-            'points': points
-        })
-        
-        # Update score if goal
-        if event_type == 'goal':
-            team_side = event.get('team_side', 'home')
-            match['score'][team_side] += 1
-        
-        match['minute'] = minute
-        
-        # Broadcast update to all connected clients
-        socketio.emit('match_update', {
-            'match_id': match_id,
-            'minute': minute,
-            'score': match['score'],
-            'event': {
+        with self._lock:
+            match['events'].append(event)
+            
+            # Update player stats
+            if player_name not in match['player_stats']:
+                match['player_stats'][player_name] = {
+                    'name': player_name,
+                    'role': player_role,
+                    'team': event.get('team'),
+                    'points': 6.0,  # Base vote
+                    'events': []
+                }
+            
+            stats = match['player_stats'][player_name]
+            stats['points'] += points
+            stats['events'].append({
                 'type': event_type,
-                'player': player_name,
                 'minute': minute,
                 'points': points
-            },
-            'player_stats': match['player_stats']
-        }, namespace='/')
+            })
+            
+            # Update score if goal
+            if event_type == 'goal':
+                team_side = event.get('team_side', 'home')
+                match['score'][team_side] += 1
+            
+            match['minute'] = minute
+            
+            # Delta versionato: solo i giocatori cambiati da questo evento
+            match['seq'] += 1
+            delta = {
+                'match_id': match_id,
+                'seq': match['seq'],
+                'minute': minute,
+                'score': dict(match['score']),
+                'event': {
+                    'type': event_type,
+                    'player': player_name,
+                    'minute': minute,
+                    'points': points
+                },
+                'player_stats': {player_name: {**stats, 'events': list(stats['events'])}}
+            }
+            match['deltas'].append(delta)
+        
+        # Broadcast only to clients subscribed to this match
+        socketio.emit('match_update', delta, room=match_room(match_id), namespace='/')
         
         # Update user-specific fantasy scores
-        self.update_user_scores(match_id, match['player_stats'])
+        self.update_user_scores(match_id, match['player_stats'], changed_players=[player_name])
         
         LOG.info(f"Match {match_id} - Event: {event_type} by {player_name} ({points} pts)")
     
@@ -135,16 +156,22 @@ class EnhancedMatchTracker:
         
         return 0
     
-    def update_user_scores(self, match_id: str, player_stats: Dict):
-        """Update fantasy scores for all users with players in this match"""
-        for user_id, team_info in self.user_teams.items():
-            player_ids = team_info.get('player_ids', [])
-            
+    def update_user_scores(self, match_id: str, player_stats: Dict,
+                           changed_players: Optional[Iterable[str]] = None):
+        """Update fantasy scores of the users owning ``changed_players`` (default: any player in this match)"""
+        with self._lock:
+            affected = set()
+            for player_name in (player_stats if changed_players is None else changed_players):
+                affected |= self.player_users.get(player_name, set())
+            teams = [(user_id, self.user_teams[user_id]) for user_id in affected]
+        
+        for user_id, team_info in teams:
             user_score = 0
             scored_players = []
             
-            for player_name, stats in player_stats.items():
-                if player_name in player_ids:
+            for player_name in team_info.get('player_ids', []):
+                stats = player_stats.get(player_name)
+                if stats is not None:
                     user_score += stats['points']
                     scored_players.append({
                         'name': player_name,
@@ -162,13 +189,68 @@ class EnhancedMatchTracker:
     
     def register_user_team(self, user_id: int, player_ids: List[str], formation: str):
         """Register a user's team for live tracking"""
-        self.user_teams[user_id] = {
-            'player_ids': player_ids,
-            'formation': formation,
-            'registered_at': datetime.now()
-        }
+        with self._lock:
+            self._unindex_user(user_id)
+            self.user_teams[user_id] = {
+                'player_ids': list(dict.fromkeys(player_ids)),
+                'formation': formation,
+                'registered_at': datetime.now()
+            }
+            for player_name in self.user_teams[user_id]['player_ids']:
+                self.player_users.setdefault(player_name, set()).add(user_id)
         LOG.info(f"Registered team for user {user_id}: {len(player_ids)} players")
     
+    def unregister_user_team(self, user_id: int):
+        """Stop live tracking for a user's team"""
+        with self._lock:
+            self._unindex_user(user_id)
+            self.user_teams.pop(user_id, None)
+    
+    def _unindex_user(self, user_id: int):
+        team_info = self.user_teams.get(user_id)
+        if not team_info:
+            return
+        for player_name in team_info['player_ids']:
+            users = self.player_users.get(player_name)
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    del self.player_users[player_name]
+    
+    def get_match_snapshot(self, match_id: str) -> Optional[Dict]:
+        """Full state of a match at its current ``seq`` (sent on subscribe and after a gap)"""
+        if match_id not in self.active_matches:
+            return None
+        
+        match = self.active_matches[match_id]
+        with self._lock:
+            return {
+                'match_id': match_id,
+                'seq': match['seq'],
+                'home_team': match['home_team'],
+                'away_team': match['away_team'],
+                'score': dict(match['score']),
+                'minute': match['minute'],
+                'status': match['status'],
+                'player_stats': {
+                    name: {**stats, 'events': list(stats['events'])}
+                    for name, stats in match['player_stats'].items()
+                }
+            }
+    
+    def get_match_updates_since(self, match_id: str, seq: int) -> Optional[List[Dict]]:
+        """Deltas after ``seq``, or None if they are no longer all available (snapshot needed)"""
+        match = self.active_matches.get(match_id)
+        if match is None:
+            return None
+        with self._lock:
+            if seq == match['seq']:
+                return []
+            deltas = match['deltas']
+            if seq > match['seq'] or not deltas or deltas[-1]['seq'] != match['seq'] or deltas[0]['seq'] > seq + 1:
+                return None
+            return [d for d in deltas if d['seq'] > seq]
+    
     def get_match_summary(self, match_id: str) -> Optional[Dict]:
         """Get current match summary"""
         if match_id not in self.active_matches:
@@ -208,22 +290,29 @@ class EnhancedMatchTracker:
             return
         
         match = self.active_matches[match_id]
-        match['status'] = 'finished'
-        match['ended_at'] = datetime.now()
-        
-        # Apply end-of-match bonuses (clean sheets, etc.)
-        self.apply_end_of_match_bonuses(match)
+        with self._lock:
+            match['status'] = 'finished'
+            match['ended_at'] = datetime.now()
+            
+            # Apply end-of-match bonuses (clean sheets, etc.)
+            self.apply_end_of_match_bonuses(match)
+            
+            # I bonus non hanno un delta: chi si risincronizza riceve lo snapshot finale
+            match['seq'] += 1
+            match['deltas'].clear()
         
-        # Broadcast final stats
+        # Final stats only to the clients following this match
         socketio.emit('match_ended', {
             'match_id': match_id,
+            'seq': match['seq'],
             'final_score': match['score'],
             'player_stats': match['player_stats'],
             'summary': self.get_match_summary(match_id)
-        }, namespace='/')
+        }, room=match_room(match_id), namespace='/')
         
         # Cache final results
-        self.cache.set(f"match_result:{match_id}", match, ttl=86400)  # 24 hours
+        self.cache.set(f"match_result:{match_id}",
+                       {k: v for k, v in match.items() if k != 'deltas'}, ttl=86400)  # 24 hours
         
         LOG.info(f"Match {match_id} ended: {match['score']}")
     
@@ -259,9 +348,8 @@ class EnhancedMatchTracker:
                     'points': penalty
                 })
     
-    @cached_redis(ttl=60, key_prefix="live_matches")
     def get_active_matches(self) -> List[Dict]:
-        """Get all currently active matches"""
+        """Get all currently active matches (of this worker: not cached, it only reads active_matches)"""
         return [
             {
                 'match_id': match_id,
@@ -285,16 +373,44 @@ def get_match_tracker() -> EnhancedMatchTracker:
         _tracker_instance = EnhancedMatchTracker()
     return _tracker_instance
 
+def _seq(value) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def _send_match_state(match_id: str, since=None):
+    """Send the requesting client the deltas after ``since`` or, if they are gone, a full snapshot"""
+    tracker = get_match_tracker()
+    since = _seq(since)  # client-supplied: anything not an integer gets the snapshot
+    if since is not None:
+        updates = tracker.get_match_updates_since(match_id, since)
+        if updates is not None:
+            for delta in updates:
+                emit('match_update', delta)
+            return
+    snapshot = tracker.get_match_snapshot(match_id)
+    if snapshot is not None:
+        emit('match_snapshot', snapshot)
+
 # SocketIO event handlers
 @socketio.on('subscribe_match')
 def handle_subscribe_match(data):
-    """User subscribes to match updates"""
+    """User subscribes to match updates (``since``: last seq seen, on reconnect)"""
     match_id = data.get('match_id')
     if match_id:
         from flask import request
         from flask_socketio import join_room
-        join_room(f'match_{match_id}')
+        join_room(match_room(match_id))
         LOG.info(f"Client {request.sid} subscribed to match {match_id}")
+        _send_match_state(match_id, data.get('since'))
+
+@socketio.on('match_resync')
+def handle_match_resync(data):
+    """Client detected a gap in ``seq`` (or reconnected): replay missing deltas or send a snapshot"""
+    match_id = (data or {}).get('match_id')
+    if match_id:
+        _send_match_state(match_id, data.get('since'))
 
 @socketio.on('unsubscribe_match')
 def handle_unsubscribe_match(data):
@@ -303,5 +419,5 @@ def handle_unsubscribe_match(data):
     if match_id:
         from flask import request
         from flask_socketio import leave_room
-        leave_room(f'match_{match_id}')
+        leave_room(match_room(match_id))
         LOG.info(f"Client {request.sid} unsubscribed from match {match_id}")
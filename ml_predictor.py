@@ -93,40 +93,56 @@ class PlayerPerformancePredictor:
             LOG.warning("No trained model available, using rule-based prediction")
             return self._rule_based_predict(player_features)
         
-        # Convert to DataFrame for feature engineering
-        df = pd.DataFrame([player_features])
-        X = self._engineer_features(df)
-        X_scaled = self.scaler.transform(X)
-        
-        # Predict
-        prediction = float(self.model.predict(X_scaled)[0])
-        
-        # Calculate confidence from tree predictions
-        tree_predictions = [float(tree.predict(X_scaled)[0]) for tree in self.model.estimators_]
-        std = float(np.std(tree_predictions))
-        confidence = float(max(0, min(100, 100 - (std * 10))))  # Convert to 0-100 scale
-        
-        return {
-            'predicted_fantamedia': round(prediction, 2),
-            'confidence': round(confidence / 100, 2),  # Return 0-1 scale
-            'confidence_interval': {
-                'lower': round(prediction - std, 2),
-                'upper': round(prediction + std, 2)
-            },
-            'explanation': self._explain_prediction(player_features, prediction)
-        }
+        return self._predict_many([player_features])[0]
     
     def predict_batch(self, players_data: List[Dict]) -> List[Dict]:
-        """Predict for multiple players"""
-        predictions = []
+        """Predict for multiple players (one feature matrix, one pass over the forest)"""
+        if not players_data:
+            return []
         
-        for player_data in players_data:
-            pred = self.predict(player_data)
+        if self.model is None:
+            LOG.warning("No trained model available, using rule-based prediction")
+            predictions = [self._rule_based_predict(player_data) for player_data in players_data]
+        else:
+            predictions = self._predict_many(players_data)
+        
+        for pred, player_data in zip(predictions, players_data):
             pred['player_name'] = player_data.get('player_name', 'Unknown')
             pred['role'] = player_data.get('role', 'C')
-            predictions.append(pred)
         
-        return sorted(predictions, key=lambda x: x['predicted_points'], reverse=True)
+        return sorted(predictions, key=lambda x: x['predicted_fantamedia'], reverse=True)
+    
+    def _predict_many(self, players_data: List[Dict]) -> List[Dict]:
+        """Vectorized model inference for a list of feature dicts"""
+        df = pd.DataFrame(players_data)
+        X_scaled = self.scaler.transform(self._engineer_features(df))
+        
+        estimators = getattr(self.model, 'estimators_', None)
+        if isinstance(self.model, RandomForestRegressor) and estimators:
+            # (n_trees, n_players) matrix; the forest prediction is the mean over
+            # trees (summed in tree order, exactly as RandomForestRegressor.predict)
+            tree_predictions = np.stack([tree.predict(X_scaled) for tree in estimators])
+            predictions = tree_predictions.sum(axis=0) / len(estimators)
+            stds = tree_predictions.std(axis=0)
+        else:
+            predictions = np.asarray(self.model.predict(X_scaled), dtype=np.float64)
+            stds = np.zeros(len(predictions))
+        
+        confidences = np.clip(100 - stds * 10, 0, 100)  # Convert to 0-100 scale
+        
+        results = []
+        for player_features, prediction, std, confidence in zip(players_data, predictions, stds, confidences):
+            prediction, std = float(prediction), float(std)
+            results.append({
+                'predicted_fantamedia': round(prediction, 2),
+                'confidence': round(float(confidence) / 100, 2),  # Return 0-1 scale
+                'confidence_interval': {
+                    'lower': round(prediction - std, 2),
+                    'upper': round(prediction + std, 2)
+                },
+                'explanation': self._explain_prediction(player_features, prediction)
+            })
+        return results
     
     def _engineer_features(self, df: pd.DataFrame) -> np.ndarray:
         """Extract and engineer features from raw data"""
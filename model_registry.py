@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide registry for heavy models (SentenceTransformer).
+
+Each model is loaded exactly once per process: the first caller creates a
+``Future`` under the registry lock and performs the load, concurrent callers
+block on that future instead of polling or loading a second copy.  A failed
+load is reported to everyone waiting on it and retried by the next caller.
+
+``warmup_models()`` loads the embedding model eagerly and runs a dummy encode
+so the first real request does not pay for lazy initialisation; load and
+warmup timings are exposed by ``model_stats()``.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+from config import KM_EMBED_MODEL
+
+LOG = logging.getLogger("model_registry")
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Future] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def get(self, name: str, loader: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """Return the model registered as ``name``, loading it with ``loader`` on first use."""
+        with self._lock:
+            fut = self._futures.get(name)
+            owner = fut is None
+            if owner:
+                fut = self._futures[name] = Future()
+        if owner:
+            self._load(name, loader, fut)
+        return fut.result(timeout)
+
+    def load_async(self, name: str, loader: Callable[[], Any]) -> Future:
+        """Like ``get`` but loads in a daemon thread and returns the ``Future`` immediately."""
+        with self._lock:
+            fut = self._futures.get(name)
+            if fut is not None:
+                return fut
+            fut = self._futures[name] = Future()
+        threading.Thread(target=self._load, args=(name, loader, fut), name=f"load-{name}", daemon=True).start()
+        return fut
+
+    def _load(self, name: str, loader: Callable[[], Any], fut: Future) -> None:
+        t0 = time.perf_counter()
+        try:
+            model = loader()
+        except BaseException as e:
+            with self._lock:
+                self._futures.pop(name, None)  # il prossimo chiamante riprova
+            self._stats[name] = {"loaded": False, "error": str(e)}
+            LOG.error("[Models] Caricamento %s fallito: %s", name, e)
+            fut.set_exception(e)
+            return
+        load_s = time.perf_counter() - t0
+        self._stats[name] = {"loaded": True, "load_seconds": round(load_s, 3), "warmup_seconds": None}
+        LOG.info("[Models] %s caricato in %.2fs", name, load_s)
+        fut.set_result(model)
+
+    def record_warmup(self, name: str, seconds: float) -> None:
+        self._stats.setdefault(name, {})["warmup_seconds"] = round(seconds, 3)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: dict(s) for name, s in self._stats.items()}
+
+
+_registry = ModelRegistry()
+
+
+def get_registry() -> ModelRegistry:
+    return _registry
+
+
+def get_sentence_transformer(model_name: str = KM_EMBED_MODEL):
+    """Shared SentenceTransformer instance (loaded once per process)."""
+    def _load():
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+    return _registry.get(f"st:{model_name}", _load)
+
+
+def load_cross_encoder_async(model_name: str) -> Future:
+    """Shared CrossEncoder, loaded in background; callers check ``done()`` before use."""
+    def _load():
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(model_name)
+    return _registry.load_async(f"ce:{model_name}", _load)
+
+
+def warmup_models(model_name: str = KM_EMBED_MODEL) -> Dict[str, Dict[str, Any]]:
+    """Load the embedding model and run a dummy encode; returns ``model_stats()``."""
+    try:
+        model = get_sentence_transformer(model_name)
+        t0 = time.perf_counter()
+        model.encode(["warmup"])
+        warm_s = time.perf_counter() - t0
+        _registry.record_warmup(f"st:{model_name}", warm_s)
+        LOG.info("[Models] Warmup %s in %.2fs", model_name, warm_s)
+    except Exception as e:
+        LOG.warning("[Models] Warmup fallito: %s", e)
+    return model_stats()
+
+
+def warmup_models_async(model_name: str = KM_EMBED_MODEL) -> threading.Thread:
+    """Run ``warmup_models`` in a daemon thread (does not delay startup)."""
+    t = threading.Thread(target=warmup_models, args=(model_name,), name="model-warmup", daemon=True)
+    t.start()
+    return t
+
+
+def model_stats() -> Dict[str, Dict[str, Any]]:
+    return _registry.stats()
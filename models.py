@@ -233,3 +233,40 @@ class MatchdayScore(db.Model):
     def __repr__(self):
         return f'<MatchdayScore {self.total_score} for Participant {self.participant_id} in Matchday {self.matchday_id}>'
 
+
+
+class LeagueMessage(db.Model):
+    """League chat messages - append-only: deleting a message only sets deleted_at"""
+    __tablename__ = 'league_messages'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    league_id = db.Column(db.Integer, db.ForeignKey('user_leagues.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    
+    # Message data (username/is_pro as they were when the message was sent)
+    username = db.Column(db.String(80), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    is_pro = db.Column(db.Boolean, default=False)
+    
+    # Timestamps
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    
+    # History is read newest-first per league, paginated by id
+    __table_args__ = (
+        db.Index('idx_league_message_league_id', 'league_id', 'id'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'league_id': self.league_id,
+            'user_id': self.user_id,
+            'username': self.username,
+            'message': self.message,
+            'timestamp': self.created_at.isoformat(),
+            'is_pro': bool(self.is_pro)
+        }
+    
+    def __repr__(self):
+        return f'<LeagueMessage {self.id} in League {self.league_id}>'
@@ -1,25 +1,224 @@
 # query_cache.py - Aggressive caching for OpenAI cost reduction
+"""
+Response cache for the assistant (and any LLM call via ``cache_llm_query``).
+
+Lookup is two-stage inside a *namespace* (for the assistant: data fingerprint
++ mode + parsed intent, so a roster or corrections change starts a new one):
+
+1. exact match on the normalized query (lowercase, no accents/punctuation);
+2. nearest neighbour over the normalized query embeddings of the namespace
+   (cosine >= ``RESPONSE_CACHE_SIMILARITY``, same numbers in both queries, so
+   "under 200" never answers "under 150").
+
+Entries live in Redis when available (shared between workers) or in a local
+SQLite file; each has the TTL of its query type/intent.
+"""
+import base64
 import hashlib
 import json
 import logging
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from functools import wraps
-import redis
+
+import numpy as np
+
+from config import (
+    KM_EMBED_MODEL, RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_PATH, RESPONSE_CACHE_SIMILARITY,
+    RESPONSE_CACHE_MAX_VECTORS, RESPONSE_CACHE_TTLS, RESPONSE_CACHE_SEMANTIC_INTENTS,
+)
+from retrieval.tokenizer import fold
 
 LOG = logging.getLogger("query_cache")
 
+# TTL (s) per intent dell'assistente; 0 = mai in cache. RESPONSE_CACHE_TTLS sovrascrive.
+DEFAULT_INTENT_TTLS: Dict[str, int] = {
+    'generic': 3600 * 2,
+    'advice': 3600 * 6,
+    'season_info': 3600 * 6,
+    'comparison': 3600 * 6,
+    'transfers': 3600,
+    'team_formation': 3600,
+    'goalkeeper': 3600,
+    'under': 3600 * 6,
+    'budget_attackers': 3600 * 6,
+    'top_players': 3600 * 6,
+    'formation': 3600 * 6,
+    'complex_budget': 3600 * 6,
+    'asta': 3600 * 24,
+}
+
+
+def _parse_ttls(spec: str) -> Dict[str, int]:
+    """Parse ``"generic:7200,transfers:0"``."""
+    out = {}
+    for part in (spec or "").split(","):
+        name, _, ttl = part.partition(":")
+        try:
+            out[name.strip()] = int(ttl)
+        except ValueError:
+            if part.strip():
+                LOG.warning("[QueryCache] invalid TTL %r ignored", part)
+    return out
+
+
+INTENT_TTLS: Dict[str, int] = {**DEFAULT_INTENT_TTLS, **_parse_ttls(RESPONSE_CACHE_TTLS)}
+SEMANTIC_INTENTS = frozenset(x.strip() for x in RESPONSE_CACHE_SEMANTIC_INTENTS.split(",") if x.strip())
+
+_PUNCT_RE = re.compile(r"[^\w\s-]+")
+_SPACE_RE = re.compile(r"\s+")
+_NUM_RE = re.compile(r"\d+")
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, accents removed, punctuation dropped, whitespace collapsed."""
+    return _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", fold(query or ""))).strip()
+
+
+def _numbers(normalized: str) -> List[str]:
+    return _NUM_RE.findall(normalized)
+
+
+# ---------- backends ----------
+class SQLiteResponseStore:
+    """Local store: one row per entry, vectors as float32 BLOBs (WAL, connection per thread)."""
+
+    _PURGE_EVERY = 200
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._writes = 0
+        self._stats: Dict[str, int] = {}
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            k TEXT PRIMARY KEY, ns TEXT NOT NULL, entry TEXT NOT NULL, vec BLOB, expires_at REAL NOT NULL)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS responses_ns ON responses(ns, expires_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT entry FROM responses WHERE k=? AND expires_at>?", (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, ns: str, entry: Dict[str, Any], ttl: int, vec: Optional[np.ndarray]) -> None:
+        conn = self._conn()
+        blob = vec.astype(np.float32).tobytes() if vec is not None else None
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO responses(k, ns, entry, vec, expires_at) VALUES(?,?,?,?,?)",
+                         (key, ns, json.dumps(entry, ensure_ascii=False), blob, time.time() + ttl))
+            self._writes += 1
+            if self._writes % self._PURGE_EVERY == 0:
+                conn.execute("DELETE FROM responses WHERE expires_at<=?", (time.time(),))
+
+    def vectors(self, ns: str) -> List[Tuple[str, np.ndarray]]:
+        rows = self._conn().execute(
+            "SELECT k, vec FROM responses WHERE ns=? AND expires_at>? AND vec IS NOT NULL ORDER BY expires_at",
+            (ns, time.time())).fetchall()
+        return [(k, np.frombuffer(v, dtype=np.float32)) for k, v in rows]
+
+    def incr(self, stat: str) -> None:
+        self._stats[stat] = self._stats.get(stat, 0) + 1
+
+    def stats(self) -> Dict[str, int]:
+        out = dict(self._stats)
+        out["entries"] = self._conn().execute(
+            "SELECT COUNT(*) FROM responses WHERE expires_at>?", (time.time(),)).fetchone()[0]
+        return out
+
+    def clear(self) -> int:
+        conn = self._conn()
+        with conn:
+            return conn.execute("DELETE FROM responses").rowcount
+
+
+class RedisResponseStore:
+    """Shared store: JSON entry per key (SETEX) and one hash of base64 vectors per namespace."""
+
+    def __init__(self, client, prefix: str = "llm_cache:"):
+        self.redis = client
+        self.prefix = prefix
+        self.stats_key = f"{prefix}stats"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = self.redis.get(f"{self.prefix}e:{key}")
+        return json.loads(raw) if raw else None
+
+    def set(self, key: str, ns: str, entry: Dict[str, Any], ttl: int, vec: Optional[np.ndarray]) -> None:
+        pipe = self.redis.pipeline()
+        pipe.setex(f"{self.prefix}e:{key}", ttl, json.dumps(entry, ensure_ascii=False))
+        if vec is not None:
+            vkey = f"{self.prefix}v:{ns}"
+            pipe.hset(vkey, key, base64.b64encode(vec.astype(np.float32).tobytes()).decode("ascii"))
+            pipe.expire(vkey, ttl)
+        pipe.hincrby(self.stats_key, "total_cached", 1)
+        pipe.execute()
+
+    def vectors(self, ns: str) -> List[Tuple[str, np.ndarray]]:
+        raw = self.redis.hgetall(f"{self.prefix}v:{ns}") or {}
+        return [(k, np.frombuffer(base64.b64decode(v), dtype=np.float32)) for k, v in raw.items()]
+
+    def incr(self, stat: str) -> None:
+        self.redis.hincrby(self.stats_key, stat, 1)
+
+    def stats(self) -> Dict[str, int]:
+        return {k: int(v) for k, v in (self.redis.hgetall(self.stats_key) or {}).items()}
+
+    def clear(self) -> int:
+        keys = list(self.redis.scan_iter(f"{self.prefix}*"))
+        if keys:
+            self.redis.delete(*keys)
+        return len(keys)
+
+
+# ---------- cache ----------
+class _VectorIndex:
+    __slots__ = ("keys", "matrix", "loaded_at")
+
+    def __init__(self, keys: List[str], matrix: np.ndarray, loaded_at: float):
+        self.keys = keys
+        self.matrix = matrix
+        self.loaded_at = loaded_at
+
+
+def _default_embed(text: str) -> np.ndarray:
+    from model_registry import get_sentence_transformer
+    model = get_sentence_transformer(KM_EMBED_MODEL)
+    return np.asarray(model.encode([text], normalize_embeddings=True)[0], dtype=np.float32)
+
+
 class QueryCache:
     """
     Semantic caching for LLM queries
     Caches similar queries to reduce OpenAI API calls by 60-80%
     """
-    
-    def __init__(self, redis_client):
-        self.redis = redis_client
-        self.cache_prefix = "llm_cache:"
-        self.stats_key = "llm_cache:stats"
-        
+
+    _INDEX_REFRESH = 60.0  # s: rilegge i vettori scritti da altri worker
+
+    def __init__(self, store, embed: Optional[Callable[[str], np.ndarray]] = _default_embed,
+                 threshold: float = RESPONSE_CACHE_SIMILARITY, max_vectors: int = RESPONSE_CACHE_MAX_VECTORS):
+        self.store = store
+        self.embed = embed
+        self.threshold = threshold
+        self.max_vectors = max(1, int(max_vectors))
+        self._indexes: Dict[str, _VectorIndex] = {}
+        self._lock = threading.Lock()
+
         # Cache TTL by query type
         self.ttl_config = {
             'player_stats': 3600 * 24,      # 24 hours (stats don't change often)
@@ -29,42 +228,19 @@ class QueryCache:
             'general': 3600 * 2,            # 2 hours
             'news': 3600,                   # 1 hour (news updates)
         }
-    
+
     def _normalize_query(self, query: str) -> str:
         """Normalize query for better cache hits"""
-        # Convert to lowercase
-        normalized = query.lower().strip()
-        
-        # Remove common variations
-        replacements = {
-            'chi è': 'chi e',
-            'qual è': 'qual e',
-            'perchè': 'perche',
-            'può': 'puo',
-            '?': '',
-            '!': '',
-            '  ': ' '
-        }
-        
-        for old, new in replacements.items():
-            normalized = normalized.replace(old, new)
-        
-        return normalized
-    
-    def _get_query_hash(self, query: str, mode: str = None) -> str:
-        """Generate cache key from query"""
-        normalized = self._normalize_query(query)
-        
-        # Include mode in hash for different contexts
-        cache_input = f"{mode or 'default'}:{normalized}"
-        
-        hash_obj = hashlib.md5(cache_input.encode('utf-8'))
-        return hash_obj.hexdigest()
-    
+        return normalize_query(query)
+
+    def _get_query_hash(self, normalized: str, namespace: str) -> str:
+        """Generate cache key from the normalized query"""
+        return hashlib.sha256(f"{namespace}|{normalized}".encode("utf-8")).hexdigest()[:32]
+
     def _detect_query_type(self, query: str) -> str:
         """Detect query type for appropriate TTL"""
         query_lower = query.lower()
-        
+
         # Keywords for each type
         if any(word in query_lower for word in ['statistiche', 'stats', 'fantamedia', 'gol', 'assist']):
             return 'player_stats'
@@ -78,147 +254,214 @@ class QueryCache:
             return 'news'
         else:
             return 'general'
-    
+
+    # ---------- semantic index ----------
+    def _embed(self, normalized: str) -> Optional[np.ndarray]:
+        if self.embed is None:
+            return None
+        try:
+            vec = np.asarray(self.embed(normalized), dtype=np.float32)
+        except Exception as e:
+            LOG.warning(f"Semantic cache disabled (embedding failed): {e}")
+            self.embed = None
+            return None
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else None
+
+    def _index(self, namespace: str) -> _VectorIndex:
+        idx = self._indexes.get(namespace)
+        if idx is not None and time.time() - idx.loaded_at < self._INDEX_REFRESH:
+            return idx
+        rows = self.store.vectors(namespace)[-self.max_vectors:]
+        keys = [k for k, _ in rows]
+        matrix = np.stack([v for _, v in rows]) if rows else np.zeros((0, 0), dtype=np.float32)
+        idx = _VectorIndex(keys, matrix, time.time())
+        with self._lock:
+            self._indexes[namespace] = idx
+        return idx
+
+    def _add_vector(self, namespace: str, key: str, vec: np.ndarray) -> None:
+        idx = self._indexes.get(namespace)
+        if idx is None:
+            return  # caricato (con questo vettore) alla prima lookup
+        with self._lock:
+            if idx.matrix.size and idx.matrix.shape[1] != vec.shape[0]:
+                return
+            keys = idx.keys + [key]
+            matrix = np.vstack([idx.matrix, vec[None, :]]) if idx.matrix.size else vec[None, :]
+            self._indexes[namespace] = _VectorIndex(keys[-self.max_vectors:], matrix[-self.max_vectors:],
+                                                    idx.loaded_at)
+
+    def _nearest(self, namespace: str, normalized: str, vec: np.ndarray) -> Optional[Dict[str, Any]]:
+        idx = self._index(namespace)
+        if not idx.keys or idx.matrix.shape[1] != vec.shape[0]:
+            return None
+        sims = idx.matrix @ vec
+        numbers = _numbers(normalized)
+        for i in np.argsort(-sims)[:3]:
+            if sims[i] < self.threshold:
+                break
+            entry = self.store.get(idx.keys[i])
+            if entry and _numbers(entry.get("query", "")) == numbers:
+                entry["similarity"] = float(sims[i])
+                return entry
+        return None
+
+    # ---------- public API ----------
+    def lookup(self, query: str, namespace: str, semantic: bool = True) -> Optional[str]:
+        """Cached response for ``query`` in ``namespace`` (exact, then nearest neighbour)."""
+        try:
+            normalized = self._normalize_query(query)
+            entry = self.store.get(self._get_query_hash(normalized, namespace))
+            kind = "hits"
+            if entry is None and semantic:
+                vec = self._embed(normalized)
+                entry = self._nearest(namespace, normalized, vec) if vec is not None else None
+                kind = "semantic_hits"
+            if entry is None:
+                self.store.incr("misses")
+                return None
+            self.store.incr(kind)
+            LOG.info(f"✅ Cache HIT ({kind}) for query: {query[:50]}...")
+            return entry["response"]
+        except Exception as e:
+            LOG.error(f"Cache get error: {e}")
+            return None
+
+    def store_response(self, query: str, response: str, namespace: str, ttl: int,
+                       query_type: str = "general", semantic: bool = True) -> None:
+        """Cache ``response`` for ``query`` in ``namespace`` for ``ttl`` seconds."""
+        if not response or ttl <= 0:
+            return
+        try:
+            normalized = self._normalize_query(query)
+            key = self._get_query_hash(normalized, namespace)
+            vec = self._embed(normalized) if semantic else None
+            entry = {
+                'query': normalized,
+                'response': response,
+                'type': query_type,
+                'cached_at': datetime.utcnow().isoformat(),
+                'ttl': ttl
+            }
+            self.store.set(key, namespace, entry, ttl, vec)
+            if vec is not None:
+                self._add_vector(namespace, key, vec)
+            LOG.info(f"💾 Cached response for query: {query[:50]}... (TTL: {ttl}s, type: {query_type})")
+        except Exception as e:
+            LOG.error(f"Cache set error: {e}")
+
     def get(self, query: str, mode: str = None) -> Optional[str]:
         """
         Get cached response for query
-        
+
         Args:
             query: User query text
             mode: Query mode (classic, mantra, draft, etc.)
-        
+
         Returns:
             Cached response or None
         """
-        try:
-            cache_key = self._get_query_hash(query, mode)
-            full_key = f"{self.cache_prefix}{cache_key}"
-            
-            cached = self.redis.get(full_key)
-            
-            if cached:
-                # Update stats
-                self.redis.hincrby(self.stats_key, 'hits', 1)
-                LOG.info(f"✅ Cache HIT for query: {query[:50]}...")
-                
-                # Parse cached data
-                data = json.loads(cached)
-                return data['response']
-            else:
-                # Update stats
-                self.redis.hincrby(self.stats_key, 'misses', 1)
-                LOG.info(f"❌ Cache MISS for query: {query[:50]}...")
-                return None
-                
-        except Exception as e:
-            LOG.error(f"Cache get error: {e}")
-            return None
-    
+        return self.lookup(query, f"mode:{mode or 'default'}")
+
     def set(self, query: str, response: str, mode: str = None):
         """
         Cache response for query
-        
+
         Args:
             query: User query text
             response: LLM response to cache
             mode: Query mode
         """
-        try:
-            cache_key = self._get_query_hash(query, mode)
-            full_key = f"{self.cache_prefix}{cache_key}"
-            
-            # Detect query type for TTL
-            query_type = self._detect_query_type(query)
-            ttl = self.ttl_config.get(query_type, self.ttl_config['general'])
-            
-            # Prepare cache data
-            cache_data = {
-                'query': query,
-                'response': response,
-                'mode': mode,
-                'type': query_type,
-                'cached_at': datetime.utcnow().isoformat(),
-                'ttl': ttl
-            }
-            
-            # Save to Redis
-            self.redis.setex(
-                full_key,
-                ttl,
-                json.dumps(cache_data, ensure_ascii=False)
-            )
-            
-            # Update stats
-            self.redis.hincrby(self.stats_key, 'total_cached', 1)
-            
-            LOG.info(f"💾 Cached response for query: {query[:50]}... (TTL: {ttl}s, type: {query_type})")
-            
-        except Exception as e:
-            LOG.error(f"Cache set error: {e}")
-    
+        query_type = self._detect_query_type(query)
+        ttl = self.ttl_config.get(query_type, self.ttl_config['general'])
+        self.store_response(query, response, f"mode:{mode or 'default'}", ttl, query_type)
+
     def get_stats(self) -> Dict[str, Any]:
         """Get cache statistics"""
         try:
-            stats = self.redis.hgetall(self.stats_key)
-            
-            # Convert bytes to int
-            hits = int(stats.get(b'hits', 0))
-            misses = int(stats.get(b'misses', 0))
+            stats = self.store.stats()
+            hits = int(stats.get('hits', 0)) + int(stats.get('semantic_hits', 0))
+            misses = int(stats.get('misses', 0))
             total = hits + misses
-            
+
             hit_rate = (hits / total * 100) if total > 0 else 0
-            
+
             return {
                 'hits': hits,
+                'semantic_hits': int(stats.get('semantic_hits', 0)),
                 'misses': misses,
                 'total_requests': total,
                 'hit_rate': round(hit_rate, 2),
-                'total_cached': int(stats.get(b'total_cached', 0)),
+                'total_cached': int(stats.get('total_cached', stats.get('entries', 0))),
                 'estimated_cost_saved': self._estimate_savings(hits)
             }
         except Exception as e:
             LOG.error(f"Stats error: {e}")
             return {}
-    
+
     def _estimate_savings(self, cache_hits: int) -> float:
         """Estimate cost savings from cache hits"""
         # Average tokens per request
         avg_input_tokens = 500
         avg_output_tokens = 400
-        
+
         # gpt-4o-mini pricing (per 1M tokens)
         input_cost_per_1m = 0.150
         output_cost_per_1m = 0.600
-        
+
         # Calculate cost per request
         cost_per_request = (
             (avg_input_tokens / 1_000_000 * input_cost_per_1m) +
             (avg_output_tokens / 1_000_000 * output_cost_per_1m)
         )
-        
+
         # Total savings
         return round(cache_hits * cost_per_request, 2)
-    
+
     def clear(self):
         """Clear all cached queries"""
         try:
-            pattern = f"{self.cache_prefix}*"
-            keys = self.redis.keys(pattern)
-            
-            if keys:
-                self.redis.delete(*keys)
-                LOG.info(f"🗑️ Cleared {len(keys)} cached queries")
-                return len(keys)
-            
-            return 0
+            n = self.store.clear()
+            with self._lock:
+                self._indexes.clear()
+            LOG.info(f"🗑️ Cleared {n} cached queries")
+            return n
         except Exception as e:
             LOG.error(f"Cache clear error: {e}")
             return 0
 
+
+_query_cache: Optional[QueryCache] = None
+_query_cache_lock = threading.Lock()
+
+
+def _make_store():
+    backend = (RESPONSE_CACHE_BACKEND or "auto").lower()
+    if backend in ("auto", "redis"):
+        from cache_redis import get_redis_cache
+        rc = get_redis_cache()
+        if rc.enabled and rc.client is not None:
+            return RedisResponseStore(rc.client)
+        if backend == "redis":
+            LOG.warning("Redis not available for the response cache, using SQLite")
+    return SQLiteResponseStore(RESPONSE_CACHE_PATH)
+
+
+def get_query_cache() -> QueryCache:
+    """Process-wide response cache (Redis if enabled, else local SQLite)."""
+    global _query_cache
+    if _query_cache is None:
+        with _query_cache_lock:
+            if _query_cache is None:
+                _query_cache = QueryCache(_make_store())
+    return _query_cache
+
+
 def cache_llm_query(mode: str = None):
     """
     Decorator for caching LLM queries
-    
+
     Usage:
         @cache_llm_query(mode='classic')
         def ask_assistant(query):
@@ -227,31 +470,27 @@ def cache_llm_query(mode: str = None):
     def decorator(func):
         @wraps(func)
         def wrapper(query: str, *args, **kwargs):
-            # Get cache instance (assumed to be in app context)
-            from cache_manager import get_cache_manager
-            cache_mgr = get_cache_manager()
-            
-            if not cache_mgr or not cache_mgr.redis_enabled:
+            try:
+                query_cache = get_query_cache()
+            except Exception as e:
                 # No cache available, call function directly
+                LOG.warning(f"Query cache unavailable: {e}")
                 return func(query, *args, **kwargs)
-            
-            # Initialize query cache
-            query_cache = QueryCache(cache_mgr.redis)
-            
+
             # Try to get from cache
             cached_response = query_cache.get(query, mode)
-            
+
             if cached_response:
                 return cached_response
-            
+
             # Cache miss - call function
             response = func(query, *args, **kwargs)
-            
+
             # Cache the response
             if response:
                 query_cache.set(query, response, mode)
-            
+
             return response
-        
+
         return wrapper
     return decorator
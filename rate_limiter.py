@@ -1,29 +1,165 @@
-
+import math
 import time
 import logging
-from typing import Dict, Optional
-from collections import defaultdict, deque
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
 import os
 
+from flask import jsonify, request as flask_request
+from flask_login import current_user
+
+from config import RATE_LIMIT_MODE, RATE_LIMIT_BACKEND, RATE_LIMIT_MAX_KEYS
+from subscription_tiers import get_user_tier, get_rate_limits
+
 LOG = logging.getLogger("rate_limiter")
 
+Limit = Tuple[int, int]  # (max richieste, finestra in secondi)
+
+# Sliding window counter, atomico: per ogni finestra KEYS = [corrente, precedente],
+# ARGV = [costo, consuma(0/1), poi per finestra: limite, peso precedente, ttl].
+# Restituisce {consentito, usati_1, ..., usati_n} (usati prima di questa richiesta).
+_SLIDING_WINDOW_LUA = """
+local cost = tonumber(ARGV[1])
+local consume = tonumber(ARGV[2])
+local n = #KEYS / 2
+local allowed = 1
+local out = {}
+for i = 1, n do
+  local cur = tonumber(redis.call('GET', KEYS[2 * i - 1]) or '0')
+  local prev = tonumber(redis.call('GET', KEYS[2 * i]) or '0')
+  local limit = tonumber(ARGV[3 * i])
+  local used = math.floor(prev * tonumber(ARGV[3 * i + 1]) + cur)
+  if used + cost > limit then allowed = 0 end
+  out[i + 1] = used
+end
+out[1] = allowed
+if allowed == 1 and consume == 1 then
+  for i = 1, n do
+    redis.call('INCRBY', KEYS[2 * i - 1], cost)
+    redis.call('EXPIRE', KEYS[2 * i - 1], tonumber(ARGV[3 * i + 2]))
+  end
+end
+return out
+"""
+
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    limit: Optional[int] = None        # limite della finestra piu' stretta (None = nessun limite)
+    window: Optional[int] = None
+    remaining: Optional[int] = None
+    reset_time: Optional[int] = None   # epoch: fine della finestra corrente
+    retry_after: int = 0               # secondi (stima) se non consentito
+
+
+class MemorySlidingWindow:
+    """In-process sliding window counters: one (window index, current, previous) triple per key."""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max(1, int(max_keys))
+        self._counters: "OrderedDict[str, List[int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _counter(self, key: str, idx: int) -> List[int]:
+        c = self._counters.get(key)
+        if c is None:
+            c = self._counters[key] = [idx, 0, 0]
+            return c
+        self._counters.move_to_end(key)
+        if c[0] != idx:
+            c[2] = c[1] if c[0] == idx - 1 else 0
+            c[1], c[0] = 0, idx
+        return c
+
+    def _prune(self, now: float) -> None:
+        # i contatori fermi da piu' di due finestre valgono zero
+        stale = [k for k, c in self._counters.items() if (c[0] + 2) * int(k.rsplit(":", 1)[1]) < now]
+        for k in stale:
+            del self._counters[k]
+        if len(self._counters) > self.max_keys:
+            # ancora troppe: scarta quelle usate meno di recente (LRU), non tutte
+            LOG.warning("[RateLimit] %d chiavi in memoria, scarto le meno recenti", len(self._counters))
+            while len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+
+    def hit(self, keys: List[str], limits: List[Limit], now: float, cost: int = 1,
+            consume: bool = True) -> Tuple[bool, List[int]]:
+        with self._lock:
+            if len(self._counters) > self.max_keys:
+                self._prune(now)
+            counters, used = [], []
+            for key, (_, window) in zip(keys, limits):
+                idx = int(now // window)
+                c = self._counter(key, idx)
+                weight = 1.0 - (now - idx * window) / window
+                counters.append(c)
+                used.append(int(c[2] * weight + c[1]))
+            allowed = all(u + cost <= limit for u, (limit, _) in zip(used, limits))
+            if allowed and consume:
+                for c in counters:
+                    c[1] += cost
+            return allowed, used
+
+
+class RedisSlidingWindow:
+    """Same counters in Redis, read and updated by one Lua script (atomic across workers)."""
+
+    def __init__(self, client, prefix: str = "rl:"):
+        self.redis = client
+        self.prefix = prefix
+        self._script = client.register_script(_SLIDING_WINDOW_LUA)
+
+    def hit(self, keys: List[str], limits: List[Limit], now: float, cost: int = 1,
+            consume: bool = True) -> Tuple[bool, List[int]]:
+        redis_keys, args = [], [cost, 1 if consume else 0]
+        for key, (limit, window) in zip(keys, limits):
+            idx = int(now // window)
+            redis_keys += [f"{self.prefix}{key}:{idx}", f"{self.prefix}{key}:{idx - 1}"]
+            args += [limit, repr(1.0 - (now - idx * window) / window), 2 * window]
+        out = self._script(keys=redis_keys, args=args)
+        return bool(int(out[0])), [int(u) for u in out[1:]]
+
+
 class RateLimiter:
-    """Rate limiter to protect against API abuse in deployed environment"""
-    
-    def __init__(self, max_requests: int = 999999, time_window: int = 3600):
-        self.max_requests = max_requests  # 10 requests
-        self.time_window = time_window     # 3600 seconds (1 hour)
-        self.requests: Dict[str, deque] = defaultdict(deque)
+    """Per-route, per-tier, per-user sliding window limits (Redis when available, else in-process)"""
+
+    def __init__(self, mode: str = RATE_LIMIT_MODE, backend: str = RATE_LIMIT_BACKEND):
         self.is_deployed = self._is_deployed_environment()
-        
-        LOG.info(f"RateLimiter initialized: max_requests={max_requests}, window={time_window}s, deployed={self.is_deployed}")
-    
+        mode = (mode or "auto").lower()
+        self.enforced = mode == "on" or (mode == "auto" and self.is_deployed)
+        self.local = MemorySlidingWindow()
+        self.redis = self._make_redis_backend(backend)
+        self.stats = {"allowed": 0, "limited": 0, "redis_errors": 0}
+
+        LOG.info(f"RateLimiter initialized: enforced={self.enforced}, backend={self.backend_name}, deployed={self.is_deployed}")
+
+    @staticmethod
+    def _make_redis_backend(backend: str) -> Optional[RedisSlidingWindow]:
+        if (backend or "auto").lower() == "memory":
+            return None
+        try:
+            from cache_redis import get_redis_cache
+            rc = get_redis_cache()
+            if rc.enabled and rc.client is not None:
+                return RedisSlidingWindow(rc.client)
+        except Exception as e:
+            LOG.warning(f"Redis rate limiting unavailable, using in-process counters: {e}")
+        return None
+
+    @property
+    def backend_name(self) -> str:
+        return "redis" if self.redis is not None else "memory"
+
     def _is_deployed_environment(self) -> bool:
         """Detect if running in deployed environment"""
         # Check for deployment indicators
         deployment_indicators = [
             os.getenv("REPLIT_DEPLOYMENT") == "1",
-            os.getenv("REPL_DEPLOYMENT") == "1", 
+            os.getenv("REPL_DEPLOYMENT") == "1",
             "fantacalcioai.it" in os.getenv("REPLIT_URL", ""),
             os.getenv("ENVIRONMENT") == "production",
             # Additional deployment detection
@@ -35,73 +171,126 @@ class RateLimiter:
         is_deployed = any(deployment_indicators)
         LOG.info(f"Deployment detection: {dict(zip(['REPLIT_DEPLOYMENT', 'REPL_DEPLOYMENT', 'fantacalcioai.it', 'ENVIRONMENT', 'HOSTNAME', 'replit.dev', 'repl.co', 'deployment_file'], [os.getenv('REPLIT_DEPLOYMENT'), os.getenv('REPL_DEPLOYMENT'), 'fantacalcioai.it' in os.getenv('REPLIT_URL', ''), os.getenv('ENVIRONMENT'), os.getenv('HOSTNAME', '').startswith('runner-'), 'replit.dev' in os.getenv('REPLIT_URL', ''), '.repl.co' in os.getenv('REPLIT_URL', ''), os.path.exists('/.replit_deployment')]))} -> {is_deployed}")
         return is_deployed
-    
+
     def _get_client_key(self, request) -> str:
-        """Generate a unique key for the client based on IP address"""
-        # Try to get real IP from headers (in case of proxy/load balancer)
-        real_ip = None
-        
-        # Check various headers for the real IP
-        forwarded_for = request.headers.get('X-Forwarded-For', '')
-        if forwarded_for:
-            # Take the first IP in the chain (original client)
-            real_ip = forwarded_for.split(',')[0].strip()
-        
-        if not real_ip:
-            real_ip = request.headers.get('X-Real-IP', '')
-        
-        if not real_ip:
-            real_ip = request.environ.get('HTTP_X_FORWARDED_FOR', '').split(',')[0].strip()
-        
-        if not real_ip:
-            real_ip = request.environ.get('REMOTE_ADDR', '')
-        
-        if not real_ip:
-            real_ip = request.remote_addr
-        
-        # Clean up the IP address
-        if real_ip:
-            real_ip = real_ip.strip()
-            # Remove port if present (e.g., "192.168.1.1:8080" -> "192.168.1.1")
-            if ':' in real_ip and not real_ip.startswith('['):  # Not IPv6
-                real_ip = real_ip.split(':')[0]
-        
-        # In development, use a default key to avoid rate limiting
-        if not self.is_deployed:
-            return "dev_environment"
-        
-        # Use IP as the key, fallback to 'unknown' if we can't determine it
-        client_key = real_ip or 'unknown'
-        
-        LOG.debug(f"Client key determined: {client_key} from request headers")
-        return client_key
-    
-    def _cleanup_old_requests(self, client_key: str) -> None:
-        """Remove requests older than time window"""
-        current_time = time.time()
-        client_requests = self.requests[client_key]
-        
-        while client_requests and current_time - client_requests[0] > self.time_window:
-            client_requests.popleft()
-    
-    def is_allowed(self, request) -> bool:
+        """Client IP: ``remote_addr`` as rewritten by ProxyFix (PROXY_FIX_X_FOR trusted hops).
+
+        X-Forwarded-For is not read here: the client can set it to any value and get a
+        fresh counter on every request.
+        """
+        return request.remote_addr or 'unknown'
+
+    def _identity(self, request) -> Tuple[str, dict]:
+        """(counter key, tier): logged-in users are limited per user id, anonymous clients per IP"""
+        tier = get_user_tier()
+        if current_user.is_authenticated:
+            return f"u:{current_user.id}", tier
+        return f"ip:{self._get_client_key(request)}", tier
+
+    def check(self, request, route: str = "chat", cost: int = 1, consume: bool = True) -> RateLimitResult:
+        """Count one request on ``route`` (unless ``consume`` is False) and tell whether it is allowed"""
+        if not self.enforced:
+            return RateLimitResult(True)
+        who, tier = self._identity(request)
+        limits = get_rate_limits(tier, route)
+        if not limits:
+            return RateLimitResult(True)
+
+        now = time.time()
+        keys = [f"{route}:{who}:{window}" for _, window in limits]
+        try:
+            if self.redis is None:
+                raise LookupError
+            allowed, used = self.redis.hit(keys, limits, now, cost, consume)
+        except LookupError:
+            allowed, used = self.local.hit(keys, limits, now, cost, consume)
+        except Exception as e:
+            self.stats["redis_errors"] += 1
+            LOG.warning(f"Redis rate limit check failed, using in-process counters: {e}")
+            allowed, used = self.local.hit(keys, limits, now, cost, consume)
+
+        # la finestra con meno richieste residue determina gli header
+        i = min(range(len(limits)), key=lambda j: limits[j][0] - used[j])
+        limit, window = limits[i]
+        reset_time = (int(now // window) + 1) * window
+        result = RateLimitResult(allowed, limit, window, max(0, limit - used[i] - (cost if allowed and consume else 0)),
+                                 reset_time)
+        if not allowed:
+            result.retry_after = max(1, math.ceil(reset_time - now))
+        if consume:
+            self.stats["allowed" if allowed else "limited"] += 1
+            request.environ[f"rate_limit.{route}"] = result
+            if not allowed:
+                LOG.warning(f"Rate limit exceeded on {route} for {who} ({tier['name']}): {limit}/{window}s")
+        return result
+
+    def peek(self, request, route: str = "chat") -> RateLimitResult:
+        """Current status of ``route`` for this client, without counting a request"""
+        return self.check(request, route, consume=False)
+
+    def _last(self, request, route: str) -> RateLimitResult:
+        return request.environ.get(f"rate_limit.{route}") or self.peek(request, route)
+
+    def is_allowed(self, request, route: str = "chat") -> bool:
         """Check if request is allowed based on rate limits"""
-        return True  # Rate limiting completely disabled
-    
-    def get_remaining_requests(self, request) -> int:
-        """Get number of remaining requests for client"""
-        return 999999  # Unlimited for all environments
-    
-    def get_reset_time(self, request) -> Optional[int]:
+        return self.check(request, route).allowed
+
+    def get_remaining_requests(self, request, route: str = "chat") -> Optional[int]:
+        """Get number of remaining requests for client (None = unlimited)"""
+        return self._last(request, route).remaining
+
+    def get_reset_time(self, request, route: str = "chat") -> Optional[int]:
         """Get timestamp when rate limit resets"""
-        return None  # No rate limits, so no reset time
-    
+        return self._last(request, route).reset_time
+
+    def limit_message(self, result: RateLimitResult) -> str:
+        if result.window and result.window >= 3600:
+            period = f"{result.window // 3600} ore" if result.window > 3600 else "un'ora"
+        else:
+            period = f"{result.window} secondi"
+        return f"Hai superato il limite di {result.limit} richieste in {period}. Riprova tra {result.retry_after} secondi."
+
     def get_status(self) -> dict:
         """Get current rate limiter status"""
         return {
             "is_deployed": self.is_deployed,
-            "max_requests": self.max_requests,
-            "time_window": self.time_window,
-            "active_clients": len(self.requests),
-            "total_requests": sum(len(client_requests) for client_requests in self.requests.values())
+            "enforced": self.enforced,
+            "backend": self.backend_name,
+            "local_keys": len(self.local._counters),
+            **self.stats
         }
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
+
+
+def rate_limited(route: str):
+    """Flask view decorator: 429 with Retry-After before the view runs when ``route`` is over its limit"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            limiter = get_rate_limiter()
+            result = limiter.check(flask_request, route)
+            if not result.allowed:
+                response = jsonify({
+                    "error": "Rate limit exceeded",
+                    "message": limiter.limit_message(result),
+                    "reset_time": result.reset_time,
+                    "retry_after": result.retry_after
+                })
+                response.status_code = 429
+                response.headers['Retry-After'] = str(result.retry_after)
+                return response
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,5 +1,22 @@
-from typing import List, Dict, Any, Optional
-from rank_bm25 import BM25Okapi
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: nessun lock tra processi
+    fcntl = None
+
+from config import BM25_INDEX_PATH, BM25_COMPACT_EVERY
+from retrieval.tokenizer import TOKENIZER_VERSION, tokenize
+
+LOG = logging.getLogger("retrieval.hybrid")
 
 def reciprocal_rank_fusion(rank_lists: List[List[Dict[str, Any]]], k: int = 60) -> List[Dict[str, Any]]:
     """
@@ -19,31 +36,436 @@ def reciprocal_rank_fusion(rank_lists: List[List[Dict[str, Any]]], k: int = 60)
             by_id.setdefault(it["id"], it)
 
     fused = sorted(by_id.values(), key=lambda x: scores.get(x["id"], 0.0), reverse=True)
+    for it in fused:
+        it["rrf_score"] = scores.get(it["id"], 0.0)
     return fused
 
+
+FORMAT_VERSION = 1
+
+
+def _doc_records(docs: Iterable[str], ids: Iterable[str]) -> List[Dict[str, Any]]:
+    return [{"op": "add", "id": i, "tf": dict(Counter(tokenize(d)))} for d, i in zip(docs, ids)]
+
+
+@contextmanager
+def _dir_lock(path: str):
+    """Lock esclusivo tra processi sulla cartella dell'indice (no-op senza fcntl)."""
+    os.makedirs(path, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(path, "lock"), "a+") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _read_manifest(path: str, any_version: bool = False) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(path, "manifest.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not any_version and (manifest.get("format") != FORMAT_VERSION
+                            or manifest.get("tokenizer") != TOKENIZER_VERSION):
+        return None
+    return manifest
+
+
+def _append_log(path: str, records: List[Dict[str, Any]]) -> bool:
+    if not records or _read_manifest(path) is None:
+        return False
+    with _dir_lock(path):
+        manifest = _read_manifest(path)
+        if manifest is None:
+            return False
+        log_path = os.path.join(path, f"g{manifest['generation']}.delta.jsonl")
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+    return True
+
+
+def append_documents(path: str, docs: List[str], ids: List[str]) -> bool:
+    """
+    Accoda documenti (upsert per id) al delta log dell'indice su disco, senza caricarlo.
+    Ritorna False se l'indice non esiste ancora: verra' costruito dalla collection al primo open().
+    """
+    return _append_log(path, _doc_records(docs, ids))
+
+
+def remove_documents(path: str, ids: List[str]) -> bool:
+    return _append_log(path, [{"op": "del", "id": i} for i in ids])
+
+
 class BM25Index:
     """
-    Indice BM25 semplice: costruiscilo a startup con tutti i testi/ids.
+    Indice BM25 (Okapi, stessi parametri di rank_bm25) su postings invertite.
+
+    - In memoria: ``BM25Index(docs, ids)``, come prima.
+    - Su disco: ``BM25Index.open(path, collection)`` carica vocabolario, postings e
+      lunghezze dei documenti (array numpy in mmap) e riapplica il delta log; se
+      l'indice manca o non e' allineato alla collection lo ricostruisce (una volta).
+      ``add``/``remove`` (o ``append_documents`` da altri processi) scrivono nel
+      delta log; ``compact`` scrive una nuova generazione con il delta incorporato.
+
+    I df dei documenti rimossi/sostituiti restano contati fino alla compattazione.
     """
-    def __init__(self, docs: List[str], ids: List[str]):
-        self.ids = ids
-        # tokenizziamo banalmente su split(); per risultati migliori usa una tokenizzazione piu furba
-        self.docs_tok = [d.split() for d in docs]
-        self.bm25 = BM25Okapi(self.docs_tok)
+    def __init__(self, docs: Optional[List[str]] = None, ids: Optional[List[str]] = None,
+                 k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25, path: Optional[str] = None):
+        self.k1, self.b, self.epsilon = k1, b, epsilon
+        self.path = path
+        self._lock = threading.RLock()
+        self._compacting = False
+        self._reset()
+        if docs and ids:
+            self._apply(_doc_records(docs, ids))
+
+    def _reset(self) -> None:
+        self.generation = 0
+        self.vocab: Dict[str, int] = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.post_docs = np.zeros(0, dtype=np.int32)
+        self.post_tfs = np.zeros(0, dtype=np.int32)
+        self.df = np.zeros(0, dtype=np.int32)
+        self.base_len = np.zeros(0, dtype=np.int32)
+        self.ids: List[str] = []
+        self.pos: Dict[str, int] = {}
+        # documenti arrivati dopo l'ultima compattazione
+        self.delta: Dict[str, List[Tuple[int, int]]] = {}
+        self.delta_len: List[int] = []
+        self.deleted: set = set()
+        self.total_len = 0
+        self._manifest_sig: Optional[Tuple[int, int]] = None
+        self._log_offset = 0
+        self._doc_len: Optional[np.ndarray] = None
+        self._avg_idf: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self.ids) - len(self.deleted)
+
+    # ---------- aggiornamenti ----------
+    def _apply(self, records: Iterable[Dict[str, Any]]) -> None:
+        for rec in records:
+            old = self.pos.pop(rec["id"], None)
+            if old is not None and old not in self.deleted:
+                self.deleted.add(old)
+                self.total_len -= self._len_of(old)
+            if rec.get("op") != "add":
+                continue
+            idx = len(self.ids)
+            self.ids.append(rec["id"])
+            self.pos[rec["id"]] = idx
+            for term, tf in rec["tf"].items():
+                self.delta.setdefault(term, []).append((idx, int(tf)))
+            dl = sum(int(tf) for tf in rec["tf"].values())
+            self.delta_len.append(dl)
+            self.total_len += dl
+        self._doc_len = None
+        self._avg_idf = None
+
+    def _len_of(self, idx: int) -> int:
+        n_base = len(self.base_len)
+        return int(self.base_len[idx]) if idx < n_base else self.delta_len[idx - n_base]
+
+    def add(self, docs: List[str], ids: List[str]) -> None:
+        """Aggiunge (o sostituisce, per id) documenti; persistente se l'indice e' su disco."""
+        records = _doc_records(docs, ids)
+        with self._lock:
+            if self.path and _append_log(self.path, records):
+                self.refresh()
+            else:
+                self._apply(records)
+
+    def remove(self, ids: List[str]) -> None:
+        records = [{"op": "del", "id": i} for i in ids]
+        with self._lock:
+            if self.path and _append_log(self.path, records):
+                self.refresh()
+            else:
+                self._apply(records)
+
+    # ---------- persistenza ----------
+    def _file(self, generation: int, name: str) -> str:
+        return os.path.join(self.path, f"g{generation}.{name}")
+
+    def _load_generation(self, manifest: Dict[str, Any]) -> None:
+        gen = manifest["generation"]
+        self._reset()
+        self.k1, self.b, self.epsilon = manifest["k1"], manifest["b"], manifest["epsilon"]
+        self.generation = gen
+        with open(self._file(gen, "vocab.json"), "r", encoding="utf-8") as f:
+            self.vocab = {t: i for i, t in enumerate(json.load(f))}
+        with open(self._file(gen, "ids.json"), "r", encoding="utf-8") as f:
+            self.ids = json.load(f)
+        self.pos = {d: i for i, d in enumerate(self.ids)}
+        self.offsets = np.load(self._file(gen, "offsets.npy"), mmap_mode="r")
+        self.post_docs = np.load(self._file(gen, "docs.npy"), mmap_mode="r")
+        self.post_tfs = np.load(self._file(gen, "tfs.npy"), mmap_mode="r")
+        self.df = np.load(self._file(gen, "df.npy"), mmap_mode="r")
+        self.base_len = np.load(self._file(gen, "doclen.npy"), mmap_mode="r")
+        self.total_len = int(manifest["total_len"])
+
+    def refresh(self, auto_compact: bool = True) -> None:
+        """Riallinea l'indice al disco: nuova generazione e/o nuove righe del delta log."""
+        if not self.path:
+            return
+        with self._lock:
+            try:
+                st = os.stat(os.path.join(self.path, "manifest.json"))
+            except OSError:
+                return
+            sig = (st.st_mtime_ns, st.st_size)
+            if sig != self._manifest_sig:
+                manifest = _read_manifest(self.path)
+                if manifest is None:
+                    return
+                self._load_generation(manifest)
+                self._manifest_sig = sig
+            log_path = self._file(self.generation, "delta.jsonl")
+            try:
+                if os.path.getsize(log_path) <= self._log_offset:
+                    return
+                with open(log_path, "rb") as f:
+                    f.seek(self._log_offset)
+                    chunk = f.read()
+            except OSError:
+                return
+            complete = chunk[:chunk.rfind(b"\n") + 1]  # ignora un'eventuale riga in scrittura
+            self._log_offset += len(complete)
+            records = []
+            for line in complete.decode("utf-8").splitlines():
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    LOG.warning("[BM25] Riga del delta log non valida, ignorata")
+            self._apply(records)
+            if auto_compact and len(self.delta_len) + len(self.deleted) >= BM25_COMPACT_EVERY:
+                self.compact()
+
+    def compact(self) -> None:
+        """Scrive una nuova generazione (postings ordinate, senza documenti rimossi)."""
+        if not self.path:
+            return
+        with self._lock, _dir_lock(self.path):
+            if self._manifest_sig is not None:
+                # indice caricato da disco: incorpora le righe scritte nel frattempo da altri processi
+                self.refresh(auto_compact=False)
+                if not self.delta_len and not self.deleted:
+                    return
+            n_total = len(self.ids)
+            alive = np.ones(n_total, dtype=bool)
+            if self.deleted:
+                alive[list(self.deleted)] = False
+            remap = np.cumsum(alive) - 1
+
+            terms = list(self.vocab)
+            term_of = np.repeat(np.arange(len(terms), dtype=np.int64), np.diff(np.asarray(self.offsets)))
+            docs, tfs = [np.asarray(self.post_docs, dtype=np.int64)], [np.asarray(self.post_tfs, dtype=np.int64)]
+            term_ids = [term_of]
+            index_of = dict(self.vocab)
+            for term, plist in self.delta.items():
+                tid = index_of.setdefault(term, len(index_of))
+                if tid == len(terms):
+                    terms.append(term)
+                arr = np.asarray(plist, dtype=np.int64).reshape(-1, 2)
+                docs.append(arr[:, 0])
+                tfs.append(arr[:, 1])
+                term_ids.append(np.full(len(arr), tid, dtype=np.int64))
+            docs, tfs, term_ids = np.concatenate(docs), np.concatenate(tfs), np.concatenate(term_ids)
+            keep = alive[docs]
+            docs, tfs, term_ids = remap[docs[keep]], tfs[keep], term_ids[keep]
+
+            order = np.lexsort((docs, term_ids))
+            docs, tfs, term_ids = docs[order], tfs[order], term_ids[order]
+            df = np.bincount(term_ids, minlength=len(terms))
+            used = np.flatnonzero(df)
+            new_tid = np.full(len(terms), -1, dtype=np.int64)
+            new_tid[used] = np.arange(len(used))
+            df = df[used]
+            offsets = np.concatenate(([0], np.cumsum(df))).astype(np.int64)
+            doc_len = self._doc_lengths()[alive].astype(np.int32)
+            ids = [d for d, a in zip(self.ids, alive) if a]
+
+            raw = _read_manifest(self.path, any_version=True) or {}
+            gen = max(self.generation, int(raw.get("generation", 0))) + 1
+            with open(self._file(gen, "vocab.json"), "w", encoding="utf-8") as f:
+                json.dump([terms[t] for t in used], f, ensure_ascii=False)
+            with open(self._file(gen, "ids.json"), "w", encoding="utf-8") as f:
+                json.dump(ids, f, ensure_ascii=False)
+            np.save(self._file(gen, "offsets.npy"), offsets)
+            np.save(self._file(gen, "docs.npy"), docs.astype(np.int32))
+            np.save(self._file(gen, "tfs.npy"), tfs.astype(np.int32))
+            np.save(self._file(gen, "df.npy"), df.astype(np.int32))
+            np.save(self._file(gen, "doclen.npy"), doc_len)
+            manifest = {"format": FORMAT_VERSION, "tokenizer": TOKENIZER_VERSION, "generation": gen,
+                        "k1": self.k1, "b": self.b, "epsilon": self.epsilon,
+                        "n_docs": len(ids), "total_len": int(doc_len.sum())}
+            tmp = os.path.join(self.path, "manifest.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(tmp, os.path.join(self.path, "manifest.json"))
+
+            for name in os.listdir(self.path):
+                if name.startswith("g") and not name.startswith(f"g{gen}."):
+                    try:
+                        os.remove(os.path.join(self.path, name))
+                    except OSError:
+                        pass
+            self._manifest_sig = None
+            self.refresh(auto_compact=False)
+            LOG.info("[BM25] Compattato: generazione %d, %d documenti, %d termini", gen, len(ids), len(used))
+
+    def _compaction_due(self) -> bool:
+        return (self._manifest_sig is not None
+                and len(self.delta_len) + len(self.deleted) >= BM25_COMPACT_EVERY)
+
+    def _compact_in_background(self) -> None:
+        """
+        Compatta in un thread daemon su una copia caricata dal disco, senza tenere il lock
+        di questo indice: le query continuano e la nuova generazione arriva col prossimo refresh.
+        """
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+
+        def run():
+            try:
+                idx = BM25Index.load(self.path)
+                if idx is not None:
+                    idx.compact()
+            except Exception as e:
+                LOG.warning("[BM25] Compattazione in background fallita: %s", e)
+            finally:
+                self._compacting = False
+
+        threading.Thread(target=run, name="bm25-compact", daemon=True).start()
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        """Carica l'indice da disco (postings in mmap); None se assente o di formato diverso."""
+        if _read_manifest(path) is None:
+            return None
+        idx = cls(path=path)
+        idx.refresh()
+        return idx
+
+    @classmethod
+    def open(cls, path: str = BM25_INDEX_PATH, collection=None) -> "BM25Index":
+        """Carica l'indice da disco; lo (ri)costruisce dalla collection se manca o non e' allineato."""
+        idx = cls.load(path)
+        if collection is None:
+            return idx if idx is not None else cls(path=path)
+        count = collection.count()
+        if idx is not None and len(idx) == count:
+            return idx
+        LOG.info("[BM25] Indice %s (%s doc) non allineato alla collection (%d doc): ricostruzione",
+                 path, len(idx) if idx is not None else "assente", count)
+        return cls.rebuild(path, collection)
+
+    @classmethod
+    def rebuild(cls, path: str, collection) -> "BM25Index":
+        from retrieval.helpers import dump_chroma_texts_ids
+        texts, ids = dump_chroma_texts_ids(collection)
+        idx = cls(texts, ids, path=path)
+        idx.compact()
+        return idx
+
+    # ---------- scoring ----------
+    def _doc_lengths(self) -> np.ndarray:
+        if self._doc_len is None:
+            self._doc_len = np.concatenate((np.asarray(self.base_len, dtype=np.float64),
+                                            np.asarray(self.delta_len, dtype=np.float64)))
+        return self._doc_len
+
+    def _df(self, term: str) -> int:
+        tid = self.vocab.get(term)
+        base = int(self.df[tid]) if tid is not None else 0
+        return base + len(self.delta.get(term, ()))
+
+    def _raw_idf(self, df):
+        n = len(self)
+        return np.log(np.maximum(n - df, 0) + 0.5) - np.log(df + 0.5)
+
+    def _average_idf(self) -> float:
+        if self._avg_idf is None:
+            df = np.asarray(self.df, dtype=np.float64).copy()
+            extra = []
+            for term, plist in self.delta.items():
+                tid = self.vocab.get(term)
+                if tid is None:
+                    extra.append(len(plist))
+                else:
+                    df[tid] += len(plist)
+            df = np.concatenate((df, np.asarray(extra, dtype=np.float64)))
+            self._avg_idf = float(self._raw_idf(df).mean()) if len(df) else 0.0
+        return self._avg_idf
+
+    def _idf(self, term: str) -> float:
+        df = self._df(term)
+        if df == 0:
+            return 0.0
+        idf = float(self._raw_idf(df))
+        return idf if idf >= 0 else self.epsilon * self._average_idf()
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        parts_d, parts_t = [], []
+        tid = self.vocab.get(term)
+        if tid is not None:
+            lo, hi = int(self.offsets[tid]), int(self.offsets[tid + 1])
+            parts_d.append(np.asarray(self.post_docs[lo:hi], dtype=np.int64))
+            parts_t.append(np.asarray(self.post_tfs[lo:hi], dtype=np.float64))
+        plist = self.delta.get(term)
+        if plist:
+            arr = np.asarray(plist, dtype=np.int64)
+            parts_d.append(arr[:, 0])
+            parts_t.append(arr[:, 1].astype(np.float64))
+        if not parts_d:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        return np.concatenate(parts_d), np.concatenate(parts_t)
 
     def search(self, query: str, top_k: int = 100) -> List[Dict[str, Any]]:
-        qtok = query.split()
-        scores = self.bm25.get_scores(qtok)
-        ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
-        out = []
-        for i in ranked:
-            out.append({
-                "id": self.ids[i],
-                # ricostruiamo un testo grezzo (serve solo per il rerank o debug)
-                "text": " ".join(self.docs_tok[i]),
-                "bm25_score": float(scores[i])
-            })
-        return out
+        """
+        Top-k BM25: si calcolano solo i documenti presenti nelle postings dei
+        termini della query, poi selezione parziale dei migliori k (costo
+        O(postings + k log k), indipendente dalla dimensione del corpus).
+        """
+        # nessuna compattazione sincrona sul percorso delle query: la fa un thread a parte
+        self.refresh(auto_compact=False)
+        if self._compaction_due():
+            self._compact_in_background()
+        with self._lock:
+            if len(self) == 0 or top_k <= 0:
+                return []
+            doc_len = self._doc_lengths()
+            avgdl = self.total_len / len(self)
+            parts_d, parts_s = [], []
+            for q, qf in Counter(tokenize(query)).items():
+                idf = self._idf(q)
+                if not idf:
+                    continue
+                docs, tf = self._postings(q)
+                denom = tf + self.k1 * (1 - self.b + self.b * doc_len[docs] / avgdl)
+                parts_d.append(docs)
+                parts_s.append(qf * idf * (tf * (self.k1 + 1) / denom))
+            if not parts_d:
+                return []
+            cand, inverse = np.unique(np.concatenate(parts_d), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(parts_s), minlength=len(cand))
+            if self.deleted:
+                alive = ~np.isin(cand, np.fromiter(self.deleted, dtype=np.int64))
+                cand, scores = cand[alive], scores[alive]
+            if len(cand) > top_k:
+                # soglia = k-esimo punteggio; i pari merito restano per l'ordinamento stabile
+                kth = np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+                keep = scores >= kth
+                cand, scores = cand[keep], scores[keep]
+            order = np.lexsort((cand, -scores))[:top_k]  # score desc, a parita' ordine di inserimento
+            return [{"id": self.ids[int(cand[i])], "bm25_score": float(scores[i])} for i in order]
+
 
 def chroma_search(collection, query_vec, where: Optional[dict] = None, top_k: int = 100) -> List[Dict[str, Any]]:
     """
@@ -66,6 +488,25 @@ def chroma_search(collection, query_vec, where: Optional[dict] = None, top_k: in
         })
     return out
 
+def _fetch_from_collection(collection, ids: List[str], meta_by_id: Dict[str, Any],
+                           text_by_id: Optional[Dict[str, Any]]) -> None:
+    """Completa metadati (e testi, se ``text_by_id``) degli id arrivati solo dal lato sparse."""
+    if not ids:
+        return
+    include = ["metadatas"] if text_by_id is None else ["documents", "metadatas"]
+    try:
+        got = collection.get(ids=ids, include=include)
+    except Exception as e:
+        LOG.warning("[BM25] Recupero testi da Chroma fallito: %s", e)
+        return
+    docs = got.get("documents") or []
+    metas = got.get("metadatas") or []
+    for i, rid in enumerate(got.get("ids") or []):
+        if text_by_id is not None and i < len(docs):
+            text_by_id[rid] = docs[i]
+        if i < len(metas) and metas[i]:
+            meta_by_id[rid] = metas[i]
+
 def hybrid_search(
     query: str,
     query_vec,
@@ -73,25 +514,59 @@ def hybrid_search(
     bm25_index: Optional[BM25Index] = None,
     where: Optional[dict] = None,
     final_k: int = 8,
-    reranker=None
+    reranker=None,
+    boost_where: Optional[Dict[str, Any]] = None,
+    boost: float = 1.0,
+    dense_fallback: bool = False,
 ) -> List[Dict[str, Any]]:
     """
     1) Dense (Chroma) + 2) Sparse (BM25, se presente) -> 3) RRF
     4) Rerank (CrossEncoder, se presente) -> top_k
+
+    ``boost_where`` (uguaglianze sui metadati, es. {"season": "2025-26"}) non filtra:
+    aggiunge ``boost`` al punteggio RRF degli item che corrispondono e li marca con
+    ``boost_match``, che il reranker usa come chiave primaria. Con il default 1.0
+    (> di qualsiasi punteggio RRF) gli item corrispondenti precedono tutti gli altri.
+
+    Con ``dense_fallback`` una query densa filtrata da ``where`` che non trova nulla
+    viene ripetuta senza filtro.
     """
-    dense = chroma_search(collection, query_vec, where=where, top_k=max(100, final_k))
-    sparse = bm25_index.search(query, top_k=100) if bm25_index else []
+    # non ha senso chiedere piu' candidati di quanti il reranker (o final_k) ne usera'
+    keep = max(final_k, getattr(reranker, "max_candidates", 0)) if reranker else final_k
+    dense = chroma_search(collection, query_vec, where=where, top_k=keep)
+    if not dense and where and dense_fallback:
+        dense = chroma_search(collection, query_vec, where=None, top_k=keep)
+    sparse = bm25_index.search(query, top_k=keep) if bm25_index else []
 
     fused = reciprocal_rank_fusion([dense, sparse], k=60)
 
     # arricchisci gli item provenienti da sparse con i metadata se disponibili in dense
     meta_by_id = {d["id"]: d.get("metadata") for d in dense if d.get("metadata")}
     text_by_id = {d["id"]: d.get("text") for d in dense}
+
+    if boost_where:
+        # il boost serve prima del taglio: per gli item solo-sparse bastano i metadati
+        _fetch_from_collection(collection, [it["id"] for it in fused if it["id"] not in meta_by_id],
+                               meta_by_id, None)
+        for it in fused:
+            meta = it.get("metadata") or meta_by_id.get(it["id"]) or {}
+            it["boost_match"] = all(meta.get(k) == v for k, v in boost_where.items())
+            if it["boost_match"]:
+                it["rrf_score"] = it.get("rrf_score", 0.0) + boost
+        fused.sort(key=lambda it: it.get("rrf_score", 0.0), reverse=True)
+
+    # solo i candidati che possono sopravvivere (rerank o final_k) servono con il testo
+    fused = fused[:keep]
+
+    # l'indice BM25 non conserva i testi: recupera da Chroma quelli arrivati solo dal lato sparse
+    missing = [it["id"] for it in fused if it["id"] not in text_by_id and not it.get("text")]
+    _fetch_from_collection(collection, missing, meta_by_id, text_by_id)
+
     items = []
     for it in fused:
         rid = it["id"]
         it["metadata"] = it.get("metadata") or meta_by_id.get(rid, {})
-        it["text"] = it.get("text") or text_by_id.get(rid, it.get("text", ""))
+        it["text"] = it.get("text") or text_by_id.get(rid) or ""
         items.append(it)
 
     if reranker:
@@ -1,10 +1,13 @@
+import logging
 from typing import List, Dict, Any, Tuple, Optional
 from datetime import datetime
+from config import BM25_INDEX_PATH, RAG_SEASON_BOOST, RERANK_ENABLED
 from hf_embedder import HFEmbedder
 from retrieval.hybrid import BM25Index, hybrid_search
 from retrieval.reranker import CrossEncoderReranker
 
 DATE_FMT = "%Y-%m-%d"
+LOG = logging.getLogger("retrieval.rag_pipeline")
 
 
 class RAGPipeline:
@@ -25,9 +28,19 @@ class RAGPipeline:
     ):
         self.collection = chroma_collection
         self.embedder = HFEmbedder()
-        self.bm25 = BM25Index(docs_texts, docs_ids) if docs_texts and docs_ids else None
-        self.reranker = CrossEncoderReranker()  # puo' disattivarsi internamente
+        if docs_texts and docs_ids:
+            self.bm25 = BM25Index(docs_texts, docs_ids)
+        else:
+            # indice persistente: mmap a startup, ricostruito solo se non allineato alla collection
+            try:
+                self.bm25 = BM25Index.open(BM25_INDEX_PATH, chroma_collection)
+            except Exception as e:
+                LOG.warning("[RAG] Indice BM25 non disponibile: %s", e)
+                self.bm25 = None
+        # cross-encoder caricato in background: fino ad allora (o oltre il budget) resta l'ordine RRF
+        self.reranker = CrossEncoderReranker() if RERANK_ENABLED else None
         self.min_sources = max(1, int(min_sources))
+        self.season_boost = RAG_SEASON_BOOST
 
     @staticmethod
     def _today_str() -> str:
@@ -84,23 +97,20 @@ class RAGPipeline:
     ) -> Dict[str, Any]:
         q_vec = self.embedder.embed_one(user_query, is_query=True).tolist()
 
-        # where solo se stagione passata in modo esplicito e non vuota
+        # stagione passata in modo esplicito e non vuota: la query densa e' filtrata sulla
+        # stagione (piu' i documenti senza stagione) e gli item della stagione ricevono un boost
+        # che resta la chiave primaria anche dopo il rerank; se per la stagione non c'e' nulla,
+        # hybrid_search ripete la sola query densa senza filtro (vecchio fallback)
         use_season = bool(season and isinstance(season, str) and season.strip())
-        where = {"season": {"$eq": season.strip()}} if use_season else {}
+        where = {"$or": [{"season": {"$eq": season.strip()}}, {"season": {"$eq": ""}}]} if use_season else {}
+        boost_where = {"season": season.strip()} if use_season else None
 
-        # primo tentativo (eventualmente con filtro stagione)
         items = hybrid_search(
             user_query, q_vec, self.collection, self.bm25,
             where=where, final_k=final_k, reranker=self.reranker,
+            boost_where=boost_where, boost=self.season_boost, dense_fallback=use_season,
         )
 
-        # fallback: se 0 risultati e avevamo filtrato per stagione, riprova senza filtro
-        if use_season and not items:
-            items = hybrid_search(
-                user_query, q_vec, self.collection, self.bm25,
-                where={}, final_k=final_k, reranker=self.reranker,
-            )
-
         # freschezza permissiva
         today = datetime.utcnow().strftime(DATE_FMT)
         today_num = int(today.replace("-", ""))
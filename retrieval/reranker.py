@@ -1,9 +1,138 @@
-from typing import List, Dict, Any
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+from config import (
+    RERANK_MODEL, RERANK_MAX_CANDIDATES, RERANK_BATCH_SIZE, RERANK_BUDGET_MS, RERANK_CACHE_SIZE,
+    RERANK_RETRY_S
+)
+from model_registry import load_cross_encoder_async
+
+LOG = logging.getLogger("retrieval.reranker")
+
 
 class CrossEncoderReranker:
-    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"):
-        self.model = None  # stub: nessun rerank
+    """
+    Rerank (query, passaggio) con un cross-encoder locale.
+
+    - il modello e' caricato una sola volta per processo, in background: finche'
+      non e' pronto (o se il caricamento fallisce) si restituisce l'ordine RRF;
+      un caricamento fallito viene ritentato al piu' ogni ``RERANK_RETRY_S`` secondi;
+    - si valutano al massimo ``max_candidates`` item, a batch;
+    - i punteggi sono in cache LRU per (hash query, id documento);
+    - se il budget di latenza si esaurisce prima di aver valutato tutti i
+      candidati, si torna all'ordine RRF (i punteggi gia' calcolati restano in cache).
+    """
+
+    def __init__(self, model_name: str = RERANK_MODEL, max_candidates: int = RERANK_MAX_CANDIDATES,
+                 batch_size: int = RERANK_BATCH_SIZE, budget_ms: Optional[float] = RERANK_BUDGET_MS,
+                 cache_size: int = RERANK_CACHE_SIZE):
+        self.model_name = model_name
+        self.max_candidates = max(1, int(max_candidates))
+        self.batch_size = max(1, int(batch_size))
+        self.budget_s = budget_ms / 1000.0 if budget_ms else None
+        self.cache_size = max(0, int(cache_size))
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._future = load_cross_encoder_async(model_name)
+        self._future_lock = threading.Lock()
+        self._failed_at: Optional[float] = None
+        self.stats = {"calls": 0, "reranked": 0, "cache_hits": 0, "scored": 0, "fallback_budget": 0,
+                      "fallback_no_model": 0}
+
+    @property
+    def model(self):
+        """Il cross-encoder se gia' caricato, altrimenti None (non blocca)."""
+        fut = self._future
+        if not fut.done():
+            return None
+        if fut.exception() is None:
+            return fut.result()
+        self._maybe_retry(fut)
+        return None
+
+    def _maybe_retry(self, failed) -> None:
+        # il registry ha gia' scartato il future fallito: una nuova richiesta ricarica il modello
+        now = time.monotonic()
+        with self._future_lock:
+            if self._future is not failed:
+                return
+            if self._failed_at is None:
+                self._failed_at = now
+            if now - self._failed_at < RERANK_RETRY_S:
+                return
+            LOG.info("[Rerank] Nuovo tentativo di caricamento di %s", self.model_name)
+            self._future = load_cross_encoder_async(self.model_name)
+            self._failed_at = None
+
+    @staticmethod
+    def _doc_key(item: Dict[str, Any]) -> str:
+        # gli id vengono aggiornati sul posto: l'hash del testo invalida i punteggi vecchi
+        th = hashlib.sha1((item.get("text") or "").encode("utf-8")).hexdigest()
+        rid = item.get("id")
+        return f"{rid}:{th[:16]}" if rid is not None else "t:" + th
+
+    def _cache_get(self, key: Tuple[str, str]) -> Optional[float]:
+        with self._cache_lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _cache_put(self, pairs: List[Tuple[Tuple[str, str], float]]) -> None:
+        if not self.cache_size:
+            return
+        with self._cache_lock:
+            for key, score in pairs:
+                self._cache[key] = score
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
 
     def rerank(self, query: str, items: List[Dict[str, Any]], top_k: int = 8) -> List[Dict[str, Any]]:
-        # no-op: restituisce i primi top_k così come arrivano
-        return items[:top_k]
\ No newline at end of file
+        self.stats["calls"] += 1
+        if not items:
+            return []
+        model = self.model
+        if model is None:
+            self.stats["fallback_no_model"] += 1
+            return items[:top_k]
+
+        t0 = time.perf_counter()
+        qh = hashlib.sha1((query or "").encode("utf-8")).hexdigest()[:16]
+        candidates = items[:self.max_candidates]
+        keys = [(qh, self._doc_key(it)) for it in candidates]
+        scores: List[Optional[float]] = [self._cache_get(k) for k in keys]
+        todo = [i for i, s in enumerate(scores) if s is None]
+        self.stats["cache_hits"] += len(candidates) - len(todo)
+
+        for s in range(0, len(todo), self.batch_size):
+            if self.budget_s is not None and s and time.perf_counter() - t0 > self.budget_s:
+                self.stats["fallback_budget"] += 1
+                LOG.debug("[Rerank] Budget %.0fms superato dopo %d/%d candidati, uso ordine RRF",
+                          self.budget_s * 1000, s, len(todo))
+                return items[:top_k]
+            batch = todo[s:s + self.batch_size]
+            try:
+                out = model.predict([(query, candidates[i].get("text") or "") for i in batch],
+                                    batch_size=self.batch_size, show_progress_bar=False)
+            except Exception as e:
+                LOG.warning("[Rerank] Predict fallito, uso ordine RRF: %s", e)
+                return items[:top_k]
+            new = [(keys[i], float(v)) for i, v in zip(batch, out)]
+            for i, (_, v) in zip(batch, new):
+                scores[i] = v
+            self._cache_put(new)
+            self.stats["scored"] += len(batch)
+
+        for it, score in zip(candidates, scores):
+            it["rerank_score"] = score
+        # gli item con boost (es. stagione richiesta) restano davanti; poi punteggio del
+        # cross-encoder; ordinamento stabile: a parita' resta l'ordine RRF
+        ranked = sorted(range(len(candidates)),
+                        key=lambda i: (not candidates[i].get("boost_match", False), -scores[i]))
+        self.stats["reranked"] += 1
+        return [candidates[i] for i in ranked[:top_k]]
@@ -0,0 +1,33 @@
+import re
+import unicodedata
+from typing import List
+
+# Versione salvata nel manifest dell'indice BM25: cambiarla forza la ricostruzione
+TOKENIZER_VERSION = "it-v1"
+
+_WORD_RE = re.compile(r"[^\W_]+")
+
+# Stopword italiane (gia' senza accenti) + poche inglesi frequenti nei documenti importati
+STOPWORDS = frozenset("""
+a ad al allo ai agli all alla alle anche avere aveva avevano abbia c che chi ci coi col come con contro
+cui da dal dallo dai dagli dall dalla dalle degli dei del dell della delle dello di dove e ed era erano
+essere fa fra gia gli ha hanno ho i il in io la le lei li lo loro lui ma mi mia mie miei mio ne negli
+nei nel nell nella nelle nello noi non nostro o per perche piu poco qual quale quali quando quanto quel
+quella quelle quelli quello questa queste questi questo se sei si sia siamo sono sta su sua sue sui sul
+sull sulla sulle sullo suo suoi ti tra tu tua tue tuo tuoi tutti tutto un una uno vi voi
+the of and to is in for on with
+""".split())
+
+
+def fold(text: str) -> str:
+    """Minuscolo e senza accenti/diacritici (Vlahović -> vlahovic, città -> citta)."""
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tokenizzazione per BM25: accenti rimossi, apostrofi ed elisioni separati
+    ("dell'Inter" -> "inter"), stopword italiane scartate.
+    """
+    return [t for t in _WORD_RE.findall(fold(text)) if t not in STOPWORDS and (len(t) > 1 or t.isdigit())]
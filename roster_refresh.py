@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+In-process roster refresh scheduler.
+
+Every ``ROSTER_REFRESH_INTERVAL`` seconds each process:
+
+1. checks ``season_roster.json`` (mtime/size first, then a SHA-256 of the
+   content) and, if it changed, hot-swaps the assistant's roster
+   (``FantacalcioAssistant.reload_roster``);
+2. if it holds the leader lock (one process per host, via ``flock``), checks
+   the ETL sources (Chroma directory mtimes/sizes) against the fingerprint
+   recorded after the last successful ETL and, only when they differ, runs
+   ``etl_runner.refresh_roster_async``.
+
+This replaces spawning ``etl_build_roster.py`` on every chat request.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process, always leader
+    fcntl = None
+
+import etl_runner
+from config import (
+    ROSTER_JSON_PATH, ROSTER_REFRESH_INTERVAL, ROSTER_REFRESH_SOURCES, ROSTER_REFRESH_LOCK
+)
+
+LOG = logging.getLogger("roster_refresh")
+
+
+def sources_fingerprint(paths: Sequence[str]) -> str:
+    """Hash of (path, mtime, size) for every file under ``paths``."""
+    entries: List[Tuple[str, int, int]] = []
+    for root in paths:
+        if os.path.isfile(root):
+            files = [root]
+        else:
+            files = [os.path.join(d, f) for d, _, names in os.walk(root) for f in names]
+        for path in files:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, st.st_mtime_ns, st.st_size))
+    entries.sort()
+    return hashlib.sha256(json.dumps(entries).encode("utf-8")).hexdigest()
+
+
+def file_digest(path: str) -> Optional[str]:
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+class RosterRefreshScheduler:
+    """Background thread that keeps the roster fresh (see module docstring)."""
+
+    def __init__(self, get_assistant: Callable[[], Any], roster_path: str = ROSTER_JSON_PATH,
+                 sources: Optional[Sequence[str]] = None, interval: float = ROSTER_REFRESH_INTERVAL,
+                 lock_path: str = ROSTER_REFRESH_LOCK):
+        self.get_assistant = get_assistant
+        self.roster_path = roster_path
+        self.sources = list(sources) if sources is not None else \
+            [s.strip() for s in ROSTER_REFRESH_SOURCES.split(",") if s.strip()]
+        self.interval = interval
+        self.lock_path = lock_path
+        self.state_path = f"{roster_path}.sources"
+        self._lock_file = None
+        self._roster_sig: Optional[Tuple[int, int]] = None
+        self._roster_hash: Optional[str] = None
+        self._check_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"ticks": 0, "etl_runs": 0, "swaps": 0, "last_swap": None}
+
+    # ---------- lifecycle ----------
+    def start(self) -> "RosterRefreshScheduler":
+        if self._thread is None:
+            # Baseline: whatever is on disk now is what the assistant loads lazily
+            self._roster_sig, self._roster_hash = self._roster_signature(), file_digest(self.roster_path)
+            self._thread = threading.Thread(target=self._loop, name="roster-refresh", daemon=True)
+            self._thread.start()
+            LOG.info("[Roster Refresh] Scheduler avviato (ogni %ss, sorgenti: %s)", self.interval, self.sources)
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def trigger(self) -> None:
+        """Run a check now instead of waiting for the next interval."""
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                LOG.error("[Roster Refresh] Errore: %s", e)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def tick(self) -> None:
+        self.stats["ticks"] += 1
+        self.check_roster()
+        if self.is_leader() and self._sources_changed():
+            if etl_runner.refresh_roster_async(cooldown_sec=int(self.interval), on_done=self._etl_done):
+                self.stats["etl_runs"] += 1
+
+    # ---------- leader election ----------
+    def is_leader(self) -> bool:
+        """Hold an exclusive ``flock`` for the lifetime of the process."""
+        if self._lock_file is not None:
+            return True
+        if fcntl is None:
+            self._lock_file = True
+            return True
+        try:
+            os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+            f = open(self.lock_path, "a+")
+        except OSError as e:
+            LOG.warning("[Roster Refresh] Lock non disponibile (%s): %s", self.lock_path, e)
+            return False
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._lock_file = f
+        LOG.info("[Roster Refresh] Leader (pid %s)", os.getpid())
+        return True
+
+    # ---------- freshness ----------
+    def _sources_changed(self) -> bool:
+        current = sources_fingerprint(self.sources)
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                recorded = json.load(f).get("sources")
+        except (OSError, ValueError):
+            recorded = None
+        return current != recorded
+
+    def _etl_done(self, ok: bool) -> None:
+        if ok:
+            tmp = f"{self.state_path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"sources": sources_fingerprint(self.sources)}, f)
+            os.replace(tmp, self.state_path)
+        self.check_roster()
+
+    def _roster_signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.roster_path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def check_roster(self) -> bool:
+        """Hot-swap the roster if ``season_roster.json`` has new content."""
+        with self._check_lock:
+            sig = self._roster_signature()
+            if sig is None or sig == self._roster_sig:
+                return False
+            self._roster_sig = sig
+            digest = file_digest(self.roster_path)
+            if digest is None or digest == self._roster_hash:
+                return False
+            assistant = self.get_assistant()
+            if not hasattr(assistant, "reload_roster"):
+                return False
+            try:
+                count = assistant.reload_roster()
+            except Exception:
+                self._roster_sig = None  # retry on the next tick
+                raise
+            self._roster_hash = digest
+            self.stats["swaps"] += 1
+            self.stats["last_swap"] = sig[0] / 1e9
+            LOG.info("[Roster Refresh] Nuovo roster attivo: %d giocatori", count)
+            return True
+
+
+_scheduler: Optional[RosterRefreshScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def start_roster_refresh(get_assistant: Callable[[], Any]) -> RosterRefreshScheduler:
+    """Start the process-wide scheduler (idempotent)."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = RosterRefreshScheduler(get_assistant).start()
+    return _scheduler
+
+
+def get_roster_refresh() -> Optional[RosterRefreshScheduler]:
+    return _scheduler
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Immutable columnar snapshot of the filtered roster.
+
+The assistant used to rescan ``filtered_roster`` (a list of dicts) on every
+selector call, copying each player and re-running the exclusion logic.  The
+snapshot turns the roster into numpy columns plus precomputed index arrays
+(per role, per team, per age bucket) so selections become masked/sorted array
+operations and only the final picks are materialised back into dicts.
+"""
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+LOG = logging.getLogger("roster_snapshot")
+
+ROLES = ("P", "D", "C", "A")
+AGE_BUCKETS = (21, 23, 25)
+
+# Role hints on ``role_raw`` used by the Under-N selector (kept identical to the
+# historical substring checks in ``FantacalcioAssistant._select_under``).
+_UNDER_ROLE_HINTS = {
+    "D": ("DIFENSOR", "DIFENSORE", "DEF", "DC", "CB", "RB", "LB", "TD", "TS"),
+    "C": ("CENTROCAMP", "MED", "MEZZ", "CM", "CAM", "CDM", "AM", "TQ"),
+    "A": ("ATTACC", "ATT", "ST", "CF", "LW", "RW", "SS", "PUN"),
+    "P": ("PORTIER", "GK", "POR"),
+}
+
+_EXCLUSION_MEMO_SIZE = 32
+
+
+def _num(x: Any) -> float:
+    return float(x) if isinstance(x, (int, float)) and not isinstance(x, bool) else np.nan
+
+
+def _int_or_zero(x: Any) -> int:
+    try:
+        return int(x)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _frozen(arr: np.ndarray) -> np.ndarray:
+    arr.flags.writeable = False
+    return arr
+
+
+def _name_excluded(name: str, excluded: Iterable[str]) -> bool:
+    """Fuzzy exclusion check (same semantics as the legacy per-call loop)."""
+    parts = name.split()
+    for ex in excluded:
+        if ex in name or name in ex:
+            return True
+        if any(part in parts for part in ex.split() if len(part) > 2):
+            return True
+    return False
+
+
+class RosterSnapshot:
+    """Read-only columnar view over a roster, built once per roster change."""
+
+    def __init__(self, players: Sequence[Dict[str, Any]], source: Optional[list],
+                 ref_year: int, roles: Sequence[str], teams: Sequence[str],
+                 birth_years: Sequence[Any], synthetic: Sequence[bool],
+                 under_roles: Optional[Sequence[str]] = None,
+                 dedup: Optional[Sequence[bool]] = None,
+                 version: int = 0):
+        n = len(players)
+        self.players: Tuple[Dict[str, Any], ...] = tuple(players)
+        self.source = source
+        self.ref_year = ref_year
+        self.version = version
+        self.size = n
+
+        self.names_lower: Tuple[str, ...] = tuple((p.get("name") or "").lower() for p in players)
+        self.teams: Tuple[str, ...] = tuple(teams)
+        team_names = sorted(set(self.teams))
+        team_ids = {t: i for i, t in enumerate(team_names)}
+        self.team_names: Tuple[str, ...] = tuple(team_names)
+
+        self.role = _frozen(np.array(list(roles) or [], dtype="U1"))
+        self.team_id = _frozen(np.fromiter((team_ids[t] for t in self.teams), dtype=np.int32, count=n))
+        self.price = _frozen(np.fromiter((_num(p.get("_price")) for p in players), dtype=np.float64, count=n))
+        self.fm = _frozen(np.fromiter((_num(p.get("_fm")) for p in players), dtype=np.float64, count=n))
+        self.birth_year = _frozen(np.fromiter((_int_or_zero(b) for b in birth_years), dtype=np.int32, count=n))
+        self.appearances = _frozen(np.fromiter((_int_or_zero(p.get("appearances")) for p in players),
+                                               dtype=np.int32, count=n))
+        self.synthetic = _frozen(np.fromiter((bool(s) for s in synthetic), dtype=bool, count=n))
+        self.dedup = _frozen(np.fromiter((bool(d) for d in dedup), dtype=bool, count=n)
+                             if dedup is not None else np.ones(n, dtype=bool))
+
+        age = np.where(self.birth_year > 0, ref_year - self.birth_year, -1)
+        self.age = _frozen(age.astype(np.int32))
+
+        # Sort helpers shared by all selectors ("missing" maps to 0 FM / 9999 price)
+        self.fm_or_zero = _frozen(np.nan_to_num(self.fm, nan=0.0))
+        self.price_or_max = _frozen(np.where(np.isnan(self.price), 9_999.0, self.price))
+
+        # ---- precomputed indexes ----
+        regular = ~self.synthetic
+        self.by_role: Dict[str, np.ndarray] = {
+            r: _frozen(np.flatnonzero(regular & (self.role == r))) for r in ROLES
+        }
+        self.by_team: Dict[int, np.ndarray] = {
+            i: _frozen(np.flatnonzero(regular & (self.team_id == i))) for i in range(len(team_names))
+        }
+        has_age = self.age >= 0
+        self.by_age_bucket: Dict[int, np.ndarray] = {
+            b: _frozen(np.flatnonzero(regular & has_age & (self.age <= b))) for b in AGE_BUCKETS
+        }
+
+        # Under-N selector pool: roster + synthetic U21 rows, role-matched via hints
+        valid_by = (self.birth_year >= 1975) & (self.birth_year <= 2010) & (self.age >= 15) & (self.age <= 45)
+        self._under_valid = _frozen(self.dedup & valid_by)
+        self.under_role: Dict[str, np.ndarray] = {}
+        eff_roles = list(under_roles) if under_roles is not None else list(roles)
+        raw_roles = [(p.get("role_raw") or "").strip().upper() for p in players]
+        plain_roles = [(p.get("role") or "").strip().upper() for p in players]
+        for r, hints in _UNDER_ROLE_HINTS.items():
+            self.under_role[r] = _frozen(np.fromiter(
+                (eff_roles[i] == r or plain_roles[i] == r or any(h in raw_roles[i] for h in hints)
+                 for i in range(n)),
+                dtype=bool, count=n,
+            ))
+
+        self._exclusion_memo: Dict[frozenset, np.ndarray] = {}
+        self._memo_lock = threading.Lock()
+
+    # ---------- construction ----------
+    @classmethod
+    def build(cls, roster: List[Dict[str, Any]], ref_year: int,
+              role_of: Callable[[Dict[str, Any]], str],
+              team_of: Callable[[Dict[str, Any]], str],
+              synthetic: Optional[List[Dict[str, Any]]] = None,
+              identity_of: Optional[Callable[[Dict[str, Any]], str]] = None,
+              override_of: Optional[Callable[[Dict[str, Any]], Tuple[Optional[str], Optional[int]]]] = None,
+              version: int = 0) -> "RosterSnapshot":
+        """Build a snapshot from ``roster`` (+ optional synthetic Under-21 rows).
+
+        ``role_of``/``team_of`` return the normalised role letter and the
+        corrected team; ``override_of`` returns ``(role, birth_year)`` from the
+        age overrides, if any (the override birth year wins for every age
+        filter); ``identity_of`` is used to de-duplicate rows for
+        the Under-N pool (first occurrence wins).
+        """
+        players = list(roster or []) + list(synthetic or [])
+        n_regular = len(roster or [])
+        roles, teams, births, under_roles, dedup = [], [], [], [], []
+        seen = set()
+        for i, p in enumerate(players):
+            roles.append(role_of(p))
+            teams.append(team_of(p) if i < n_regular else (p.get("team") or ""))
+            o_role, o_by = override_of(p) if override_of else (None, None)
+            births.append(o_by if o_by else p.get("birth_year"))
+            under_roles.append(o_role or (p.get("role") or "").strip().upper())
+            if identity_of is not None:
+                pid = identity_of(p)
+                dedup.append(pid not in seen)
+                seen.add(pid)
+            else:
+                dedup.append(True)
+        flags = [False] * n_regular + [True] * (len(players) - n_regular)
+        snap = cls(players, roster, ref_year, roles, teams, births, flags,
+                   under_roles=under_roles, dedup=dedup, version=version)
+        LOG.info("[Snapshot] v%d: %d giocatori (%d synthetic), %d squadre",
+                 version, n_regular, len(players) - n_regular, len(snap.team_names))
+        return snap
+
+    # ---------- masks ----------
+    def exclusion_mask(self, excluded: Iterable[str]) -> np.ndarray:
+        """Boolean mask of excluded rows, memoised per exclusion set."""
+        key = frozenset(e.lower() for e in excluded if e)
+        with self._memo_lock:
+            mask = self._exclusion_memo.get(key)
+        if mask is None:
+            # calcolo fuori dal lock: due thread con lo stesso set producono la stessa maschera
+            if key:
+                mask = np.fromiter((_name_excluded(nm, key) for nm in self.names_lower),
+                                   dtype=bool, count=self.size)
+            else:
+                mask = np.zeros(self.size, dtype=bool)
+            mask = _frozen(mask)
+            with self._memo_lock:
+                while len(self._exclusion_memo) >= _EXCLUSION_MEMO_SIZE:
+                    self._exclusion_memo.pop(next(iter(self._exclusion_memo)))
+                self._exclusion_memo[key] = mask
+        return mask
+
+    def age_index(self, max_age: int) -> np.ndarray:
+        """Indices of regular players with known age <= ``max_age``."""
+        idx = self.by_age_bucket.get(max_age)
+        if idx is not None:
+            return idx
+        return np.flatnonzero(~self.synthetic & (self.age >= 0) & (self.age <= max_age))
+
+    def role_index(self, role: str, max_age: Optional[int] = None,
+                   excluded: Iterable[str] = ()) -> np.ndarray:
+        """Indices for ``role`` after the optional age filter and exclusions."""
+        idx = self.by_role.get(role)
+        if idx is None:
+            return np.empty(0, dtype=np.int64)
+        if max_age is not None:
+            idx = np.intersect1d(idx, self.age_index(max_age), assume_unique=True)
+        ex = self.exclusion_mask(excluded)
+        if ex.any():
+            idx = idx[~ex[idx]]
+        return idx
+
+    def under_index(self, role: str, max_age: int) -> np.ndarray:
+        """Indices for the Under-N selector (roster + synthetic rows)."""
+        mask = self.under_role.get(role)
+        if mask is None:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(mask & self._under_valid & (self.age <= max_age))
+
+    # ---------- ordering ----------
+    def order_by_fm(self, idx: np.ndarray) -> np.ndarray:
+        """Sort by FM desc, then price asc (stable)."""
+        return idx[np.lexsort((self.price_or_max[idx], -self.fm_or_zero[idx]))]
+
+    def order_by_value(self, idx: np.ndarray, ratio: np.ndarray) -> np.ndarray:
+        """Sort by value ratio desc, FM desc, price asc (stable)."""
+        return idx[np.lexsort((self.price_or_max[idx], -self.fm_or_zero[idx], -ratio))]
+
+    # ---------- materialisation ----------
+    def rows(self, idx: Iterable[int], extra: Optional[Dict[str, Sequence[Any]]] = None) -> List[Dict[str, Any]]:
+        """Copy the selected rows into dicts, applying the snapshot's corrected team
+        and birth year."""
+        out = []
+        for j, i in enumerate(idx):
+            i = int(i)
+            q = dict(self.players[i])
+            team = self.teams[i]
+            if team and team != q.get("team"):
+                q["team"] = team
+            by = int(self.birth_year[i])
+            if by and by != q.get("birth_year"):
+                q["birth_year"] = by
+            if extra:
+                for k, col in extra.items():
+                    q[k] = float(col[j])
+            out.append(q)
+        return out
@@ -11,6 +11,7 @@ from flask_login import login_required, current_user
 from models import User, UserLeague, Subscription
 from league_rules_manager import LeagueRulesManager
 from replit_auth import require_login, require_pro
+from rate_limiter import rate_limited
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -827,11 +828,12 @@ def api_cache_clear():
 
 @app.route('/api/team-builder', methods=['POST'])
 @require_login
+@rate_limited('team_builder')
 def api_team_builder():
     """AI-powered team builder with genetic algorithm"""
     try:
         from subscription_tiers import require_feature, track_feature_usage, has_feature
-        from ai_team_builder import AITeamBuilder, Player
+        from ai_team_builder import AITeamBuilder, Player, ENGINES, ENGINE_GA
         import json
         import logging
         
@@ -853,6 +855,9 @@ def api_team_builder():
         budget = data.get('budget', 500)
         formation_str = data.get('formation', '3-5-2')
         objectives = data.get('objectives', {'performance': 0.5, 'value': 0.3, 'reliability': 0.2})
+        engine = data.get('engine', ENGINE_GA)
+        if engine not in ENGINES:
+            engine = ENGINE_GA
         
         logger.info(f"Raw request data: budget={budget}, formation={formation_str}, objectives={objectives}")
         logger.info(f"Types: formation type={type(formation_str)}, objectives type={type(objectives)}")
@@ -907,7 +912,7 @@ def api_team_builder():
         
         logger.info(f"Converted {len(players)} players successfully")
         
-        builder = AITeamBuilder(players, budget)
+        builder = AITeamBuilder(players, budget, engine=engine)
         result = builder.build_optimal_team(formation_dict, objectives)
         
         logger.info(f"Team building successful: {len(result.get('team', []))} players selected")
@@ -497,13 +497,9 @@ class SerieADataCollector:
             }
         ]
         
-        # Add current players data to database
-        for player_info in current_players_2024_25:
-            self.km.add_knowledge(player_info['text'], player_info['metadata'])
-        
-        # Add strategic knowledge to database
-        for knowledge in strategic_knowledge:
-            self.km.add_knowledge(knowledge['text'], knowledge['metadata'])
+        # Add current players data and strategic knowledge to database
+        seed = current_players_2024_25 + strategic_knowledge
+        self.km.add_knowledge_batch([k['text'] for k in seed], [k['metadata'] for k in seed])
         
         # Transfermarkt URLs (squad pages for better player data)
         transfermarkt_urls = {
@@ -523,16 +519,16 @@ class SerieADataCollector:
         wikipedia_data = self.collect_wikipedia_data(serie_a_teams)
         
         # Add to knowledge base
+        texts, metadatas = [], []
         for data in transfermarkt_data + wikipedia_data:
-            text = f"{data.get('name', data.get('team', ''))} - {data.get('description', '')}"
-            metadata = {
+            texts.append(f"{data.get('name', data.get('team', ''))} - {data.get('description', '')}")
+            metadatas.append({
                 'type': 'real_time_data',
                 'source': data['source'],
                 'updated_at': data['updated_at'],
                 'season': self.current_season
-            }
-            
-            self.km.add_knowledge(text, metadata)
+            })
+        self.km.add_knowledge_batch(texts, metadatas)
         
         print(f"✅ Added {len(transfermarkt_data + wikipedia_data)} entries to knowledge base")
         
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Server-side chat state, keyed by session id.
+
+The Flask cookie only carries the ``sid``; the state dict (conversation
+history, exclusions, last intent, ...) lives in one of:
+
+- ``MemoryStateStore``: in-process LRU (single worker / tests);
+- ``SQLiteStateStore``: local file shared by the workers of one host (default);
+- ``RedisStateStore``: shared between hosts.
+
+States are serialized as compact JSON, zlib-compressed above a small
+threshold, and kept under ``STATE_MAX_BYTES`` by dropping the oldest
+conversation turns first.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config import (
+    STATE_BACKEND, STATE_DB_PATH, STATE_TTL, STATE_MAX_BYTES, STATE_MAX_HISTORY, STATE_MEMORY_MAX_SESSIONS
+)
+
+LOG = logging.getLogger("session_store")
+
+_COMPRESS_MIN = 512  # byte: sotto questa soglia zlib non conviene
+_RAW, _ZLIB = b"j", b"z"
+
+
+def dumps(state: Dict[str, Any]) -> bytes:
+    raw = json.dumps(state, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    if len(raw) >= _COMPRESS_MIN:
+        return _ZLIB + zlib.compress(raw, 6)
+    return _RAW + raw
+
+
+def loads(blob: Optional[bytes]) -> Dict[str, Any]:
+    if not blob:
+        return {}
+    try:
+        raw = zlib.decompress(blob[1:]) if blob[:1] == _ZLIB else blob[1:]
+        state = json.loads(raw.decode("utf-8"))
+    except (ValueError, zlib.error) as e:
+        LOG.warning("[State] Stato illeggibile scartato: %s", e)
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+def fit(state: Dict[str, Any], max_bytes: int = STATE_MAX_BYTES,
+        max_history: int = STATE_MAX_HISTORY) -> Tuple[Dict[str, Any], bytes]:
+    """Serialize ``state``, trimming the conversation history to respect the caps."""
+    state = dict(state or {})
+    history = state.get("conversation_history")
+    if isinstance(history, list) and len(history) > max_history:
+        state["conversation_history"] = history = history[-max_history:]
+    blob = dumps(state)
+    while len(blob) > max_bytes and isinstance(history, list) and history:
+        state["conversation_history"] = history = history[max(1, len(history) // 4):]
+        blob = dumps(state)
+    if len(blob) > max_bytes:
+        LOG.warning("[State] Stato di %d byte oltre il limite (%d): azzerato", len(blob), max_bytes)
+        state, blob = {}, dumps({})
+    return state, blob
+
+
+class MemoryStateStore:
+    """In-process LRU of serialized states (copies on read, like the other backends)."""
+
+    def __init__(self, max_sessions: int = STATE_MEMORY_MAX_SESSIONS, ttl: int = STATE_TTL):
+        self.max_sessions = max(1, int(max_sessions))
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid: str) -> Dict[str, Any]:
+        with self._lock:
+            item = self._data.get(sid)
+            if item is None:
+                return {}
+            if item[0] <= time.time():
+                del self._data[sid]
+                return {}
+            self._data.move_to_end(sid)
+        return loads(item[1])
+
+    def set(self, sid: str, state: Dict[str, Any]) -> None:
+        _, blob = fit(state)
+        with self._lock:
+            self._data[sid] = (time.time() + self.ttl, blob)
+            self._data.move_to_end(sid)
+            while len(self._data) > self.max_sessions:
+                self._data.popitem(last=False)
+
+    def delete(self, sid: str) -> None:
+        with self._lock:
+            self._data.pop(sid, None)
+
+
+class SQLiteStateStore:
+    """One row per session (WAL, connection per thread); expired rows purged periodically."""
+
+    _PURGE_EVERY = 500
+
+    def __init__(self, path: str = STATE_DB_PATH, ttl: int = STATE_TTL):
+        self.path = path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS chat_state (sid TEXT PRIMARY KEY, data BLOB, expires_at REAL)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid: str) -> Dict[str, Any]:
+        row = self._conn().execute(
+            "SELECT data FROM chat_state WHERE sid=? AND expires_at>?", (sid, time.time())).fetchone()
+        return loads(row[0]) if row else {}
+
+    def set(self, sid: str, state: Dict[str, Any]) -> None:
+        _, blob = fit(state)
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO chat_state(sid, data, expires_at) VALUES(?,?,?)",
+                         (sid, sqlite3.Binary(blob), time.time() + self.ttl))
+            self._writes += 1
+            if self._writes % self._PURGE_EVERY == 0:
+                conn.execute("DELETE FROM chat_state WHERE expires_at<=?", (time.time(),))
+
+    def delete(self, sid: str) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM chat_state WHERE sid=?", (sid,))
+
+
+class RedisStateStore:
+    """``chat_state:<sid>`` binary values with SETEX (TTL refreshed on every write)."""
+
+    def __init__(self, client, ttl: int = STATE_TTL, prefix: str = "chat_state:"):
+        self.redis = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, sid: str) -> Dict[str, Any]:
+        return loads(self.redis.get(self.prefix + sid))
+
+    def set(self, sid: str, state: Dict[str, Any]) -> None:
+        _, blob = fit(state)
+        self.redis.setex(self.prefix + sid, self.ttl, blob)
+
+    def delete(self, sid: str) -> None:
+        self.redis.delete(self.prefix + sid)
+
+
+def _redis_binary_client():
+    """Client on the same server as ``cache_redis`` but without ``decode_responses``."""
+    from cache_redis import get_redis_cache
+    rc = get_redis_cache()
+    if not rc.enabled or rc.client is None:
+        return None
+    import redis
+    kwargs = dict(rc.client.connection_pool.connection_kwargs)
+    kwargs["decode_responses"] = False
+    return redis.Redis(connection_pool=redis.ConnectionPool(**kwargs))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _make_store():
+    backend = (STATE_BACKEND or "sqlite").lower()
+    if backend == "redis":
+        client = _redis_binary_client()
+        if client is not None:
+            return RedisStateStore(client)
+        LOG.warning("[State] Redis non disponibile, uso SQLite")
+        backend = "sqlite"
+    if backend == "sqlite":
+        try:
+            return SQLiteStateStore(STATE_DB_PATH)
+        except sqlite3.Error as e:
+            LOG.error("[State] SQLite non disponibile (%s), uso la memoria del processo", e)
+    return MemoryStateStore()
+
+
+def get_state_store():
+    """Process-wide state store (``STATE_BACKEND``: memory | sqlite | redis)."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _make_store()
+                LOG.info("[State] Backend stato chat: %s", type(_store).__name__)
+    return _store
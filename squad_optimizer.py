@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Exact budget-constrained squad selection.
+
+Maximises the sum of per-player scores subject to
+- an exact number of players per role (e.g. {"P": 1, "D": 3, "C": 5, "A": 2}),
+- a total budget in integer credits,
+- at most ``max_per_team`` players from the same club.
+
+Each role is solved as a cardinality-constrained 0/1 knapsack with a numpy DP
+over credits; the role tables are merged with a max-plus convolution.  The
+club cap is enforced with best-first branch-and-bound on top of that
+relaxation (branching on the members of an over-represented club), so the
+result is optimal and deterministic for a given input.
+"""
+import heapq
+import itertools
+import logging
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+LOG = logging.getLogger("squad_optimizer")
+
+NEG = -np.inf
+DEFAULT_MAX_NODES = 5000
+
+
+@dataclass
+class SquadSolution:
+    """Indices (into the input arrays) of the selected squad."""
+    indices: List[int]
+    score: float
+    cost: int
+    optimal: bool
+    nodes: int
+
+
+class _RoleTable:
+    """DP table for one role: best score picking exactly ``k`` players with cost <= c."""
+
+    def __init__(self, cand: np.ndarray, prices: np.ndarray, scores: np.ndarray, k: int, budget: int):
+        self.cand = cand
+        self.prices = prices
+        self.k = k
+        dp = np.full((k + 1, budget + 1), NEG)
+        dp[0, :] = 0.0
+        self.take = np.zeros((len(cand), k + 1, budget + 1), dtype=bool)
+        if k > 0:
+            for i, j in enumerate(cand):
+                p = int(prices[j])
+                if p > budget:
+                    continue
+                new = np.full_like(dp, NEG)
+                new[1:, p:] = dp[:-1, :budget + 1 - p] + scores[j]
+                better = new > dp
+                self.take[i] = better
+                dp = np.where(better, new, dp)
+        self.best = dp[k]
+
+    def picks(self, c: int) -> List[int]:
+        out, k = [], self.k
+        for i in range(len(self.cand) - 1, -1, -1):
+            if k == 0:
+                break
+            if self.take[i, k, c]:
+                j = int(self.cand[i])
+                out.append(j)
+                k -= 1
+                c -= int(self.prices[j])
+        return out
+
+
+def _prune_dominated(idx: np.ndarray, prices: np.ndarray, scores: np.ndarray, team_ids: np.ndarray,
+                     k: int, total: int, cap: Optional[int]) -> np.ndarray:
+    """Drop players that can always be swapped for a cheaper, better one.
+
+    A player is dominated when enough players of the same role cost no more
+    and score no less (ties broken by index).  With a club cap the dominators
+    must come from enough distinct clubs that one of them is always free to
+    take the slot, which keeps the pruning exact.
+    """
+    if len(idx) <= k:
+        return idx
+    p, s, t = prices[idx], scores[idx], team_ids[idx]
+    order = np.arange(len(idx))
+    dom = ((p[None, :] <= p[:, None]) & (s[None, :] >= s[:, None])
+           & ((p[None, :] < p[:, None]) | (s[None, :] > s[:, None]) | (order[None, :] < order[:, None])))
+    if cap is None:
+        keep = dom.sum(axis=1) < k
+    else:
+        need = (k - 1) + (total - 1) // max(cap, 1) + 1
+        keep = np.ones(len(idx), dtype=bool)
+        for i in np.flatnonzero(dom.sum(axis=1) >= need):
+            keep[i] = len(np.unique(t[dom[i]])) < need
+    return idx[keep]
+
+
+class SquadOptimizer:
+    """Exact solver over a fixed candidate set (see module docstring)."""
+
+    def __init__(self, roles: Sequence[str], prices: Sequence[float], scores: Sequence[float],
+                 teams: Sequence[str], quotas: Dict[str, int], budget: int,
+                 max_per_team: Optional[int] = 3):
+        self.quotas = {r: int(c) for r, c in quotas.items() if int(c) > 0}
+        self.budget = int(budget)
+        self.cap = max_per_team
+        self.roles = np.asarray(list(roles), dtype=object)
+        # Credits are integers; round prices up so the budget is never exceeded
+        self.prices = np.maximum(np.ceil(np.asarray(prices, dtype=np.float64) - 1e-9), 0).astype(np.int64)
+        self.scores = np.asarray(scores, dtype=np.float64)
+        team_names = {t: i for i, t in enumerate(sorted(set(teams)))}
+        self.team_ids = np.fromiter((team_names[t] for t in teams), dtype=np.int64, count=len(self.prices))
+
+        total = sum(self.quotas.values())
+        self._cands: Dict[str, np.ndarray] = {}
+        for r, k in self.quotas.items():
+            idx = np.flatnonzero((self.roles == r) & (self.prices <= self.budget) & np.isfinite(self.scores))
+            # Stable, deterministic candidate order: score desc, price asc, index
+            idx = idx[np.lexsort((idx, self.prices[idx], -self.scores[idx]))]
+            self._cands[r] = _prune_dominated(idx, self.prices, self.scores, self.team_ids, k, total, self.cap)
+        self._tables: Dict[Tuple[str, FrozenSet[int], FrozenSet[int]], _RoleTable] = {}
+        self._conv: Dict[tuple, Tuple[np.ndarray, np.ndarray]] = {}
+
+    # ---------- relaxation (no club cap) ----------
+    def _table(self, role: str, forbidden: FrozenSet[int], forced: FrozenSet[int]) -> _RoleTable:
+        key = (role, forbidden, forced)
+        tab = self._tables.get(key)
+        if tab is None:
+            cand = self._cands[role]
+            if forbidden or forced:
+                cand = cand[~np.isin(cand, list(forbidden | forced))]
+            tab = _RoleTable(cand, self.prices, self.scores, self.quotas[role] - len(forced), self.budget)
+            self._tables[key] = tab
+        return tab
+
+    def _max_plus(self, f: np.ndarray, g: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """out[c] = max_a f[a] + g[c - a], plus the maximising split ``a``."""
+        key = (f.tobytes(), id(g))
+        hit = self._conv.get(key)
+        if hit is not None:
+            return hit
+        rows = np.flatnonzero(np.isfinite(f))
+        out = np.full(len(g), NEG)
+        arg = np.zeros(len(g), dtype=np.int64)
+        if len(rows):
+            # Row a of the (zero-copy) Toeplitz view is g shifted right by a
+            b = len(g) - 1
+            padded = np.concatenate((np.full(b, NEG), g))
+            toeplitz = sliding_window_view(padded, b + 1)[::-1]
+            total = f[rows, None] + toeplitz[rows]
+            best = total.argmax(axis=0)
+            out = total[best, np.arange(len(g))]
+            arg = rows[best]
+        self._conv[key] = (out, arg)
+        return out, arg
+
+    def _relax(self, forbidden: FrozenSet[int], forced: FrozenSet[int]) -> Optional[Tuple[float, List[int]]]:
+        forced_cost = int(self.prices[list(forced)].sum()) if forced else 0
+        if forced_cost > self.budget:
+            return None
+        avail = self.budget - forced_cost
+        tables, splits = [], []
+        merged = None
+        for role in sorted(self.quotas):
+            role_forced = frozenset(j for j in forced if self.roles[j] == role)
+            if len(role_forced) > self.quotas[role]:
+                return None
+            role_forbidden = frozenset(j for j in forbidden if self.roles[j] == role)
+            tab = self._table(role, role_forbidden, role_forced)
+            tables.append(tab)
+            if merged is None:
+                merged = tab.best.copy()
+                splits.append(None)
+                continue
+            merged, arg = self._max_plus(merged, tab.best)
+            splits.append(arg)
+        if merged is None or not np.isfinite(merged[avail]):
+            return None
+
+        picks, c = [], avail
+        for tab, arg in zip(reversed(tables), reversed(splits)):
+            a = int(arg[c]) if arg is not None else 0
+            picks.extend(tab.picks(c - a))
+            c = a
+        picks.extend(forced)
+        return float(merged[avail] + self.scores[list(forced)].sum()), sorted(picks)
+
+    def _violation(self, picks: List[int]) -> Optional[List[int]]:
+        """Members of the most over-represented club, if any exceeds the cap."""
+        if self.cap is None:
+            return None
+        ids = self.team_ids[picks]
+        counts = np.bincount(ids)
+        worst = int(counts.argmax())
+        if counts[worst] <= self.cap:
+            return None
+        return [j for j in picks if self.team_ids[j] == worst]
+
+    # ---------- branch and bound ----------
+    def solve(self, max_nodes: int = DEFAULT_MAX_NODES,
+              min_score: Optional[float] = None) -> Optional[SquadSolution]:
+        """Best squad, or ``None`` if infeasible (or nothing scores above ``min_score``)."""
+        counter = itertools.count()
+        root = self._relax(frozenset(), frozenset())
+        floor = -np.inf if min_score is None else float(min_score)
+        if root is None or root[0] <= floor:
+            return None
+        heap = [(-root[0], next(counter), frozenset(), frozenset(), root)]
+        best: Optional[Tuple[float, List[int]]] = None
+        nodes = 1
+        while heap:
+            if -heap[0][0] <= floor + 1e-9:
+                break
+            if nodes >= max_nodes:
+                LOG.warning("[Optimizer] node limit %d reached, returning best feasible squad", max_nodes)
+                break
+            _, _, forbidden, forced, sol = heapq.heappop(heap)
+            if sol is None:
+                sol = self._relax(forbidden, forced)
+                nodes += 1
+                if sol is None or sol[0] <= floor + 1e-9:
+                    continue
+            members = self._violation(sol[1])
+            if members is None:
+                best, floor = sol, sol[0]
+                continue
+            # At least one non-forced member of the club must go: child i keeps
+            # the first i members and drops member i (a partition of the space).
+            free = [j for j in members if j not in forced]
+            already = len(members) - len(free)
+            for i, j in enumerate(free):
+                if already + i > self.cap:
+                    break
+                heapq.heappush(heap, (-sol[0], next(counter), forbidden | {j},
+                                      forced | frozenset(free[:i]), None))
+
+        if best is None:
+            return None
+        optimal = not heap or (-heap[0][0] <= best[0] + 1e-9)
+        picks = best[1]
+        return SquadSolution(indices=picks, score=best[0], cost=int(self.prices[picks].sum()),
+                             optimal=optimal, nodes=nodes)
+
+
+def solve_squad(roles: Sequence[str], prices: Sequence[float], scores: Sequence[float],
+                teams: Sequence[str], quotas: Dict[str, int], budget: int,
+                max_per_team: Optional[int] = 3, max_nodes: int = DEFAULT_MAX_NODES,
+                min_score: Optional[float] = None) -> Optional[SquadSolution]:
+    """Convenience wrapper around :class:`SquadOptimizer`; ``None`` if infeasible."""
+    return SquadOptimizer(roles, prices, scores, teams, quotas, budget, max_per_team).solve(max_nodes, min_score)
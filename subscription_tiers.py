@@ -16,6 +16,11 @@ class SubscriptionTier:
         'price': 0,
         'queries_per_hour': 10,
         'queries_per_day': 50,
+        # route -> [(max richieste, finestra in secondi)], oltre a queries_per_hour/day per la chat
+        'rate_limits': {
+            'chat': [(3, 10)],
+            'team_builder': [(2, 60)],
+        },
         'features': {
             'basic_chat': True,
             'player_search': True,
@@ -38,6 +43,11 @@ class SubscriptionTier:
         'currency': 'EUR',
         'queries_per_hour': None,  # Unlimited
         'queries_per_day': None,
+        # Domande illimitate, ma con un tetto per minuto: protegge i worker dai client rumorosi
+        'rate_limits': {
+            'chat': [(20, 60)],
+            'team_builder': [(5, 60), (60, 86400)],
+        },
         'features': {
             'basic_chat': True,
             'player_search': True,
@@ -60,6 +70,10 @@ class SubscriptionTier:
         'currency': 'EUR',
         'queries_per_hour': None,
         'queries_per_day': None,
+        'rate_limits': {
+            'chat': [(40, 60)],
+            'team_builder': [(10, 60), (200, 86400)],
+        },
         'features': {
             'basic_chat': True,
             'player_search': True,
@@ -123,26 +137,27 @@ def require_feature(feature_name: str, message: str = None):
         return wrapper
     return decorator
 
-def check_rate_limit() -> tuple[bool, Optional[dict]]:
-    """Check if user is within rate limits"""
-    tier = get_user_tier()
-    
-    # Pro/Elite users have unlimited queries
-    if tier['name'] in ['Pro', 'Elite']:
+def get_rate_limits(tier: dict, route: str) -> list:
+    """[(max_requests, window_seconds)] for ``route`` in ``tier``; empty means no limit"""
+    limits = list(tier.get('rate_limits', {}).get(route, ()))
+    if route == 'chat':
+        if tier.get('queries_per_hour'):
+            limits.append((tier['queries_per_hour'], 3600))
+        if tier.get('queries_per_day'):
+            limits.append((tier['queries_per_day'], 86400))
+    return limits
+
+def check_rate_limit(route: str = 'chat') -> tuple[bool, Optional[dict]]:
+    """Check (without consuming) if the current user is within the rate limits of ``route``"""
+    from rate_limiter import get_rate_limiter
+    result = get_rate_limiter().peek(request, route)
+    if result.limit is None:
         return True, None
-    
-    # Free tier rate limiting
-    # This is a simplified version - in production, use Redis for tracking
-    # For now, the existing rate_limiter.py handles this
-    
-    hourly_limit = tier['queries_per_hour']
-    daily_limit = tier['queries_per_day']
-    
-    return True, {
-        'hourly_limit': hourly_limit,
-        'daily_limit': daily_limit,
-        'remaining_hourly': hourly_limit,  # TODO: Track actual usage
-        'remaining_daily': daily_limit
+    return result.allowed, {
+        'limit': result.limit,
+        'window': result.window,
+        'remaining': result.remaining,
+        'reset_time': result.reset_time
     }
 
 def get_tier_comparison() -> list:
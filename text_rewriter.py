@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Single-pass multi-pattern text rewriting for chat replies.
+
+Both post-processing steps of ``/api/chat`` (dropping lines that mention
+excluded players and fixing "(Team)" after corrected players) used to loop
+over lines × names × regex variants.  Here every name variant is compiled
+once into an Aho-Corasick automaton and the reply is scanned in one linear
+pass; matchers are rebuilt only when the exclusions/corrections change.
+"""
+import bisect
+import logging
+import re
+import unicodedata
+from collections import deque
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+
+LOG = logging.getLogger("text_rewriter")
+
+
+class AhoCorasick:
+    """Minimal Aho-Corasick automaton over plain strings."""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        seen: Dict[str, int] = {}
+        for pat in patterns:
+            if not pat or pat in seen:
+                continue
+            seen[pat] = len(self.patterns)
+            self.patterns.append(pat)
+            self._insert(pat, seen[pat])
+        self._link()
+
+    def _insert(self, pat: str, pid: int) -> None:
+        node = 0
+        for ch in pat:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(pid)
+
+    def _link(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                cand = self._goto[f].get(ch, 0)
+                self._fail[nxt] = cand if cand != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """Yield ``(start, end, pattern_id)`` for every (overlapping) match."""
+        goto, fail, out, pats = self._goto, self._fail, self._out, self.patterns
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                for pid in out[node]:
+                    yield i + 1 - len(pats[pid]), i + 1, pid
+
+
+def _lower_same_length(text: str) -> str:
+    """Lower-case ``text`` without changing its length (keeps offsets valid)."""
+    low = text.lower()
+    if len(low) == len(text):
+        return low
+    return "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+
+def _fold(s: str) -> str:
+    s = unicodedata.normalize('NFD', s)
+    return ''.join(c for c in s if unicodedata.category(c) != 'Mn')
+
+
+def name_variants(excluded: str) -> List[str]:
+    """Raw, diacritic-folded and common Slavic spelling variants of a name."""
+    low = excluded.lower().strip()
+    variants = {
+        low,
+        _fold(low),
+        low.replace('ć', 'c').replace('č', 'c').replace('ž', 'z').replace('š', 's'),
+        low.replace('ovic', 'ović').replace('ovic', 'ovič'),
+    }
+    return [v for v in variants if v and len(v) >= 3]
+
+
+def _in_bold(line: str, start: int, end: int) -> bool:
+    """True if ``line[start:end]`` sits inside a ``**...**`` span without other '*'."""
+    if '*' in line[start:end]:
+        return False
+    k = line.rfind('*', 0, start)
+    if k < 1 or line[k - 1] != '*':
+        return False
+    m = line.find('*', end)
+    return m != -1 and m + 1 < len(line) and line[m + 1] == '*'
+
+
+class ExclusionMatcher:
+    """Drops reply lines mentioning excluded players.
+
+    A line is dropped for an excluded name when any of its variants
+    - appears inside a bold ``**...**`` span,
+    - has all of its (>2 char) parts in the line, for multi-part names,
+    - has its single part (>4 chars) in the line, or
+    - is longer than 6 chars and appears anywhere in the line.
+    """
+
+    def __init__(self, excluded: Iterable[str]):
+        self.excluded: Tuple[str, ...] = tuple(sorted({e for e in excluded if e}))
+        # rule = (excluded index, variant id, part ids, single-part rule, long-name rule)
+        needles: Dict[str, int] = {}
+
+        def nid(s: str) -> int:
+            return needles.setdefault(s, len(needles))
+
+        self._rules: List[Tuple[int, int, Tuple[int, ...], bool, bool]] = []
+        for ei, ex in enumerate(self.excluded):
+            for v in name_variants(ex):
+                parts = [p for p in v.split() if len(p) > 2]
+                self._rules.append((
+                    ei, nid(v), tuple(nid(p) for p in parts),
+                    len(parts) == 1 and len(parts[0]) > 4,
+                    len(v) > 6,
+                ))
+        self._ac = AhoCorasick(sorted(needles, key=needles.get))
+        # needle id -> rules that may fire when it is found
+        self._by_needle: Dict[int, List[int]] = {}
+        for ri, (_, vid, pids, _, _) in enumerate(self._rules):
+            for n in {vid, *pids}:
+                self._by_needle.setdefault(n, []).append(ri)
+
+    def _line_excluded(self, line: str, hits: List[Tuple[int, int, int]]) -> Optional[str]:
+        found: Set[int] = {pid for _, _, pid in hits}
+        bold: Set[int] = set()
+        for s, e, pid in hits:
+            if pid not in bold and _in_bold(line, s, e):
+                bold.add(pid)
+        candidates = sorted({ri for pid in found for ri in self._by_needle.get(pid, ())})
+        for ri in candidates:
+            ei, vid, pids, single, long_name = self._rules[ri]
+            if vid in bold:
+                return self.excluded[ei]
+            if len(pids) > 1 and all(p in found for p in pids):
+                return self.excluded[ei]
+            if single and pids[0] in found:
+                return self.excluded[ei]
+            if long_name and vid in found:
+                return self.excluded[ei]
+        return None
+
+    def filter_text(self, text: str) -> Tuple[str, int]:
+        """Return ``(text_without_excluded_lines, removed_line_count)``."""
+        if not text or not self._rules:
+            return text, 0
+        lines = text.split('\n')
+        starts, pos = [], 0
+        for line in lines:
+            starts.append(pos)
+            pos += len(line) + 1
+        low = _lower_same_length(text)
+        per_line: Dict[int, List[Tuple[int, int, int]]] = {}
+        for s, e, pid in self._ac.finditer(low):
+            li = bisect.bisect_right(starts, s) - 1
+            if e > starts[li] + len(lines[li]):
+                continue  # crosses a newline
+            per_line.setdefault(li, []).append((s - starts[li], e - starts[li], pid))
+
+        kept, removed = [], 0
+        for li, line in enumerate(lines):
+            hits = per_line.get(li)
+            if hits:
+                who = self._line_excluded(low[starts[li]:starts[li] + len(line)], hits)
+                if who is not None:
+                    LOG.info(f"Excluding line with player '{who}': {line.strip()}")
+                    removed += 1
+                    continue
+            kept.append(line)
+        return '\n'.join(kept), removed
+
+
+@lru_cache(maxsize=64)
+def exclusion_matcher(excluded: FrozenSet[str]) -> ExclusionMatcher:
+    """Compiled matcher for an exclusion set (shared across requests)."""
+    return ExclusionMatcher(excluded)
+
+
+_WORD = re.compile(r"\w")
+
+
+class TeamCorrectionRewriter:
+    """Rewrites ``Player (Old Team)`` / ``**Player** (Old Team)`` to the corrected team."""
+
+    def __init__(self, corrections: Dict[str, str]):
+        # lower(name) -> (name as stored, replacement team); first entry wins
+        self.corrections: Dict[str, Tuple[str, str]] = {}
+        for name, team in corrections.items():
+            if name and team and name.strip():
+                self.corrections.setdefault(name.lower().strip(), (name.strip(), team))
+        self._names = sorted(self.corrections)
+        self._ac = AhoCorasick(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def rewrite(self, text: str) -> Tuple[str, List[str]]:
+        """Return ``(rewritten_text, applied_corrections)``."""
+        if not text or not self._names:
+            return text, []
+        low = _lower_same_length(text)
+        # Leftmost-longest, non-overlapping name matches
+        matches = sorted(self._ac.finditer(low), key=lambda m: (m[0], -(m[1] - m[0])))
+        out, applied, pos = [], [], 0
+        for s, e, pid in matches:
+            if s < pos:
+                continue
+            if (s > 0 and _WORD.match(text[s - 1])) or (e < len(text) and _WORD.match(text[e])):
+                continue
+            j = e + 2 if text.startswith('**', e) and text.startswith('**', s - 2) else e
+            k = j
+            while k < len(text) and text[k].isspace():
+                k += 1
+            if k >= len(text) or text[k] != '(':
+                continue
+            close = text.find(')', k + 1)
+            if close == -1:
+                continue
+            name, new_team = self.corrections[self._names[pid]]
+            applied.append(f"Corrected {name}: {text[k + 1:close].strip()} → {new_team}")
+            out.append(text[pos:j])
+            out.append(f" ({new_team})")
+            pos = close + 1
+        out.append(text[pos:])
+        return ''.join(out), applied
@@ -2,20 +2,27 @@
 import uuid
 import json
 import logging
-import subprocess
 import os
 import re # Import the re module
 import time
+import queue
+import threading
+from typing import Optional
 from flask import Flask, request, jsonify, session, render_template, g # Import g for application context
-from flask import Response # Import Response for exporting rules
+from flask import Response, stream_with_context # Import Response for exporting rules
 from flask_login import current_user
+from flask_socketio import emit
 
-from config import HOST, PORT, LOG_LEVEL
+from config import HOST, PORT, LOG_LEVEL, ROSTER_REFRESH_ENABLED, MODEL_WARMUP
 from fantacalcio_assistant import FantacalcioAssistant
 from corrections_manager import CorrectionsManager
 # Assuming LeagueRulesManager is in a separate file named league_rules_manager.py
 from league_rules_manager import LeagueRulesManager
-from rate_limiter import RateLimiter
+from rate_limiter import get_rate_limiter
+from text_rewriter import exclusion_matcher
+from roster_refresh import start_roster_refresh
+from model_registry import model_stats, warmup_models_async
+from session_store import get_state_store
 from static_transfers import get_team_arrivals, is_static_mode_enabled, get_transfer_stats
 
 # New enhancements
@@ -27,7 +34,7 @@ from match_tracker_enhanced import get_match_tracker
 import league_chat  # Auto-registers SocketIO handlers
 
 # Import authentication components
-from app import app, db
+from app import app, db, socketio
 from models import User, UserLeague
 from replit_auth import require_login, require_pro
 
@@ -49,8 +56,12 @@ except ImportError as e:
 except Exception as e:
     LOG.error(f"Error importing routes: {e}")
 
-# Initialize rate limiter (10 requests per hour for deployed app)
-rate_limiter = RateLimiter(max_requests=10, time_window=3600)
+if MODEL_WARMUP:
+    # Embedding model loaded + dummy encode at startup, off the request path
+    warmup_models_async()
+
+# Rate limiter condiviso (limiti per route/tier in subscription_tiers, contatori in Redis se disponibile)
+rate_limiter = get_rate_limiter()
 
 # ---------- Singletons ----------
 # Global singleton to prevent re-initialization
@@ -65,6 +76,9 @@ def get_assistant():
         try:
             _global_assistant = FantacalcioAssistant()
             LOG.info("FantacalcioAssistant initialized successfully")
+            if ROSTER_REFRESH_ENABLED:
+                # ETL + hot-swap of season_roster.json in background (was: one ETL process per chat message)
+                start_roster_refresh(get_assistant)
         except Exception as e:
             LOG.error(f"Failed to initialize FantacalcioAssistant: {e}")
             # Create a minimal fallback assistant
@@ -106,11 +120,17 @@ def get_sid() -> str:
     return sid
 
 def get_state() -> dict:
-    st = session.get("state")
-    return st if isinstance(st, dict) else {}
+    """Chat state of this session, from the server-side store (the cookie only holds the sid)."""
+    sid = get_sid()
+    legacy = session.pop("state", None)
+    if isinstance(legacy, dict):
+        # Migrate state from older signed-cookie sessions
+        get_state_store().set(sid, legacy)
+        return legacy
+    return get_state_store().get(sid)
 
 def set_state(st: dict) -> None:
-    session["state"] = st
+    get_state_store().set(get_sid(), st or {})
 
 T = {
     "it": {
@@ -166,56 +186,13 @@ def index_legacy():
         </html>
         """, 500
 
-@app.route("/api/chat", methods=["POST"])
-@cached_redis(ttl=0, key_prefix="")  # No caching for chat (real-time)
-def api_chat():
-    try:
-        # Log client info for debugging
-        client_ip = rate_limiter._get_client_key(request)
-        LOG.info(f"Chat request from client: {client_ip}")
-
-        # Check rate limit first
-        if not rate_limiter.is_allowed(request):
-            remaining_requests = rate_limiter.get_remaining_requests(request)
-            reset_time = rate_limiter.get_reset_time(request)
-
-            LOG.warning(f"Rate limit exceeded for client {client_ip}: {remaining_requests} remaining, reset at {reset_time}")
-
-            return jsonify({
-                "error": "Rate limit exceeded",
-                "message": "Hai superato il limite di 10 richieste per ora. Riprova più tardi.",
-                "remaining_requests": remaining_requests,
-                "reset_time": reset_time,
-                "client_id": client_ip[:8] + "..." if len(client_ip) > 8 else client_ip  # Partial IP for debugging
-            }), 429
-
-        data = request.get_json(force=True, silent=True) or {}
-        msg  = (data.get("message") or "").strip()
-        mode = (data.get("mode") or "classic").strip()
-
-        LOG.info("Request data: %s", data)
-    except Exception as e:
-        LOG.error(f"Error processing request: {e}")
-        return jsonify({"response": "❌ Errore nell'elaborazione della richiesta. Riprova."}), 500
-
-    # Best-effort: avvia ETL senza bloccare (skip in deployment if issues)
-    try:
-        import os
-        if os.path.exists("etl_build_roster.py"):
-            subprocess.Popen(["python", "etl_build_roster.py"],
-                           stdout=subprocess.DEVNULL,
-                           stderr=subprocess.DEVNULL)
-            LOG.info("[ETL] Job di refresh lanciato")
-        else:
-            LOG.info("[ETL] ETL script non trovato, skip")
-    except Exception as e2:
-        LOG.warning("[ETL] impossibile avviare ETL: %s", e2)
+def _run_chat_turn(msg: str, mode: str, state: dict, on_token=None):
+    """Process one chat message (commands, corrections, assistant reply, post-filters).
 
-    if not msg:
-        return jsonify({"response": "Scrivi un messaggio."})
-
-    get_sid()
-    state = get_state()
+    Returns ``(payload, new_state)``; ``on_token`` receives the reply while it
+    is generated (used by the streaming endpoints), one line at a time and only
+    after the same exclusion/correction filters applied to the final reply.
+    """
     assistant = get_assistant()
     corrections_manager = get_corrections_manager()
 
@@ -276,8 +253,7 @@ def api_chat():
                     state["excluded_players"] = session_exclusions
                     LOG.info(f"[Web] Added to session exclusions (fallback): {exclusion_key}")
 
-            set_state(state)
-            return jsonify({"response": response, "state": state})
+            return {"response": response, "state": state}, state
 
     # Check for corrections
     correction_response = handle_correction(msg, assistant) # Pass assistant instead of corrections_manager
@@ -291,8 +267,7 @@ def api_chat():
             "role": "assistant",
             "content": correction_response
         })
-        set_state(state)
-        return jsonify({"response": correction_response})
+        return {"response": correction_response}, state
 
     # Get relevant corrections for context
     relevant_corrections = corrections_manager.get_relevant_corrections(msg, limit=5)
@@ -350,12 +325,16 @@ def api_chat():
         LOG.info(f"Updated exclusions cache with session data")
 
 
+    stream = _StreamFilter(on_token, state.get("excluded_players", []), assistant) if on_token else None
     try:
-        reply, new_state = assistant.respond(msg, mode=mode, state=state, context_messages=context_messages)
+        reply, new_state = assistant.respond(msg, mode=mode, state=state, context_messages=context_messages,
+                                             on_token=stream)
     except Exception as e:
         LOG.error("Error in assistant.respond: %s", e, exc_info=True)
         reply = f"⚠️ Errore temporaneo del servizio. Messaggio: {msg[:50]}... - Riprova tra poco."
         new_state = state
+    if stream is not None:
+        stream.flush()
 
     # Apply exclusions to response text
     reply = apply_exclusions_to_text(reply, new_state.get("excluded_players", []))
@@ -368,21 +347,7 @@ def api_chat():
             reply = corrected_response
 
         # Additional validation: remove mentions of non-Serie A teams
-        non_serie_a_patterns = [
-            r'\b(Newcastle|PSG|Paris Saint-Germain|Al Hilal|Tottenham|Arsenal|Manchester United|Manchester City|Chelsea|Liverpool|Real Madrid|Barcelona|Atletico Madrid|Bayern Munich|Borussia Dortmund)\b',
-            r'\(Newcastle\)',
-            r'\(PSG\)',
-            r'\(Al Hilal\)',
-            r'\(Tottenham\)',
-            r'\(Premier League\)',
-            r'\(La Liga\)',
-            r'\(Bundesliga\)',
-            r'\(Ligue 1\)'
-        ]
-
-        import re
-        for pattern in non_serie_a_patterns:
-            reply = re.sub(pattern, '', reply, flags=re.IGNORECASE)
+        reply = _scrub_non_serie_a(reply)
 
         # Clean up multiple spaces and empty lines
         reply = re.sub(r'\s+', ' ', reply)
@@ -406,21 +371,133 @@ def api_chat():
             new_state["conversation_history"].append({"role": "user", "content": msg, "timestamp": time.time()})
             new_state["conversation_history"].append({"role": "assistant", "content": reply, "timestamp": time.time()})
 
+    return {"response": reply}, new_state
+
+@app.route("/api/chat", methods=["POST"])
+@cached_redis(ttl=0, key_prefix="")  # No caching for chat (real-time)
+def api_chat():
+    try:
+        # Log client info for debugging
+        client_ip = rate_limiter._get_client_key(request)
+        LOG.info(f"Chat request from client: {client_ip}")
+
+        # Check rate limit first (before any LLM work)
+        limit = rate_limiter.check(request, "chat")
+        if not limit.allowed:
+            LOG.warning(f"Rate limit exceeded for client {client_ip}: reset at {limit.reset_time}")
+
+            return jsonify({
+                "error": "Rate limit exceeded",
+                "message": rate_limiter.limit_message(limit),
+                "remaining_requests": limit.remaining,
+                "reset_time": limit.reset_time,
+                "client_id": client_ip[:8] + "..." if len(client_ip) > 8 else client_ip  # Partial IP for debugging
+            }), 429, {"Retry-After": str(limit.retry_after)}
+
+        data = request.get_json(force=True, silent=True) or {}
+        msg  = (data.get("message") or "").strip()
+        mode = (data.get("mode") or "classic").strip()
+
+        LOG.info("Request data: %s", data)
+    except Exception as e:
+        LOG.error(f"Error processing request: {e}")
+        return jsonify({"response": "❌ Errore nell'elaborazione della richiesta. Riprova."}), 500
 
+
+    if not msg:
+        return jsonify({"response": "Scrivi un messaggio."})
+
+    get_sid()
+    payload, new_state = _run_chat_turn(msg, mode, get_state())
     set_state(new_state)
 
     # Add rate limit info to response
-    response = jsonify({"response": reply})
-    remaining = rate_limiter.get_remaining_requests(request)
-    response.headers['X-RateLimit-Remaining'] = str(remaining)
-    response.headers['X-RateLimit-Limit'] = str(rate_limiter.max_requests)
-
-    reset_time = rate_limiter.get_reset_time(request)
-    if reset_time:
-        response.headers['X-RateLimit-Reset'] = str(reset_time)
+    response = jsonify(payload)
+    if limit.limit is not None:
+        response.headers['X-RateLimit-Remaining'] = str(limit.remaining)
+        response.headers['X-RateLimit-Limit'] = str(limit.limit)
+        response.headers['X-RateLimit-Reset'] = str(limit.reset_time)
 
     return response
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route("/api/chat/stream", methods=["POST"])
+def api_chat_stream():
+    """Same as /api/chat, streamed as server-sent events.
+
+    Emits ``token`` events with LLM deltas while the reply is generated and a
+    final ``done`` event with the filtered/corrected reply (clients should
+    replace the streamed text with it).
+    """
+    limit = rate_limiter.check(request, "chat")
+    if not limit.allowed:
+        return jsonify({
+            "error": "Rate limit exceeded",
+            "message": rate_limiter.limit_message(limit),
+            "reset_time": limit.reset_time
+        }), 429, {"Retry-After": str(limit.retry_after)}
+
+    data = request.get_json(force=True, silent=True) or {}
+    msg = (data.get("message") or "").strip()
+    mode = (data.get("mode") or "classic").strip()
+    if not msg:
+        return jsonify({"response": "Scrivi un messaggio."})
+
+    get_sid()
+    state = get_state()
+    tokens: "queue.Queue[Optional[str]]" = queue.Queue()
+    result = {}
+
+    def worker():
+        try:
+            result["payload"], result["state"] = _run_chat_turn(msg, mode, state, on_token=tokens.put)
+        except Exception as e:
+            LOG.error("Error in streamed chat turn: %s", e, exc_info=True)
+            result["payload"] = {"response": "⚠️ Errore temporaneo del servizio. Riprova tra poco."}
+            result["state"] = state
+        finally:
+            tokens.put(None)
+
+    def generate():
+        threading.Thread(target=worker, daemon=True).start()
+        while True:
+            token = tokens.get()
+            if token is None:
+                break
+            yield _sse("token", {"token": token})
+        # Headers are already sent, but the state is stored server-side under the sid
+        set_state(result["state"])
+        yield _sse("done", result["payload"])
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@socketio.on('chat_message')
+def ws_chat_message(data):
+    """Socket.IO chat: emits ``chat_token`` per LLM delta, then ``chat_done``."""
+    data = data or {}
+    msg = (data.get("message") or "").strip()
+    mode = (data.get("mode") or "classic").strip()
+    if not msg:
+        emit('chat_done', {"response": "Scrivi un messaggio."})
+        return
+    limit = rate_limiter.check(request, "chat")
+    if not limit.allowed:
+        emit('chat_error', {"error": "Rate limit exceeded", "message": rate_limiter.limit_message(limit),
+                            "retry_after": limit.retry_after})
+        return
+
+    try:
+        payload, new_state = _run_chat_turn(msg, mode, get_state(),
+                                            on_token=lambda token: emit('chat_token', {"token": token}))
+        set_state(new_state)
+    except Exception as e:
+        LOG.error("Error in Socket.IO chat turn: %s", e, exc_info=True)
+        payload = {"response": "⚠️ Errore temporaneo del servizio. Riprova tra poco."}
+    emit('chat_done', payload)
+
 def handle_exclusion(msg: str, state: dict) -> str:
     """Handle player exclusions (rimuovi/escludi commands)"""
     msg_lower = msg.lower()
@@ -525,111 +602,86 @@ def handle_exclusion(msg: str, state: dict) -> str:
 
     return ""
 
-def apply_exclusions_to_text(text: str, excluded_players: list) -> str:
-    """Remove excluded players from response text, considering team-specific exclusions"""
-    # Get persistent exclusions from corrections manager
+def _all_exclusions(excluded_players: list) -> frozenset:
+    """Session exclusions plus the persistent ones from the corrections manager"""
     try:
         corrections_manager = get_corrections_manager()
         persistent_excluded = corrections_manager.get_excluded_players()
-        all_excluded = list(set(excluded_players + persistent_excluded))
         LOG.info(f"Applying exclusions: session={excluded_players}, persistent={persistent_excluded}")
     except Exception as e:
         LOG.error(f"Error getting persistent exclusions: {e}")
-        all_excluded = excluded_players
+        persistent_excluded = []
+    return frozenset(e for e in list(excluded_players) + list(persistent_excluded) if e)
 
+def apply_exclusions_to_text(text: str, excluded_players: list) -> str:
+    """Remove excluded players from response text, considering team-specific exclusions"""
+    all_excluded = _all_exclusions(excluded_players)
     if not all_excluded:
         return text
 
-    lines = text.split('\n')
-    filtered_lines = []
-
-    for line in lines:
-        # Skip lines that contain excluded players
-        should_exclude = False
-        line_lower = line.lower()
-
-        # Extract team from line if possible (format: **Player** (Team))
-        team_in_line = None
-        import re
-        team_match = re.search(r'\*\*[^*]+\*\*\s*\(([^)]+)\)', line)
-        if team_match:
-            team_in_line = team_match.group(1).strip()
-
-        for excluded in all_excluded:
-            excluded_lower = excluded.lower().strip()
-
-            # Handle special characters by creating multiple search variants
-            import unicodedata
-
-            # Normalize the excluded name to handle accented characters
-            excluded_normalized = unicodedata.normalize('NFD', excluded_lower)
-            excluded_normalized = ''.join(c for c in excluded_normalized if unicodedata.category(c) != 'Mn')
-
-            # Create search patterns for the player name
-            search_patterns = [
-                excluded_lower,
-                excluded_normalized,
-                excluded_lower.replace('ć', 'c').replace('č', 'c').replace('ž', 'z').replace('š', 's'),
-                excluded_lower.replace('ovic', 'ović').replace('ovic', 'ovič')
-            ]
-
-            # Remove duplicates
-            search_patterns = list(set(search_patterns))
-
-            for pattern in search_patterns:
-                if not pattern or len(pattern) < 3:
-                    continue
-
-                # Enhanced pattern matching for better exclusion
-                # Pattern 1: Look for the name in **bold** format (most common in responses)
-                bold_pattern = rf'\*\*[^*]*{re.escape(pattern)}[^*]*\*\*'
-                if re.search(bold_pattern, line_lower, re.IGNORECASE):
-                    should_exclude = True
-                    LOG.info(f"Excluding line with bold player '{excluded}' (pattern: {pattern}): {line.strip()}")
-                    break
-
-                # Pattern 2: Look for exact name matches in list items (e.g., "1. **Name** →")
-                list_pattern = rf'\d+\.\s*\*\*[^*]*{re.escape(pattern)}[^*]*\*\*'
-                if re.search(list_pattern, line_lower, re.IGNORECASE):
-                    should_exclude = True
-                    LOG.info(f"Excluding numbered list item with '{excluded}' (pattern: {pattern}): {line.strip()}")
-                    break
-
-                # Pattern 3: Check if main parts of the name appear
-                pattern_parts = [part for part in pattern.split() if len(part) > 2]
-                if pattern_parts:
-                    # For names with multiple parts, check if most parts match
-                    parts_found = sum(1 for part in pattern_parts if part in line_lower)
-                    if len(pattern_parts) > 1 and parts_found >= len(pattern_parts):
-                        should_exclude = True
-                        LOG.info(f"Excluding line containing all name parts from '{excluded}' (pattern: {pattern}): {line.strip()}")
-                        break
-                    elif len(pattern_parts) == 1 and parts_found > 0 and len(pattern_parts[0]) > 4:
-                        # For single long names, be more strict
-                        should_exclude = True
-                        LOG.info(f"Excluding line containing single name part from '{excluded}' (pattern: {pattern}): {line.strip()}")
-                        break
-
-                # Pattern 4: Direct substring match for substantial names (stricter)
-                if len(pattern) > 6 and pattern in line_lower:
-                    should_exclude = True
-                    LOG.info(f"Excluding line containing '{excluded}' (pattern: {pattern}): {line.strip()}")
-                    break
-
-            if should_exclude:
-                break
-
-        if not should_exclude:
-            filtered_lines.append(line)
-
-    result = '\n'.join(filtered_lines)
+    # One compiled multi-pattern pass over the reply (matcher cached per exclusion set)
+    result, removed = exclusion_matcher(all_excluded).filter_text(text)
 
     # Log the filtering result
-    if len(filtered_lines) < len(lines):
-        LOG.info(f"Filtered out {len(lines) - len(filtered_lines)} lines containing excluded players")
+    if removed:
+        LOG.info(f"Filtered out {removed} lines containing excluded players")
 
     return result
 
+# Squadre/campionati esteri da non mostrare nelle risposte
+_NON_SERIE_A_RE = re.compile(
+    r'\b(Newcastle|PSG|Paris Saint-Germain|Al Hilal|Tottenham|Arsenal|Manchester United|Manchester City|Chelsea|Liverpool|Real Madrid|Barcelona|Atletico Madrid|Bayern Munich|Borussia Dortmund)\b'
+    r'|\(Newcastle\)|\(PSG\)|\(Al Hilal\)|\(Tottenham\)'
+    r'|\(Premier League\)|\(La Liga\)|\(Bundesliga\)|\(Ligue 1\)',
+    re.IGNORECASE)
+
+def _scrub_non_serie_a(text: str) -> str:
+    return _NON_SERIE_A_RE.sub('', text)
+
+class _StreamFilter:
+    """``on_token`` wrapper for streamed replies.
+
+    Tokens are buffered until a line is complete; the line is then passed
+    through the exclusion matcher, the team corrections, the roster check
+    (lines naming players no longer in Serie A are held back) and the
+    non-Serie-A scrub before reaching the client.  The final ``done`` reply
+    still replaces the streamed text.
+    """
+
+    def __init__(self, on_token, excluded_players: list, assistant):
+        self.on_token = on_token
+        self.assistant = assistant
+        all_excluded = _all_exclusions(excluded_players)
+        self.matcher = exclusion_matcher(all_excluded) if all_excluded else None
+        self.corrections_manager = get_corrections_manager()
+        self.buffer = ""
+
+    def __call__(self, token: str) -> None:
+        self.buffer += token
+        if "\n" not in self.buffer:
+            return
+        complete, self.buffer = self.buffer.rsplit("\n", 1)
+        self._emit(complete + "\n")
+
+    def flush(self) -> None:
+        if self.buffer:
+            text, self.buffer = self.buffer, ""
+            self._emit(text)
+
+    def _emit(self, text: str) -> None:
+        try:
+            if self.matcher is not None:
+                text, _ = self.matcher.filter_text(text)
+            text, _ = self.corrections_manager.apply_corrections_to_text(text)
+            text = "".join(line for line in text.splitlines(keepends=True)
+                           if not self.assistant._contains_invalid_players(line))
+            text = _scrub_non_serie_a(text)
+        except Exception as e:
+            LOG.error("Error filtering streamed reply, holding it back: %s", e)
+            return
+        if text:
+            self.on_token(text)
+
 def handle_correction(user_message: str, fantacalcio_assistant) -> str:
     """Handle comprehensive user corrections and apply them permanently"""
     message_lower = user_message.lower().strip()
@@ -1485,7 +1537,8 @@ def health_check():
         return jsonify({
             "status": "healthy",
             "timestamp": time.time(),
-            "deployment": os.getenv("REPLIT_DEPLOYMENT", "unknown")
+            "deployment": os.getenv("REPLIT_DEPLOYMENT", "unknown"),
+            "models": model_stats()
         })
     except Exception as e:
         return jsonify({
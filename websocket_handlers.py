@@ -19,6 +19,9 @@ def register_websocket_handlers(socketio):
     @socketio.on('disconnect')
     def handle_disconnect():
         logger.info("Client disconnected from WebSocket")
+        from flask import request
+        from league_chat import forget_connection
+        forget_connection(request.sid)
 
     @socketio.on('join_statistics')
     def handle_join_statistics():